@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import numpy as np
 from itertools import zip_longest
+from collections import Counter
 from operator import mul as multiply
 from functools import reduce
 from math import log
@@ -33,9 +34,7 @@ def table(seq):
 
     :rtype: dict
     """
-    seq = [x for x in seq]
-    keys = set(seq)
-    return dict([(k, seq.count(k)) for k in keys])
+    return dict(Counter(seq))
 
 def mode(seq):
     """ 
@@ -1,7 +1,11 @@
 import numpy as np
 cimport numpy as np
 cimport cython
-from libc.stdint cimport int32_t, uint32_t
+from libc.stdint cimport int32_t, uint32_t, uint8_t, uint64_t
+from libc.string cimport memset
+
+cdef extern from *:
+    int popcount64 "__builtin_popcountll" (unsigned long long)
 
 cpdef ibs(g1,g2, missingval=None):
     '''
@@ -212,6 +216,284 @@ cpdef bint is_sorted(sequence):
 
     return True
 
+# Dense genotypes can be any of these integer types
+ctypedef fused allele_t:
+    np.uint8_t
+    np.int8_t
+    np.int16_t
+    np.int32_t
+    np.int64_t
+
+
+def dense_ibs(a, b, c, d, np.int64_t missingcode=0, uint8_t missingval=64,
+              out=None, bint runs=False):
+    """
+    Evaluates IBS between two individuals with dense integer genotypes in a
+    single pass, with the same rules as pydigree.ibs.chromwide_ibs
+
+    :param a: first chromatid of individual 1
+    :param b: second chromatid of individual 1
+    :param c: first chromatid of individual 2
+    :param d: second chromatid of individual 2
+    :param missingcode: the allele code for missing data
+    :param missingval: IBS state for missing genotypes
+    :param out: array to write the states to
+    :param runs: also return the runs of identical state
+    :type a: numpy array
+    :type out: numpy array of type uint8
+
+    :returns: IBS states, and if runs is set the start index of each run
+        and its state (as in sparse_ibs_runs)
+    :rtype: numpy array of type uint8, or a tuple of numpy arrays
+    """
+    cdef Py_ssize_t nmark = a.shape[0]
+    if not (b.shape[0] == c.shape[0] == d.shape[0] == nmark):
+        raise ValueError('Genotypes are different sizes')
+
+    if out is None:
+        out = np.empty(nmark, dtype=np.uint8)
+    elif out.shape[0] != nmark:
+        raise ValueError('Output array is the wrong size')
+    cdef uint8_t[:] states = out
+
+    # Dispatched by hand instead of with a fused def function, since
+    # those can't take const memoryviews (needed for read-only arrays)
+    dtype = a.dtype
+    if dtype == np.uint8:
+        _dense_ibs[np.uint8_t](a, b, c, d, missingcode, missingval, states)
+    elif dtype == np.int8:
+        _dense_ibs[np.int8_t](a, b, c, d, missingcode, missingval, states)
+    elif dtype == np.int16:
+        _dense_ibs[np.int16_t](a, b, c, d, missingcode, missingval, states)
+    elif dtype == np.int32:
+        _dense_ibs[np.int32_t](a, b, c, d, missingcode, missingval, states)
+    elif dtype == np.int64:
+        _dense_ibs[np.int64_t](a, b, c, d, missingcode, missingval, states)
+    else:
+        raise TypeError('Unsupported allele type: {}'.format(dtype))
+
+    if runs:
+        return (out,) + state_runs(states)
+    return out
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _dense_ibs(const allele_t[:] a, const allele_t[:] b,
+                     const allele_t[:] c, const allele_t[:] d,
+                     np.int64_t missingcode, uint8_t missingval,
+                     uint8_t[:] states):
+    cdef Py_ssize_t i
+    cdef allele_t va, vb, vc, vd
+    cdef uint8_t ac, ad, bc, bd
+    for i in range(a.shape[0]):
+        va, vb, vc, vd = a[i], b[i], c[i], d[i]
+        # Computed without branching, since the states change too often
+        # for branches to be predicted well
+        ac, ad, bc, bd = va == vc, va == vd, vb == vc, vb == vd
+        states[i] = (ac | ad | bc | bd) + ((ac & bd) | (ad & bc))
+        if va == missingcode or vc == missingcode:
+            states[i] = missingval
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def state_runs(const uint8_t[:] states):
+    """
+    Compresses a sequence of IBS states into runs of identical state
+
+    :param states: IBS states
+    :type states: numpy array of type uint8
+
+    :returns: the start index of each run and its state
+    :rtype: tuple of numpy arrays (dtypes: np.uint32, np.uint8)
+    """
+    cdef Py_ssize_t n = states.shape[0]
+    cdef Py_ssize_t i, j, nruns = 1 if n else 0
+    for i in range(1, n):
+        if states[i] != states[i - 1]:
+            nruns += 1
+
+    starts = np.empty(nruns, dtype=np.uint32)
+    values = np.empty(nruns, dtype=np.uint8)
+    cdef uint32_t[:] s = starts
+    cdef uint8_t[:] v = values
+    j = 0
+    for i in range(n):
+        if i == 0 or states[i] != states[i - 1]:
+            s[j] = i
+            v[j] = states[i]
+            j += 1
+    return starts, values
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def runs_gte_from_runs(const uint32_t[:] starts, const uint8_t[:] values,
+                       Py_ssize_t nmark, uint8_t minval, 
+                       Py_ssize_t minlength=1):
+    """
+    Finds the same intervals as runs_gte_uint8 on the sequence the runs 
+    were made from, but only visits each run instead of each value
+
+    :param starts: start index of each run
+    :param values: value of each run
+    :param nmark: length of the original sequence
+    :param minval: smallest value in an interval
+    :param minlength: shortest allowable interval (as in runs_gte_uint8)
+
+    :returns: intervals, as (start, stop inclusive) tuples
+    :rtype: list of tuples
+    """
+    cdef Py_ssize_t i, n = starts.shape[0]
+    cdef Py_ssize_t start = 0, stop
+    cdef bint inrun = False
+    out = []
+    for i in range(n):
+        if values[i] >= minval:
+            if not inrun:
+                inrun = True
+                start = starts[i]
+        elif inrun:
+            inrun = False
+            stop = starts[i] - 1
+            if stop - start >= minlength:
+                out.append((start, stop))
+    if inrun and (nmark - 1 - start) >= minlength:
+        out.append((start, nmark - 1))
+    return out
+
+
+# Packed genotypes hold 32 two-bit alleles per uint64 word, with 0 for a 
+# missing allele. The helpers below give one bit per allele, in the low 
+# bit of its two-bit lane.
+DEF LANES = 32
+cdef uint64_t LOW_BITS = 0x5555555555555555ULL
+
+
+cdef inline uint64_t packed_eq(uint64_t x, uint64_t y):
+    cdef uint64_t diff = x ^ y
+    return ~(diff | (diff >> 1)) & LOW_BITS
+
+
+cdef inline uint64_t packed_missing(uint64_t x):
+    return ~(x | (x >> 1)) & LOW_BITS
+
+
+cdef inline void packed_ibs_word(uint64_t a, uint64_t b, uint64_t c, 
+                                 uint64_t d, uint64_t* ibs1, uint64_t* ibs2,
+                                 uint64_t* missing):
+    cdef uint64_t ac = packed_eq(a, c)
+    cdef uint64_t ad = packed_eq(a, d)
+    cdef uint64_t bc = packed_eq(b, c)
+    cdef uint64_t bd = packed_eq(b, d)
+    ibs1[0] = ac | ad | bc | bd
+    ibs2[0] = (ac & bd) | (ad & bc)
+    # As with dense genotypes, only the first chromatid of each
+    # individual is checked for missingness
+    missing[0] = packed_missing(a) | packed_missing(c)
+
+
+cdef inline uint64_t tail_mask(Py_ssize_t nmark):
+    cdef Py_ssize_t rem = nmark % LANES
+    if rem == 0:
+        return LOW_BITS
+    return LOW_BITS & ((1ULL << (2 * rem)) - 1)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def packed_ibs(uint64_t[:] a, uint64_t[:] b, uint64_t[:] c, uint64_t[:] d,
+               Py_ssize_t nmark, uint8_t missingval=64, out=None):
+    """
+    Evaluates IBS between two individuals with 2-bit packed genotypes, 
+    32 markers at a time
+
+    :param a: first chromatid of individual 1
+    :param b: second chromatid of individual 1
+    :param c: first chromatid of individual 2
+    :param d: second chromatid of individual 2
+    :param nmark: number of markers
+    :param missingval: IBS state for missing genotypes
+    :param out: array to write the states to
+    :type a: numpy array of type uint64
+    :type out: numpy array of type uint8
+
+    :returns: IBS states
+    :rtype: numpy array of type uint8
+    """
+    cdef Py_ssize_t nwords = (nmark + LANES - 1) // LANES
+    if not (a.shape[0] == b.shape[0] == c.shape[0] == d.shape[0] == nwords):
+        raise ValueError('Packed genotypes are different sizes')
+
+    if out is None:
+        out = np.empty(nmark, dtype=np.uint8)
+    elif out.shape[0] != nmark:
+        raise ValueError('Output array is the wrong size')
+    cdef uint8_t[:] states = out
+
+    cdef Py_ssize_t w, lane, pos, nlanes
+    cdef uint64_t ibs1, ibs2, missing, bit
+    for w in range(nwords):
+        packed_ibs_word(a[w], b[w], c[w], d[w], &ibs1, &ibs2, &missing)
+        pos = w * LANES
+        nlanes = min(LANES, nmark - pos)
+
+        if nlanes == LANES and not missing and ibs2 == LOW_BITS:
+            memset(&states[pos], 2, LANES)
+            continue
+
+        for lane in range(nlanes):
+            bit = 1ULL << (2 * lane)
+            if missing & bit:
+                states[pos + lane] = missingval
+            elif ibs2 & bit:
+                states[pos + lane] = 2
+            elif ibs1 & bit:
+                states[pos + lane] = 1
+            else:
+                states[pos + lane] = 0
+    return out
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def packed_ibs_counts(uint64_t[:] a, uint64_t[:] b, uint64_t[:] c, 
+                      uint64_t[:] d, Py_ssize_t nmark):
+    """
+    Counts the markers in each IBS state between two individuals with 2-bit
+    packed genotypes
+
+    :param a: first chromatid of individual 1
+    :param b: second chromatid of individual 1
+    :param c: first chromatid of individual 2
+    :param d: second chromatid of individual 2
+    :param nmark: number of markers
+    :type a: numpy array of type uint64
+
+    :returns: number of markers with IBS 0, 1, 2 and missing genotypes
+    :rtype: tuple of ints
+    """
+    cdef Py_ssize_t nwords = (nmark + LANES - 1) // LANES
+    if not (a.shape[0] == b.shape[0] == c.shape[0] == d.shape[0] == nwords):
+        raise ValueError('Packed genotypes are different sizes')
+
+    cdef Py_ssize_t w
+    cdef uint64_t ibs1, ibs2, missing, valid
+    cdef Py_ssize_t n1 = 0, n2 = 0, nmiss = 0
+    for w in range(nwords):
+        packed_ibs_word(a[w], b[w], c[w], d[w], &ibs1, &ibs2, &missing)
+        valid = LOW_BITS if w < nwords - 1 else tail_mask(nmark)
+        missing &= valid
+        ibs2 &= valid & ~missing
+        ibs1 &= valid & ~missing & ~ibs2
+        nmiss += popcount64(missing)
+        n2 += popcount64(ibs2)
+        n1 += popcount64(ibs1)
+
+    return nmark - n1 - n2 - nmiss, n1, n2, nmiss
+
+
 cdef class Segment:
     cdef object ind1, ind2, chromosome
     cdef public int32_t start, stop
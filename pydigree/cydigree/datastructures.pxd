@@ -35,8 +35,32 @@ cdef struct IntTreeNode:
     sparse_val value 
     int8_t height
 
+cdef struct NodeSlab:
+    NodeSlab* following
+    IntTreeNode* nodes
+    Py_ssize_t used
+    Py_ssize_t capacity
+
+cdef struct NodePool:
+    NodeSlab* slabs
+    IntTreeNode* free_nodes
+
+cdef IntTreeNode* pool_alloc(NodePool* pool) except NULL
+cdef void pool_free(NodePool* pool, IntTreeNode* node)
+cdef void pool_reset(NodePool* pool)
+
+cdef void pool_adopt(NodePool* pool, NodePool* other)
+
+cdef class NodeArena:
+    cdef NodePool pool
+    cdef Py_ssize_t ntrees
+
 cdef class IntTree(object):
     cdef IntTreeNode* root
+    cdef NodeArena arena
+    cdef NodePool* pool
+    cdef void share_arena(self, NodeArena arena)
+    cdef bint owns_pool(self)
     cpdef bint empty(self)
     cpdef bint verify(self)
     cpdef void clear(self)
@@ -49,7 +73,12 @@ cdef class IntTree(object):
     cpdef void delete(self, sparse_key key, bint silent=*)
     cdef void del2child(self, IntTreeNode* node)
     cpdef void delrange(self, sparse_key start, sparse_key end)
+    cdef void drop_subtree(self, IntTreeNode* node, bint whole_tree)
+    cpdef void splice(self, sparse_key start, sparse_key end, IntTree source, sparse_key offset=*) except *
     cpdef IntTree getrange(self, sparse_key start, sparse_key end)
+    cdef IntTree copy_range(self, sparse_key start, sparse_key end, sparse_key shift)
+    cpdef IntTree split(self, sparse_key key)
+    cpdef void join(self, IntTree other) except *
     cpdef IntTree intersection(self, IntTree other)
     cpdef IntTree union(self, IntTree other)
 
@@ -57,20 +86,30 @@ cdef bint node_verify(IntTreeNode* node)
 cdef int8_t node_balance(IntTreeNode* node)
 cdef void update_node_height(IntTreeNode* node)
 
-cdef void deltree(IntTreeNode* start)
+cdef void deltree(NodePool* pool, IntTreeNode* start)
+
+cdef IntTreeNode* join_nodes(IntTreeNode* left, IntTreeNode* mid, IntTreeNode* right)
+cdef IntTreeNode* join_trees(IntTreeNode* left, IntTreeNode* right)
+cdef void split_tree(IntTreeNode* node, sparse_key key, IntTreeNode** left, IntTreeNode** right)
+cdef IntTreeNode* build_balanced(NodePool* pool, sparse_key* keys, sparse_val* values, Py_ssize_t start, Py_ssize_t stop) except? NULL
+cdef Py_ssize_t range_to_arrays(IntTreeNode* node, sparse_key start, sparse_key end, sparse_key* keys, sparse_val* values, Py_ssize_t i, sparse_key shift)
+cdef void fill_range(IntTreeNode* node, sparse_key start, sparse_key end, sparse_val* out)
+cdef Py_ssize_t tree_to_arrays(IntTreeNode* node, sparse_key* keys, sparse_val* values, Py_ssize_t i, sparse_key offset)
 
 cdef void rotate_right(IntTreeNode* root, IntTreeNode* parent)
 cdef void rotate_left(IntTreeNode* root, IntTreeNode* parent)
 cdef void rotate_double_left(IntTreeNode* root, IntTreeNode* parent)
 cdef void rotate_double_right(IntTreeNode* root, IntTreeNode* parent)
 
-cdef struct NodeStackItem:
-    IntTreeNode* node
-    NodeStackItem* following
+cdef enum:
+    NODESTACK_INLINE = 64
 
 cdef class NodeStack(object):
-    cdef NodeStackItem* front
-    cdef void push(self, IntTreeNode* node)
+    cdef IntTreeNode** items
+    cdef IntTreeNode* inline_items[NODESTACK_INLINE]
+    cdef Py_ssize_t n
+    cdef Py_ssize_t capacity
+    cdef void push(self, IntTreeNode* node) except *
     cdef IntTreeNode* peek(self)
     cdef IntTreeNode* pop(self)
     cdef bint empty(self)
@@ -1,11 +1,14 @@
 from collections import Sequence
 from libc.stdint cimport uint32_t, uint8_t, int8_t
 from libc.stdio cimport printf
-from cpython.mem cimport PyMem_Malloc, PyMem_Free
+from libc.string cimport memcpy
+from cpython.mem cimport PyMem_Malloc, PyMem_Realloc, PyMem_Free
 
 import numpy as np
 
 DEF MAX_HEIGHT=30
+DEF MIN_SLAB_NODES=64
+DEF MAX_SLAB_NODES=65536
 
 cdef inline bint sparse_val_compare(sparse_val a, sparse_val b, int op):
     # <   0
@@ -38,6 +41,11 @@ cdef class SparseArray:
     def __len__(self):
         return self.size
 
+    def __reduce__(self):
+        keys, values = tree_to_numpy(self.container)
+        return (unpickle_sparsearray, 
+                (self.size, self.refcode, keys.tobytes(), values.tobytes()))
+
     def copy(self):
         cdef SparseArray output = SparseArray.from_items(self.items(), 
                                                          self.size, 
@@ -87,12 +95,7 @@ cdef class SparseArray:
         cdef sparse_key stop = index.stop 
 
         cdef SparseArray subarray = SparseArray(stop - start, self.refcode)
-        subarray.container = self.container.getrange(start, stop)
-        cdef NodeStack ns = subarray.container.to_stack()
-        cdef IntTreeNode* node = ns.pop()
-        while node:
-            node.key = node.key - start 
-            node = ns.pop()
+        subarray.container = self.container.copy_range(start, stop, start)
         return subarray
 
     cdef _get_fancyidx(self, index):
@@ -164,14 +167,14 @@ cdef class SparseArray:
     cdef void _set_slice_to_sparray(self, sparse_key start, sparse_key stop, SparseArray values):
         if stop - start != values.size:
             raise IndexError('Value wrong shape for slice')
-        
-        toclear = [idx for idx in self.keys() if start <= idx <= stop]
-        for idx in toclear:
-            self.container.delete(idx)
 
-        # TODO: Make efficient instead of using python traversal
-        for k, v in values.items():
-            self.container.insert(k + start, v)
+        if values.refcode != self.refcode:
+            # The sparse sites in values aren't sparse here, so every 
+            # site has to be written out
+            self._set_slice(start, stop, values.tolist())
+            return
+
+        self.container.splice(start, stop, values.container, start)
 
     cdef void _set_boolidx(self, indices, values):
         cdef list trueidxs = [i for i,x in enumerate(indices) if x]
@@ -233,10 +236,10 @@ cdef class SparseArray:
         cdef IntTreeNode* selfnode = selfstack.pop()
         cdef IntTreeNode* othernode = otherstack.pop()
 
-        cdef SparseArray output = SparseArray(self.size, self.refcode == other.refcode)
-        while selfnode != NULL and othernode != NULL:
+        cdef SparseArray output = SparseArray(self.size, sparse_val_compare(self.refcode, other.refcode, op))
+        while selfnode != NULL or othernode != NULL:
             
-            if othernode == NULL or selfnode.key < othernode.key:
+            if othernode == NULL or (selfnode != NULL and selfnode.key < othernode.key):
                 output.set_item(selfnode.key, sparse_val_compare(selfnode.value, other.refcode, op))
                 selfnode = selfstack.pop()
             elif selfnode == NULL or selfnode.key > othernode.key:
@@ -353,50 +356,294 @@ cdef class SparseArray:
         for k, v in zip(self.container.keys(), self.container.values()):
             yield k,v
 
+    def keys_array(self):
+        '''
+        Gets the non-sparse locations without making Python objects
+
+        :rtype: numpy array of type uint32
+        '''
+        return tree_to_numpy(self.container)[0]
+
+    def values_array(self):
+        '''
+        Gets the non-sparse values without making Python objects
+
+        :rtype: numpy array of type int8
+        '''
+        return tree_to_numpy(self.container)[1]
+
+    def to_numpy(self, out=None, sparse_key start=0, stop=None):
+        '''
+        Writes the values in a region into a dense numpy array
+
+        :param out: array to fill, such as a row of a genotype matrix. 
+            Must have stop - start elements. A new array is made if None.
+        :param start: start of the region (inclusive)
+        :param stop: end of the region (exclusive), defaults to the end
+        :type out: numpy array of type int8
+
+        :returns: the filled array
+        :rtype: numpy array of type int8
+        '''
+        cdef sparse_key end = self.size if stop is None else stop
+        if not start <= end <= self.size:
+            raise IndexError('Region out of bounds')
+        if out is None:
+            out = np.empty(end - start, dtype=np.int8)
+        elif len(out) != end - start:
+            raise ValueError('Output array is the wrong size')
+
+        cdef sparse_val[:] buf = out
+        buf[:] = self.refcode
+        if end > start:
+            fill_range(self.container.root, start, end, &buf[0])
+        return out
+
 ############
 ############
 
-cdef IntTreeNode* new_node(sparse_key key, sparse_val value):
-    cdef IntTreeNode* node = <IntTreeNode*>PyMem_Malloc(sizeof(IntTreeNode))
-    if not node:
-        raise MemoryError("Couldnt alloc memory for node")
+def unpickle_sparsearray(sparse_key size, refcode, bytes keys, bytes values):
+    "Rebuilds a pickled SparseArray"
+    cdef SparseArray output = SparseArray(size, refcode)
+    output.container = unpickle_inttree(keys, values)
+    return output
+
+def unpickle_inttree(bytes keys, bytes values):
+    "Rebuilds a pickled IntTree"
+    return IntTree.from_arrays(np.frombuffer(keys, dtype=np.uint32), 
+                               np.frombuffer(values, dtype=np.int8))
+
+cdef IntTree sorted_unique_tree(sparse_key[:] keys, sparse_val[:] values):
+    "Builds a tree from keys that are already sorted and unique"
+    cdef IntTree tree = IntTree()
+    if keys.shape[0]:
+        tree.root = build_balanced(tree.pool, &keys[0], &values[0], 
+                                   0, keys.shape[0])
+    return tree
+
+cdef IntTree sorted_tree(keys, values):
+    # Sorts keys, keeping the last value given for each, then builds
+    if keys.shape[0] and (keys.min() < 0 or keys.max() > 0xFFFFFFFF):
+        raise OverflowError('Key out of range')
+    if values.shape[0] and (values.min() < -128 or values.max() > 127):
+        raise OverflowError('Value out of range')
+
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    values = values[order]
+
+    last = np.ones(keys.shape[0], dtype=np.bool_)
+    last[:-1] = keys[1:] != keys[:-1]
+    return sorted_unique_tree(keys[last].astype(np.uint32), 
+                              values[last].astype(np.int8))
+
+cdef tuple tree_to_numpy(IntTree tree):
+    "Copies the keys and values of a tree into numpy arrays, in order"
+    cdef Py_ssize_t n = tree.size()
+    keys = np.empty(n, dtype=np.uint32)
+    values = np.empty(n, dtype=np.int8)
+    cdef sparse_key[:] kbuf = keys
+    cdef sparse_val[:] vbuf = values
+
+    if n:
+        tree_to_arrays(tree.root, &kbuf[0], &vbuf[0], 0, 0)
+    return keys, values
+
+############
+############
+
+# Node allocation
+#
+# Each tree owns a pool of nodes, carved out of slabs that double in size 
+# as the tree grows. Deleted nodes go on a free list for reuse, and the 
+# slabs are only returned to the system when the tree is cleared, which 
+# frees the whole tree without visiting each node. Trees made by 
+# IntTree.split share the pool of the tree they came from, since their 
+# nodes live in its slabs.
+cdef IntTreeNode* pool_alloc(NodePool* pool) except NULL:
+    cdef IntTreeNode* node
+    cdef NodeSlab* slab
+    cdef Py_ssize_t capacity
+
+    if pool.free_nodes != NULL:
+        node = pool.free_nodes
+        pool.free_nodes = node.left
+        return node
+
+    slab = pool.slabs
+    if slab == NULL or slab.used == slab.capacity:
+        if slab == NULL:
+            capacity = MIN_SLAB_NODES 
+        else:
+            capacity = min(2 * slab.capacity, MAX_SLAB_NODES)
+        
+        slab = <NodeSlab*>PyMem_Malloc(sizeof(NodeSlab) + 
+                                       capacity * sizeof(IntTreeNode))
+        if not slab:
+            raise MemoryError("Couldnt alloc memory for node")
+
+        slab.nodes = <IntTreeNode*>(<char*>slab + sizeof(NodeSlab))
+        slab.used = 0
+        slab.capacity = capacity
+        slab.following = pool.slabs
+        pool.slabs = slab
+
+    node = &slab.nodes[slab.used]
+    slab.used += 1
+    return node
+
+cdef void pool_free(NodePool* pool, IntTreeNode* node):
+    # Free nodes are chained through their left pointer
+    node.left = pool.free_nodes
+    pool.free_nodes = node
+
+cdef void pool_reset(NodePool* pool):
+    cdef NodeSlab* slab = pool.slabs
+    cdef NodeSlab* following
+
+    while slab != NULL:
+        following = slab.following
+        PyMem_Free(slab)
+        slab = following
+
+    pool.slabs = NULL
+    pool.free_nodes = NULL
+
+cdef IntTreeNode* new_node(NodePool* pool, sparse_key key, sparse_val value) except NULL:
+    cdef IntTreeNode* node = pool_alloc(pool)
 
     node.key = key
     node.value = value
     node.left = NULL
     node.right = NULL
-    node.height = 0
+    node.height = 1
 
     return node
 
-cdef void del_node(IntTreeNode* node):
-    PyMem_Free(node)
+cdef void del_node(NodePool* pool, IntTreeNode* node):
+    pool_free(pool, node)
+
+cdef void pool_adopt(NodePool* pool, NodePool* other):
+    "Takes ownership of every slab and free node in other, emptying it"
+    cdef NodeSlab* slab = other.slabs
+    cdef IntTreeNode* node = other.free_nodes
+
+    if slab != NULL:
+        while slab.following != NULL:
+            slab = slab.following
+        slab.following = pool.slabs
+        pool.slabs = other.slabs
+
+    if node != NULL:
+        while node.left != NULL:
+            node = node.left
+        node.left = pool.free_nodes
+        pool.free_nodes = other.free_nodes
+
+    other.slabs = NULL
+    other.free_nodes = NULL
+
+
+cdef class NodeArena:
+    "Holds a NodePool, which may be shared by several trees"
+    def __cinit__(self):
+        self.pool.slabs = NULL
+        self.pool.free_nodes = NULL
+        self.ntrees = 0
+
+    def __dealloc__(self):
+        pool_reset(&self.pool)
 
 ############
 ############
 
 cdef class IntTree(object):
-    def __init__(self):
+    def __cinit__(self):
         self.root = NULL
+        self.arena = NodeArena()
+        self.arena.ntrees = 1
+        self.pool = &self.arena.pool
 
     def __dealloc__(self):
-        self.clear()
+        # The slabs are freed with the arena. If another tree still uses
+        # them, hand this tree's nodes back for reuse
+        if self.arena.ntrees > 1:
+            deltree(self.pool, self.root)
+        self.arena.ntrees -= 1
+
+    cdef void share_arena(self, NodeArena arena):
+        # Only for trees with no nodes of their own
+        self.arena.ntrees -= 1
+        self.arena = arena
+        self.arena.ntrees += 1
+        self.pool = &arena.pool
+
+    cdef bint owns_pool(self):
+        return self.arena.ntrees == 1
+
+    def __reduce__(self):
+        # Pickled as two contiguous buffers, which are rebuilt into a 
+        # balanced tree without any rotations
+        keys, values = tree_to_numpy(self)
+        return (unpickle_inttree, (keys.tobytes(), values.tobytes()))
+
+    @staticmethod
+    def from_arrays(keys, values):
+        '''
+        Builds a balanced tree from sorted keys and their values in O(n)
+
+        :param keys: strictly increasing keys
+        :param values: values for each key
+        :type keys: sequence of uint32_t
+        :type values: sequence of int8_t
+
+        :rtype: IntTree
+        '''
+        cdef const sparse_key[:] kbuf = np.ascontiguousarray(keys, dtype=np.uint32)
+        cdef const sparse_val[:] vbuf = np.ascontiguousarray(values, dtype=np.int8)
+        cdef Py_ssize_t n = kbuf.shape[0]
+        cdef Py_ssize_t i
+        cdef IntTree tree = IntTree()
+
+        if vbuf.shape[0] != n:
+            raise ValueError('Keys and values are different lengths')
+        for i in range(1, n):
+            if kbuf[i] <= kbuf[i-1]:
+                raise ValueError('Keys are not strictly increasing')
+
+        if n:
+            tree.root = build_balanced(tree.pool, <sparse_key*>&kbuf[0], 
+                                       <sparse_val*>&vbuf[0], 0, n)
+        return tree
 
     @staticmethod
     def from_keys(keys):
-        tree = IntTree()
-        for key in keys:
-            tree.insert(key)
+        '''
+        Builds a tree from keys in any order, with all values 0
 
-        return tree
+        :param keys: keys to include. Duplicates are ignored.
+        :type keys: iterable of uint32_t
+
+        :rtype: IntTree
+        '''
+        keys = np.fromiter(keys, dtype=np.int64)
+        return sorted_tree(keys, np.zeros(keys.shape[0], dtype=np.int8))
 
     @staticmethod
     def from_pairs(pairs):
-        tree = IntTree()
-        for key, value in pairs:
-            tree.insert(key, value)
+        '''
+        Builds a tree from (key, value) pairs in any order
 
-        return tree
+        :param pairs: items to include. If a key appears more than once
+            the last value is kept.
+        :type pairs: iterable of (uint32_t, int8_t)
+
+        :rtype: IntTree
+        '''
+        pairs = list(pairs)
+        keys = np.array([k for k, v in pairs], dtype=np.int64)
+        values = np.array([v for k, v in pairs], dtype=np.int64)
+        return sorted_tree(keys, values)
 
     def __contains__(self, sparse_key key):
         node = self.root
@@ -427,9 +674,7 @@ cdef class IntTree(object):
 
     cpdef void clear(self):
         'Removes all nodes from tree'
-        if not self.root:
-            return 
-        deltree(self.root)
+        self.drop_subtree(self.root, True)
         self.root = NULL
 
     def traverse(self):
@@ -547,7 +792,7 @@ cdef class IntTree(object):
         raise KeyError('Node not found')
 
     cpdef void insert(self, sparse_key key, sparse_val value=0):
-        cdef IntTreeNode* inserted = new_node(key, value)
+        cdef IntTreeNode* inserted = new_node(self.pool, key, value)
         if self.empty():
             self.root = inserted
             return
@@ -579,7 +824,7 @@ cdef class IntTree(object):
             else:
                 cur_node.value = value
                 # We don't need to rebalance if the key was already in the tree
-                del_node(inserted)
+                del_node(self.pool, inserted)
                 return 
 
         stack[depth] = inserted
@@ -645,6 +890,7 @@ cdef class IntTree(object):
         else:
             if not silent:
                 raise KeyError('Node not found') 
+            return
         
         cdef IntTreeNode* parent = stack[depth - 1] if depth > 0 else NULL
 
@@ -656,7 +902,7 @@ cdef class IntTree(object):
             else:
                 parent.left = NULL
 
-            del_node(node)
+            del_node(self.pool, node)
 
         elif node.right == NULL: # 1 Child on left
             if not parent: # node is the root
@@ -666,7 +912,7 @@ cdef class IntTree(object):
             else:
                 parent.left = node.left
 
-            del_node(node)
+            del_node(self.pool, node)
 
         elif node.left == NULL: # 1 Child on right
             if not parent:
@@ -677,7 +923,7 @@ cdef class IntTree(object):
                 parent.left = node.right
 
  
-            del_node(node)
+            del_node(self.pool, node)
 
         else:
             self.del2child(node)
@@ -708,98 +954,226 @@ cdef class IntTree(object):
 
     cpdef void delrange(self, sparse_key start, sparse_key end):
         'Deletes keys where start <= key < stop'
-        cdef NodeStack delstack = NodeStack()
-        cdef NodeStack s = NodeStack()
-        cdef IntTreeNode* node = self.root
-
-        while (not s.empty()) or (node != NULL):
-            if node != NULL:
-                s.push(node)
-                node = node.left
-            else:
-                node = s.pop()
-                if start <= node.key < end:
-                    delstack.push(node)
-                elif node.key >= end:
-                    break 
-                node = node.right
-
-        cdef IntTreeNode* delnode = delstack.pop() 
-        while delnode:
-            self.delete(delnode.key)
-            delnode = delstack.pop()
-
+        cdef IntTreeNode* left
+        cdef IntTreeNode* middle
+        cdef IntTreeNode* right
+
+        split_tree(self.root, start, &left, &right)
+        split_tree(right, end, &middle, &right)
+        self.drop_subtree(middle, left == NULL and right == NULL)
+        self.root = join_trees(left, right)
+
+    cdef void drop_subtree(self, IntTreeNode* node, bint whole_tree):
+        # If the subtree was all of the tree, every node in the pool can 
+        # be released at once
+        if whole_tree and self.owns_pool():
+            pool_reset(self.pool)
+        else:
+            deltree(self.pool, node)
+
+    cpdef void splice(self, sparse_key start, sparse_key end, IntTree source, sparse_key offset=0) except *:
+        '''
+        Replaces the keys where start <= key < end with the keys in source,
+        shifted by offset. Runs in O(log n + k) for k keys in source.
+
+        :param start: start of the region (inclusive)
+        :param end: end of the region (exclusive)
+        :param source: tree with the replacement keys
+        :param offset: value added to each key in source
+        :type start: uint32_t
+        :type end: uint32_t
+        :type source: IntTree
+        :type offset: uint32_t
+        '''
+        cdef Py_ssize_t n = source.size()
+        cdef sparse_key* keys = <sparse_key*>PyMem_Malloc(n * sizeof(sparse_key) + 1)
+        cdef sparse_val* values = <sparse_val*>PyMem_Malloc(n * sizeof(sparse_val) + 1)
+        if not keys or not values:
+            PyMem_Free(keys)
+            PyMem_Free(values)
+            raise MemoryError("Couldnt alloc memory for splice")
+
+        tree_to_arrays(source.root, keys, values, 0, offset)
+
+        if n and not (start <= keys[0] and keys[n-1] < end):
+            PyMem_Free(keys)
+            PyMem_Free(values)
+            raise IndexError('Spliced keys fall outside of region')
+
+        cdef IntTreeNode* left
+        cdef IntTreeNode* middle
+        cdef IntTreeNode* right
+
+        split_tree(self.root, start, &left, &right)
+        split_tree(right, end, &middle, &right)
+        self.drop_subtree(middle, left == NULL and right == NULL)
+
+        try:
+            middle = build_balanced(self.pool, keys, values, 0, n)
+        finally:
+            PyMem_Free(keys)
+            PyMem_Free(values)
+
+        self.root = join_trees(join_trees(left, middle), right)
 
     cpdef IntTree getrange(self, sparse_key start, sparse_key end):
+        '''
+        Copies the keys where start <= key < end into a new tree.
+        Runs in O(log n + k) for k keys in the range.
+
+        :rtype: IntTree
+        '''
+        return self.copy_range(start, end, 0)
+
+    cdef IntTree copy_range(self, sparse_key start, sparse_key end, sparse_key shift):
+        # Like getrange, but subtracts shift from each key
+        cdef Py_ssize_t n = range_to_arrays(self.root, start, end, NULL, NULL, 0, 0)
+        keys = np.empty(n, dtype=np.uint32)
+        values = np.empty(n, dtype=np.int8)
+        cdef sparse_key[:] kbuf = keys
+        cdef sparse_val[:] vbuf = values
         cdef IntTree ntree = IntTree()
-        cdef NodeStack s = NodeStack()
-        cdef IntTreeNode* node = self.root
-
-        while (not s.empty()) or (node != NULL):
-            if node:
-                s.push(node)
-                node = node.left
-            else:
-                node = s.pop()
-                if start <= node.key < end:
-                    ntree.insert(node.key, node.value)
-                elif node.key >= end:
-                    break 
-                node = node.right
 
+        if n:
+            range_to_arrays(self.root, start, end, &kbuf[0], &vbuf[0], 0, shift)
+            ntree.root = build_balanced(ntree.pool, &kbuf[0], &vbuf[0], 0, n)
         return ntree
 
-    cpdef IntTree intersection(self, IntTree other):
-        cdef NodeStack t1 = self.to_stack()
-        cdef NodeStack t2 = other.to_stack()
+    cpdef IntTree split(self, sparse_key key):
+        '''
+        Removes the keys greater than or equal to key and returns them as a
+        new tree, in O(log n). The new tree shares nodes with this one.
+
+        :param key: the first key to move
+        :type key: uint32_t
+
+        :rtype: IntTree
+        '''
+        cdef IntTree upper = IntTree()
+        cdef IntTreeNode* left
+        cdef IntTreeNode* right
+
+        upper.share_arena(self.arena)
+        split_tree(self.root, key, &left, &right)
+        self.root = left
+        upper.root = right
+        return upper
+
+    cpdef void join(self, IntTree other) except *:
+        '''
+        Moves all keys of other onto the end of this tree, leaving other 
+        empty. Every key in other must be greater than every key in this 
+        tree. Runs in O(log n) if other was made by split from this tree, 
+        or doesn't share its nodes with any other tree. 
+
+        :param other: the tree to append
+        :type other: IntTree
+        '''
+        cdef IntTreeNode* last = self.root
+        cdef IntTreeNode* first = other.root
+        cdef IntTreeNode* moved
+        cdef sparse_key[:] kbuf
+        cdef sparse_val[:] vbuf
+
+        if other is self or first == NULL:
+            return
 
-        cdef IntTreeNode* a = t1.pop()
-        cdef IntTreeNode* b = t2.pop()
+        while last != NULL and last.right != NULL:
+            last = last.right
+        while first.left != NULL:
+            first = first.left
+        if last != NULL and first.key <= last.key:
+            raise ValueError('Keys overlap')
+
+        if other.arena is self.arena:
+            moved = other.root
+        elif other.owns_pool():
+            pool_adopt(self.pool, other.pool)
+            moved = other.root
+        else:
+            # Other's nodes belong to a pool that's still in use, so they 
+            # have to be copied into this one
+            keys, values = tree_to_numpy(other)
+            kbuf = keys
+            vbuf = values
+            moved = build_balanced(self.pool, &kbuf[0], &vbuf[0], 0, kbuf.shape[0])
+            other.clear()
 
-        cdef IntTree ntree = IntTree()
-        
-        while a != NULL and b != NULL:
-            if a.key == b.key:
-                ntree.insert(a.key)
-                a, b = t1.pop(), t2.pop()
-            elif a.key < b.key:
-                a = t1.pop()
+        other.root = NULL
+        self.root = join_trees(self.root, moved)
+
+    cpdef IntTree intersection(self, IntTree other):
+        '''
+        Returns a tree of the keys in both trees, with the values from this
+        one. Runs in O(n + m).
+
+        :rtype: IntTree
+        '''
+        keys_a, values_a = tree_to_numpy(self)
+        keys_b, values_b = tree_to_numpy(other)
+        cdef sparse_key[:] ka = keys_a
+        cdef sparse_key[:] kb = keys_b
+        cdef sparse_val[:] va = values_a
+        cdef Py_ssize_t na = ka.shape[0], nb = kb.shape[0]
+        cdef Py_ssize_t i = 0, j = 0, n = 0
+
+        keys = np.empty(min(na, nb), dtype=np.uint32)
+        values = np.empty(min(na, nb), dtype=np.int8)
+        cdef sparse_key[:] kout = keys
+        cdef sparse_val[:] vout = values
+
+        while i < na and j < nb:
+            if ka[i] == kb[j]:
+                kout[n] = ka[i]
+                vout[n] = va[i]
+                n += 1
+                i += 1
+                j += 1
+            elif ka[i] < kb[j]:
+                i += 1
             else:
-                b = t2.pop()
+                j += 1
 
-        return ntree
+        return sorted_unique_tree(kout[:n], vout[:n])
 
     cpdef IntTree union(self, IntTree other):
-        cdef NodeStack t1 = self.to_stack()
-        cdef NodeStack t2 = other.to_stack()
-
-        cdef IntTreeNode* a = t1.pop()
-        cdef IntTreeNode* b = t2.pop()
-
-        cdef IntTree ntree = IntTree()
-
-        while a != NULL or b != NULL:
-            if a == NULL:
-                ntree.insert(b.key)
-                b = t2.pop()
-
-            elif b == NULL:
-                ntree.insert(a.key)
-                a = t1.pop()
-
-            elif a.key == b.key:
-                ntree.insert(a.key)
-                a, b = t1.pop(), t2.pop()
-
-            elif a.key < b.key:
-                ntree.insert(a.key)
-                a = t1.pop()
-
+        '''
+        Returns a tree of the keys in either tree. Values come from this
+        tree where the key is in both. Runs in O(n + m).
+
+        :rtype: IntTree
+        '''
+        keys_a, values_a = tree_to_numpy(self)
+        keys_b, values_b = tree_to_numpy(other)
+        cdef sparse_key[:] ka = keys_a
+        cdef sparse_key[:] kb = keys_b
+        cdef sparse_val[:] va = values_a
+        cdef sparse_val[:] vb = values_b
+        cdef Py_ssize_t na = ka.shape[0], nb = kb.shape[0]
+        cdef Py_ssize_t i = 0, j = 0, n = 0
+
+        keys = np.empty(na + nb, dtype=np.uint32)
+        values = np.empty(na + nb, dtype=np.int8)
+        cdef sparse_key[:] kout = keys
+        cdef sparse_val[:] vout = values
+
+        while i < na or j < nb:
+            if j == nb or (i < na and ka[i] < kb[j]):
+                kout[n] = ka[i]
+                vout[n] = va[i]
+                i += 1
+            elif i == na or kb[j] < ka[i]:
+                kout[n] = kb[j]
+                vout[n] = vb[j]
+                j += 1
             else:
-                ntree.insert(b.key)
-                b = t2.pop()
+                kout[n] = ka[i]
+                vout[n] = va[i]
+                i += 1
+                j += 1
+            n += 1
 
-        return ntree
+        return sorted_unique_tree(kout[:n], vout[:n])
 
 # Node manipulation functions
 cdef bint node_verify(IntTreeNode* node):
@@ -826,7 +1200,7 @@ cdef void update_node_height(IntTreeNode* node):
         node.height = max(lheight, rheight) + 1
 
 
-cdef void deltree(IntTreeNode* node):
+cdef void deltree(NodePool* pool, IntTreeNode* node):
     """
     Recursively deletes all nodes in tree a node's subtree. Faster than 
     deleting each node individually because it does not have to rebalance the 
@@ -836,13 +1210,164 @@ cdef void deltree(IntTreeNode* node):
         return
 
     # Traverse in post-order removing nodes
-    # TODO: rewrite in iterative style
-    deltree(node.left)
-    deltree(node.right)
+    deltree(pool, node.left)
+    deltree(pool, node.right)
 
     node.left = NULL
     node.right = NULL
-    del_node(node)
+    del_node(pool, node)
+
+# Split and join operations
+#
+# These work on bare subtrees and return the root of the result. The AVL 
+# invariant holds for every tree they produce, so they can be composed to
+# cut out or paste in whole ranges of keys without per-key rebalancing.
+cdef inline uint8_t node_height(IntTreeNode* node):
+    return node.height if node != NULL else 0
+
+cdef IntTreeNode* pivot_left(IntTreeNode* node):
+    cdef IntTreeNode* pivot = node.right
+    rotate_left(node, NULL)
+    return pivot
+
+cdef IntTreeNode* pivot_right(IntTreeNode* node):
+    cdef IntTreeNode* pivot = node.left
+    rotate_right(node, NULL)
+    return pivot
+
+cdef IntTreeNode* rebalance_subtree(IntTreeNode* node):
+    cdef int8_t balance = node_balance(node)
+    if balance > 1:
+        if node_balance(node.right) < 0:
+            node.right = pivot_right(node.right)
+        return pivot_left(node)
+    elif balance < -1:
+        if node_balance(node.left) > 0:
+            node.left = pivot_left(node.left)
+        return pivot_right(node)
+    return node
+
+cdef IntTreeNode* join_nodes(IntTreeNode* left, IntTreeNode* mid, IntTreeNode* right):
+    """
+    Joins two trees with a node whose key falls between them. All keys in 
+    left must be less than mid.key, and all keys in right greater. Takes 
+    time proportional to the difference in height of the two trees.
+    """
+    cdef uint8_t lh = node_height(left)
+    cdef uint8_t rh = node_height(right)
+
+    if lh > rh + 1:
+        left.right = join_nodes(left.right, mid, right)
+        update_node_height(left)
+        return rebalance_subtree(left)
+
+    elif rh > lh + 1:
+        right.left = join_nodes(left, mid, right.left)
+        update_node_height(right)
+        return rebalance_subtree(right)
+
+    mid.left = left
+    mid.right = right
+    update_node_height(mid)
+    return mid
+
+cdef IntTreeNode* remove_last(IntTreeNode* node, IntTreeNode** last):
+    if node.right == NULL:
+        last[0] = node
+        return node.left
+
+    node.right = remove_last(node.right, last)
+    update_node_height(node)
+    return rebalance_subtree(node)
+
+cdef IntTreeNode* join_trees(IntTreeNode* left, IntTreeNode* right):
+    "Joins two trees where every key in left is less than every key in right"
+    if left == NULL:
+        return right
+    if right == NULL:
+        return left
+
+    cdef IntTreeNode* mid = NULL
+    left = remove_last(left, &mid)
+    return join_nodes(left, mid, right)
+
+cdef void split_tree(IntTreeNode* node, sparse_key key, IntTreeNode** left, IntTreeNode** right):
+    "Splits a tree into the keys less than key and the keys greater or equal"
+    cdef IntTreeNode* l
+    cdef IntTreeNode* r
+
+    if node == NULL:
+        left[0] = NULL
+        right[0] = NULL
+        return
+
+    if key <= node.key:
+        split_tree(node.left, key, &l, &r)
+        left[0] = l
+        right[0] = join_nodes(r, node, node.right)
+    else:
+        split_tree(node.right, key, &l, &r)
+        left[0] = join_nodes(node.left, node, l)
+        right[0] = r
+
+cdef IntTreeNode* build_balanced(NodePool* pool, sparse_key* keys, sparse_val* values, Py_ssize_t start, Py_ssize_t stop) except? NULL:
+    "Builds a perfectly balanced tree from sorted keys in O(n)"
+    if start >= stop:
+        return NULL
+
+    cdef Py_ssize_t mid = start + (stop - start) // 2
+    cdef IntTreeNode* node = new_node(pool, keys[mid], values[mid])
+    node.left = build_balanced(pool, keys, values, start, mid)
+    node.right = build_balanced(pool, keys, values, mid + 1, stop)
+    update_node_height(node)
+    return node
+
+cdef Py_ssize_t range_to_arrays(IntTreeNode* node, sparse_key start, sparse_key end, sparse_key* keys, sparse_val* values, Py_ssize_t i, sparse_key shift):
+    """
+    Writes the keys (minus shift) and values where start <= key < end to 
+    arrays in order, starting at position i, skipping subtrees outside of 
+    the range. If keys is NULL, only counts them. Returns the position after
+    the last item.
+    """
+    if node == NULL:
+        return i
+
+    if node.key >= start:
+        i = range_to_arrays(node.left, start, end, keys, values, i, shift)
+    if start <= node.key < end:
+        if keys != NULL:
+            keys[i] = node.key - shift
+            values[i] = node.value
+        i += 1
+    if node.key < end:
+        i = range_to_arrays(node.right, start, end, keys, values, i, shift)
+    return i
+
+cdef void fill_range(IntTreeNode* node, sparse_key start, sparse_key end, sparse_val* out):
+    "Writes the values where start <= key < end to out[key - start]"
+    if node == NULL:
+        return
+
+    if node.key >= start:
+        fill_range(node.left, start, end, out)
+    if start <= node.key < end:
+        out[node.key - start] = node.value
+    if node.key < end:
+        fill_range(node.right, start, end, out)
+
+cdef Py_ssize_t tree_to_arrays(IntTreeNode* node, sparse_key* keys, sparse_val* values, Py_ssize_t i, sparse_key offset):
+    """
+    Writes the keys (plus offset) and values of a tree to arrays in order,
+    starting at position i. Returns the position after the last item written.
+    """
+    if node == NULL:
+        return i
+
+    i = tree_to_arrays(node.left, keys, values, i, offset)
+    keys[i] = node.key + offset
+    values[i] = node.value
+    return tree_to_arrays(node.right, keys, values, i + 1, offset)
+
 
 cdef void rotate_right(IntTreeNode* root, IntTreeNode* parent):
     cdef IntTreeNode* pivot = root.left
@@ -894,41 +1419,55 @@ cdef void rotate_double_right(IntTreeNode* root, IntTreeNode* parent):
 
 
 cdef class NodeStack:
+    # Items are kept in a plain array. Traversals never hold more than 
+    # the height of the tree, which fits in the inline storage, so only
+    # to_stack (which holds every node) ever has to go to the heap.
     def __cinit__(self):
-        self.front = NULL
+        self.items = self.inline_items
+        self.n = 0
+        self.capacity = NODESTACK_INLINE
 
-    cdef void push(self, IntTreeNode* node):
-        cdef NodeStackItem* item = <NodeStackItem*>PyMem_Malloc(sizeof(NodeStackItem))
-        
-        item.node = node
-        item.following = self.front
-        
-        self.front = item
+    def __dealloc__(self):
+        if self.items != self.inline_items:
+            PyMem_Free(self.items)
+
+    cdef void push(self, IntTreeNode* node) except *:
+        cdef IntTreeNode** grown
+        if self.n == self.capacity:
+            if self.items == self.inline_items:
+                grown = <IntTreeNode**>PyMem_Malloc(2 * self.capacity * sizeof(IntTreeNode*))
+                if grown:
+                    memcpy(grown, self.items, self.n * sizeof(IntTreeNode*))
+            else:
+                grown = <IntTreeNode**>PyMem_Realloc(self.items, 2 * self.capacity * sizeof(IntTreeNode*))
+            if not grown:
+                raise MemoryError("Couldnt alloc memory for stack")
+            self.items = grown
+            self.capacity *= 2
+
+        self.items[self.n] = node
+        self.n += 1
 
     cdef IntTreeNode* peek(self):
-        if self.front:
-            return self.front.node
+        if self.n:
+            return self.items[self.n - 1]
         else:
             return NULL
 
     cdef IntTreeNode* pop(self):
-        if not self.front:
+        if not self.n:
             return NULL
         
-        item = self.front 
-        self.front = item.following
-        
-        cdef IntTreeNode* node = item.node
-        PyMem_Free(item)
-        return node 
+        self.n -= 1
+        return self.items[self.n]
 
     cdef bint empty(self):
-        return self.front == NULL
+        return self.n == 0
 
 
 def print_sizes():
     print('IntTreeNode: {}'.format(sizeof(IntTreeNode)))
     print('IntTree: {}'.format(sizeof(IntTree)))
     print('SparseArray: {}'.format(sizeof(SparseArray)))
-    print('NodeStackItem: {}'.format(sizeof(NodeStackItem)))
+    print('NodeSlab: {}'.format(sizeof(NodeSlab)))
     print('NodeStack: {}'.format(sizeof(NodeStack)))
\ No newline at end of file
@@ -1,14 +1,37 @@
 from collections import Sequence
 
 from cython.operator cimport dereference as deref, preincrement as inc
+from cpython.buffer cimport PyBUF_WRITABLE
 
-from libc.stdint cimport uint32_t, int8_t
+from libc.stdint cimport uint32_t, int8_t, uint8_t
 from libcpp.map cimport map as stlmap
+from libcpp.set cimport set as stlset
+from libcpp.utility cimport pair
 from libcpp.vector cimport vector
 
+import numpy as np
+
 
 ctypedef uint32_t sparsekey
 ctypedef int8_t sparseval
+ctypedef pair[sparsekey, sparseval] sparseitem
+
+cdef class FrozenSparseArray
+
+cdef size_t search_keys(vector[sparsekey]& keys, sparsekey k):
+    "Binary search for the position of the first key >= k in a sorted vector"
+    cdef size_t lo = 0
+    cdef size_t hi = keys.size()
+    cdef size_t mid
+
+    while lo < hi:
+        mid = (lo + hi) >> 1
+        if keys[mid] < k:
+            lo = mid + 1
+        else:
+            hi = mid
+
+    return lo
 
 cdef bint sparseval_cmp(sparseval a, sparseval b, int op):
     """
@@ -46,6 +69,12 @@ cdef class SparseArray:
     For each non-sparse value, a uint32_t is used for the key (4 bytes), 
     int8_t (1 byte) for the value.
 
+    Negative values are how pydigree codes missing genotypes, so the 
+    positions of non-sparse negative values are also kept in a secondary 
+    index that is updated on every write. Missingness queries then only 
+    have to visit the missing sites. Because of this, data should not be 
+    modified except through the methods of the array.
+
     :ivar size: the size of the array
     :ivar ref: the sparse value
     :ivar data: the non-sparse positions values
@@ -55,6 +84,7 @@ cdef class SparseArray:
     """
 
     cdef public stlmap[sparsekey, sparseval] data
+    cdef stlset[sparsekey] missing_keys
     cdef public sparsekey size
     cdef public sparseval ref
 
@@ -65,6 +95,13 @@ cdef class SparseArray:
     def __len__(self):
         return self.size
 
+    def __reduce__(self):
+        # Pickled as a header and two contiguous buffers instead of 
+        # item by item
+        return (unpickle_sparsearray, 
+                (self.size, self.ref, 
+                 self.keys_array().tobytes(), self.values_array().tobytes()))
+
     def keys(self):
         """
         Gets the non-sparse locations
@@ -92,6 +129,70 @@ cdef class SparseArray:
         """
         return [(x.first, x.second) for x in self.data]
 
+    def keys_array(self):
+        """
+        Gets the non-sparse locations without making Python objects
+
+        :returns: locations of the non-sparse values
+        :rtype: numpy array of type uint32
+        """
+        out = np.empty(self.data.size(), dtype=np.uint32)
+        cdef uint32_t[:] buf = out
+        cdef size_t i = 0
+        cdef stlmap[sparsekey, sparseval].iterator it = self.data.begin()
+
+        while it != self.data.end():
+            buf[i] = deref(it).first
+            inc(i)
+            inc(it)
+
+        return out
+
+    def values_array(self):
+        """
+        Gets the non-sparse values without making Python objects
+
+        :returns: non-sparse values, in order
+        :rtype: numpy array of type int8
+        """
+        out = np.empty(self.data.size(), dtype=np.int8)
+        cdef int8_t[:] buf = out
+        cdef size_t i = 0
+        cdef stlmap[sparsekey, sparseval].iterator it = self.data.begin()
+
+        while it != self.data.end():
+            buf[i] = deref(it).second
+            inc(i)
+            inc(it)
+
+        return out
+
+    def to_numpy(self, out=None, sparsekey start=0, stop=None):
+        """
+        Writes the values in a region into a dense numpy array
+
+        :param out: array to fill, such as a row of a genotype matrix. 
+            Must have stop - start elements. A new array is made if None.
+        :param start: start of the region (inclusive)
+        :param stop: end of the region (exclusive), defaults to the end
+        :type out: numpy array of type int8
+
+        :returns: the filled array
+        :rtype: numpy array of type int8
+        """
+        cdef sparsekey end = self.size if stop is None else stop
+        out = dense_buffer(out, start, end, self.size)
+        cdef int8_t[:] buf = out
+        cdef stlmap[sparsekey, sparseval].iterator it = self.data.lower_bound(start)
+        cdef stlmap[sparsekey, sparseval].iterator last = self.data.lower_bound(end)
+
+        buf[:] = self.ref
+        while it != last:
+            buf[deref(it).first - start] = deref(it).second
+            inc(it)
+
+        return out
+
     cpdef bint any(self):
         """
         Are there any non-sparse values?
@@ -200,15 +301,19 @@ cdef class SparseArray:
         return out
 
     cpdef SparseArray get_slice(self, slice):
-        cdef int start = slice.start 
-        cdef int stop = slice.stop
+        cdef sparsekey start = slice.start 
+        cdef sparsekey stop = slice.stop
         cdef SparseArray out = SparseArray(stop - start, self.ref) 
 
-        for k, v in self.data:
-            if start <= k < stop:
-                out.set_item(k-start, v)
-            if k >= stop:
-                break
+        cdef stlmap[sparsekey, sparseval].iterator it = self.data.lower_bound(start)
+        cdef stlmap[sparsekey, sparseval].iterator last = self.data.lower_bound(stop)
+
+        # Keys come out in order, so each one is appended at the end of 
+        # the new map without searching it
+        while it != last:
+            out.append_item(deref(it).first - start, deref(it).second)
+            inc(it)
+
         return out 
 
 
@@ -227,20 +332,73 @@ cdef class SparseArray:
             self.set_item(index, value)
 
     cpdef void set_item(self, int k, int v):
+        cdef sparsekey key = k
         if v == self.ref:
-            self.clear(k)
+            self.clear(key)
         else:
-            self.data[k] = v
+            self.data[key] = v
+            if v < 0:
+                self.missing_keys.insert(key)
+            else:
+                self.missing_keys.erase(key)
+
+    cdef inline void insert_item(self, stlmap[sparsekey, sparseval].iterator hint, 
+                                 sparsekey k, sparseval v):
+        # Inserts a new non-sparse value next to hint
+        self.data.insert(hint, sparseitem(k, v))
+        if v < 0:
+            self.missing_keys.insert(k)
 
     cdef void set_slice_to_sparray(self, sparsekey start, sparsekey stop, SparseArray arr):
-        if arr.ref != self.ref:
-            self.set_slice(slice(start, stop), arr.ref)
-        
-        cdef sparsekey k
+        # set_slice has already emptied [start, stop), so everything we 
+        # insert belongs right before the first key past the span. Using that
+        # as a hint makes each insertion amortized constant time.
+        cdef stlmap[sparsekey, sparseval].iterator hint = self.data.lower_bound(stop)
+        cdef stlmap[sparsekey, sparseval].iterator it = arr.data.begin()
+        cdef sparsekey i
+        cdef sparseval v
+
+        if arr.ref == self.ref:
+            while it != arr.data.end():
+                self.insert_item(hint, start + deref(it).first, deref(it).second)
+                inc(it)
+            return
+
+        # The sparse value of arr isn't sparse here, so every site in the 
+        # span has to be visited
+        for i in range(stop - start):
+            if it != arr.data.end() and deref(it).first == i:
+                v = deref(it).second
+                inc(it)
+            else:
+                v = arr.ref
+
+            if v != self.ref:
+                self.insert_item(hint, start + i, v)
+
+    cdef void set_slice_to_frozen(self, sparsekey start, sparsekey stop, FrozenSparseArray arr):
+        # See set_slice_to_sparray
+        cdef stlmap[sparsekey, sparseval].iterator hint = self.data.lower_bound(stop)
+        cdef size_t j = 0
+        cdef size_t n = arr.dense_keys.size()
+        cdef sparsekey i
         cdef sparseval v
-        for k,v in arr.data:
-            self.set_item(start+k, v)
 
+        if arr.ref == self.ref:
+            for j in range(n):
+                self.insert_item(hint, start + arr.dense_keys[j], 
+                                 arr.dense_values[j])
+            return
+
+        for i in range(stop - start):
+            if j < n and arr.dense_keys[j] == i:
+                v = arr.dense_values[j]
+                inc(j)
+            else:
+                v = arr.ref
+
+            if v != self.ref:
+                self.insert_item(hint, start + i, v)
 
     cdef void set_slice(self, slice, object values):
         cdef sparsekey start = slice.start
@@ -252,6 +410,9 @@ cdef class SparseArray:
             self.set_slice_to_sparray(start, stop, values)
             return
 
+        elif isinstance(values, FrozenSparseArray):
+            self.set_slice_to_frozen(start, stop, values)
+            return
 
 
         cdef int nvals = 0
@@ -321,6 +482,7 @@ cdef class SparseArray:
         :type k: uint32_t
         """
         self.data.erase(k)
+        self.missing_keys.erase(k)
 
     cpdef void clear_range(self, sparsekey start, sparsekey stop):
         """
@@ -331,7 +493,9 @@ cdef class SparseArray:
         :type start: uint32_t
         :type stop: uint32_t
         """
-        self.data.erase(self.data.lower_bound(start), self.data.upper_bound(stop))
+        self.data.erase(self.data.lower_bound(start), self.data.lower_bound(stop))
+        self.missing_keys.erase(self.missing_keys.lower_bound(start), 
+                                self.missing_keys.lower_bound(stop))
 
     cpdef sparsekey ndense(self):
         """
@@ -368,17 +532,96 @@ cdef class SparseArray:
         :rtype: SparseArray
         """
         cdef SparseArray out = SparseArray(self.size, self.ref)
-        cdef sparsekey k 
-        cdef sparseval v 
+        out.data = self.data
+        out.missing_keys = self.missing_keys
+        return out
 
-        for k,v in self.data:
-            out.data[k] = v
+    cpdef sparsekey missing_count(self, sparsekey start, sparsekey stop):
+        """
+        Counts the missing (negative) values in a region
+
+        :param start: start of the region (inclusive)
+        :param stop: end of the region (exclusive)
+        :type start: uint32_t
+        :type stop: uint32_t
+
+        :returns: number of missing values
+        :rtype: uint32_t
+        """
+        cdef sparsekey n = 0
+        cdef stlset[sparsekey].iterator it = self.missing_keys.lower_bound(start)
+        cdef stlset[sparsekey].iterator last = self.missing_keys.lower_bound(stop)
+        cdef stlmap[sparsekey, sparseval].iterator dit, dlast
+
+        while it != last:
+            inc(n)
+            inc(it)
+
+        if self.ref < 0:
+            # Every sparse site is missing too
+            n += stop - start
+            dit = self.data.lower_bound(start)
+            dlast = self.data.lower_bound(stop)
+            while dit != dlast:
+                n -= 1
+                inc(dit)
+
+        return n
+
+    def missing_indices(self):
+        """
+        Gets the locations of missing (negative) values
+
+        :returns: sorted locations of missing values
+        :rtype: numpy array of type uint32
+        """
+        if self.ref < 0:
+            return np.flatnonzero(np.array(self.tolist()) < 0).astype(np.uint32)
+
+        out = np.empty(self.missing_keys.size(), dtype=np.uint32)
+        cdef uint32_t[:] buf = out
+        cdef stlset[sparsekey].iterator it = self.missing_keys.begin()
+        cdef size_t i = 0
+
+        while it != self.missing_keys.end():
+            buf[i] = deref(it)
+            inc(i)
+            inc(it)
+
+        return out
+
+    cpdef FrozenSparseArray freeze(self):
+        """
+        Creates an immutable, array-backed copy of the array. 
+
+        :returns: the frozen copy
+        :rtype: FrozenSparseArray
+        """
+        cdef FrozenSparseArray out = FrozenSparseArray(self.size, self.ref)
+        out.dense_keys.reserve(self.data.size())
+        out.dense_values.reserve(self.data.size())
+
+        cdef stlmap[sparsekey, sparseval].iterator it = self.data.begin()
+        while it != self.data.end():
+            out.dense_keys.push_back(deref(it).first)
+            out.dense_values.push_back(deref(it).second)
+            inc(it)
+
+        cdef stlset[sparsekey].iterator mit = self.missing_keys.begin()
+        out.missing_keys.reserve(self.missing_keys.size())
+        while mit != self.missing_keys.end():
+            out.missing_keys.push_back(deref(mit))
+            inc(mit)
+        out.missing_indexed = True
 
         return out
 
     def __richcmp__(self, other, int op):
        
-        if isinstance(other, SparseArray):  
+        if isinstance(other, FrozenSparseArray):
+            return self.freeze().richcmp(other, op)
+
+        elif isinstance(other, SparseArray):  
             if op == 2:
                 return self.sparse_eq(other)
             elif op == 3:
@@ -423,90 +666,851 @@ cdef class SparseArray:
         return out
 
             
+    cdef inline void append_item(self, sparsekey k, sparseval v):
+        # Adds a value past the current last key without searching the tree.
+        # Only for building arrays in key order.
+        if v != self.ref:
+            self.data.insert(self.data.end(), sparseitem(k, v))
+            if v < 0:
+                self.missing_keys.insert(self.missing_keys.end(), k)
+
     cpdef SparseArray sparse_eq(self, SparseArray other):
-        cdef SparseArray out = SparseArray(self.size, self.ref == other.ref)
+        return self.sparse_cmp(other, 2)
+
+    cpdef SparseArray sparse_cmp(self, SparseArray other, int op):
+        cdef SparseArray out = SparseArray(self.size, sparseval_cmp(self.ref, other.ref, op))
+
+        cdef stlmap[sparsekey, sparseval].iterator a = self.data.begin()
+        cdef stlmap[sparsekey, sparseval].iterator b = other.data.begin()
+
+        # Walk the two sets of keys together like the merge step of a 
+        # merge sort, so only the non-sparse sites of either are visited
+        while a != self.data.end() or b != other.data.end():
+            if b == other.data.end() or (a != self.data.end() and 
+                                         deref(a).first < deref(b).first):
+                out.append_item(deref(a).first, 
+                                sparseval_cmp(deref(a).second, other.ref, op))
+                inc(a)
+            elif a == self.data.end() or deref(b).first < deref(a).first:
+                out.append_item(deref(b).first, 
+                                sparseval_cmp(self.ref, deref(b).second, op))
+                inc(b)
+            else:
+                out.append_item(deref(a).first, 
+                                sparseval_cmp(deref(a).second, deref(b).second, op))
+                inc(a)
+                inc(b)
+
+        return out
+
+    cpdef SparseArray eq_single(self, sparseval val):
+        return self.cmp_single(val, 2)
+
+    cpdef SparseArray cmp_single(self, sparseval val, int op):
+        cdef SparseArray out = SparseArray(self.size, sparseval_cmp(self.ref, val, op))
+
+        cdef stlmap[sparsekey, sparseval].iterator it = self.data.begin()
+        while it != self.data.end():
+            out.append_item(deref(it).first, sparseval_cmp(deref(it).second, val, op))
+            inc(it)
+
+        return out
+
+    cpdef SparseArray logical_not(self):
+        """
+        Performs a logical not on the entire array
+
+        :returns: the not-ed array
+        """ 
+        cdef SparseArray out = SparseArray(self.size, not self.ref)
         
+        cdef stlmap[sparsekey, sparseval].iterator it = self.data.begin()
+        while it != self.data.end():
+            out.append_item(deref(it).first, not deref(it).second)
+            inc(it)
+        
+        return out
+
+
+    cpdef vector[sparseval] tolist(self):
+        """
+        Returns the SparseArray in a dense format
+        :rtype: list in python, C++ std::vector<uint8_t>
+        """
+        cdef vector[sparseval] out = vector[sparseval](self.size, self.ref)
         cdef sparsekey k
         cdef sparseval v
 
-        # This can definitely be done faster
         for k,v in self.data:
-            out.set_item(k, other.get_item(k) == v)
+            out[k] = v
+
+        return out
+
+
+cdef class FrozenSparseArray:
+    """
+    An immutable counterpart to SparseArray for read-mostly data. 
+
+    Non-sparse values are stored in two parallel, sorted arrays instead of 
+    a tree, so each non-sparse site costs exactly 5 bytes (a uint32_t key 
+    and an int8_t value) and lookups are binary searches over contiguous 
+    memory. Item assignment is not supported: use thaw() to get a mutable
+    SparseArray.
+
+    :ivar size: the size of the array
+    :ivar ref: the sparse value
+    :type size: uint32_t
+    :type ref: int8_t
+    """
+
+    cdef vector[sparsekey] dense_keys
+    cdef vector[sparseval] dense_values
+    cdef vector[sparsekey] missing_keys
+    cdef bint missing_indexed
+    cdef readonly sparsekey size
+    cdef readonly sparseval ref
+
+    def __cinit__(self, sparsekey array_size, sparseval refcode):
+        self.size = array_size
+        self.ref = refcode
+
+    def __len__(self):
+        return self.size
+
+    def __reduce__(self):
+        return (unpickle_frozensparsearray, 
+                (self.size, self.ref, 
+                 self.keys_view().tobytes(), self.values_view().tobytes()))
+
+    def keys_view(self):
+        """
+        Gets the non-sparse locations without copying them. The array 
+        is read-only and keeps this FrozenSparseArray alive.
+
+        :returns: locations of the non-sparse values
+        :rtype: numpy array of type uint32
+        """
+        return np.asarray(BufferView.wrap(self, self.dense_keys.data(), 
+                                          self.dense_keys.size(), 
+                                          sizeof(sparsekey), b'I'))
 
-        for k,v in other.data:
-            out.set_item(k, self.get_item(k) == v)
+    def values_view(self):
+        """
+        Gets the non-sparse values without copying them. The array is 
+        read-only and keeps this FrozenSparseArray alive.
+
+        :returns: non-sparse values, in order
+        :rtype: numpy array of type int8
+        """
+        return np.asarray(BufferView.wrap(self, self.dense_values.data(), 
+                                          self.dense_values.size(), 
+                                          sizeof(sparseval), b'b'))
+
+    def keys(self):
+        """
+        Gets the non-sparse locations
+
+        :returns: locations of the non-sparse values
+        :rtype: list
+        """ 
+        return [k for k in self.dense_keys]
+
+    def values(self):
+        """
+        Gets the non-sparse values
+
+        :returns: non-sparse values, in order
+        :rtype: list
+        """ 
+        return [v for v in self.dense_values]
+
+    def items(self):
+        """
+        Gets the non-sparse indices and their values
+
+        :returns: non-sparse locations and values
+        :rtype: list of (uint32_t, int8_t) tuples
+        """
+        cdef size_t i
+        return [(self.dense_keys[i], self.dense_values[i]) 
+                for i in range(self.dense_keys.size())]
+
+    def keys_array(self):
+        """
+        Gets the non-sparse locations. This is the same read-only view
+        as keys_view.
+
+        :returns: locations of the non-sparse values
+        :rtype: numpy array of type uint32
+        """
+        return self.keys_view()
+
+    def values_array(self):
+        """
+        Gets the non-sparse values. This is the same read-only view as
+        values_view.
+
+        :returns: non-sparse values, in order
+        :rtype: numpy array of type int8
+        """
+        return self.values_view()
+
+    def to_numpy(self, out=None, sparsekey start=0, stop=None):
+        """
+        Writes the values in a region into a dense numpy array
+
+        :param out: array to fill, such as a row of a genotype matrix. 
+            Must have stop - start elements. A new array is made if None.
+        :param start: start of the region (inclusive)
+        :param stop: end of the region (exclusive), defaults to the end
+        :type out: numpy array of type int8
+
+        :returns: the filled array
+        :rtype: numpy array of type int8
+        """
+        cdef sparsekey end = self.size if stop is None else stop
+        out = dense_buffer(out, start, end, self.size)
+        cdef int8_t[:] buf = out
+        cdef size_t i
+
+        buf[:] = self.ref
+        for i in range(self.lower_bound(start), self.lower_bound(end)):
+            buf[self.dense_keys[i] - start] = self.dense_values[i]
 
         return out
 
-    cpdef SparseArray sparse_cmp(self, SparseArray other, int op):
-        cdef SparseArray out = SparseArray(self.size, sparseval_cmp(self.ref, other.ref, op))
+    cpdef bint any(self):
+        """
+        Are there any non-sparse values?
+        """
+        return self.dense_keys.size() != 0
 
-        cdef sparsekey k
+    cpdef bint all(self):
+        """
+        :returns: are all values are nondense?
+        :rtype bool:
+        """
+        return self.dense_keys.size() == self.size
+
+    cpdef sparsekey ndense(self):
+        """
+        The number of non-sparse sites in the array
+
+        :returns: number of non-sparse items
+        :rtype: int
+        """
+        return self.dense_keys.size()
+
+    cpdef sparsity(self):
+        """
+        Proportion of array that is sparse
+
+        :returns: Percent sparse
+        :rtype: float
+        """
+        return 1 - self.ndense() / <float>self.size
+
+    cpdef density(self):
+        """
+        Proportion of non-sparse sites
+
+        :returns: Percent non-sparse
+        :rtype: float
+        """
+        return self.ndense() / <float>self.size
+
+    # Builders
+    @staticmethod
+    def from_dense(seq, sparseval refcode):
+        """
+        Creates a FrozenSparseArray from a dense sequence
+
+        :returns: resulting array
+        :rtype: FrozenSparseArray
+        """
+        cdef FrozenSparseArray out = FrozenSparseArray(len(seq), refcode)
+
+        cdef sparsekey k = 0
         cdef sparseval v
+        for v in seq:
+            if v != refcode:
+                out.dense_keys.push_back(k)
+                out.dense_values.push_back(v)
+            k += 1
 
-        # This can definitely be done faster
-        for k,v in self.data:
-            out.set_item(k, sparseval_cmp(other.get_item(k), v, op))
+        return out
+
+    @staticmethod
+    def from_items(seq, sparsekey size, sparseval refcode):
+        """
+        Creates a FrozenSparseArray from pairs of items
+
+        :param seq: A sequence of pairs of type (uint32_t, int8_t)
+        :param size: the size of the array
+        :param refcode: the sparse value of the array
+        :type size: uint32_t
+        :type refcode: int8_t
+
+        :returns: the resulting array
+        :rtype: FrozenSparseArray
+        """
+        return SparseArray.from_items(seq, size, refcode).freeze()
+
+    @staticmethod
+    def from_arrays(keys, values, sparsekey size, sparseval refcode):
+        """
+        Creates a FrozenSparseArray from arrays of keys and values, such 
+        as a column of a compressed sparse matrix. Values equal to refcode 
+        are left out.
+
+        :param keys: strictly increasing locations
+        :param values: values at each location
+        :param size: the size of the array
+        :param refcode: the sparse value of the array
+        :type keys: numpy array of type uint32
+        :type values: numpy array of type int8
+
+        :returns: the resulting array
+        :rtype: FrozenSparseArray
+        """
+        cdef const uint32_t[:] kbuf = np.ascontiguousarray(keys, dtype=np.uint32)
+        cdef const int8_t[:] vbuf = np.ascontiguousarray(values, dtype=np.int8)
+        cdef Py_ssize_t n = kbuf.shape[0]
+        cdef Py_ssize_t i
+        cdef FrozenSparseArray out = FrozenSparseArray(size, refcode)
 
-        for k,v in other.data:
-            out.set_item(k, sparseval_cmp(self.get_item(k), v, op))
+        if vbuf.shape[0] != n:
+            raise ValueError('Keys and values are different lengths')
+
+        out.dense_keys.reserve(n)
+        out.dense_values.reserve(n)
+        for i in range(n):
+            if kbuf[i] >= size or (i > 0 and kbuf[i] <= kbuf[i-1]):
+                raise ValueError('Keys must be increasing and within the array')
+            if vbuf[i] != refcode:
+                out.dense_keys.push_back(kbuf[i])
+                out.dense_values.push_back(vbuf[i])
 
         return out
 
-    cpdef SparseArray eq_single(self, sparseval val):
-        cdef SparseArray out = SparseArray(self.size, self.ref == val)
+    cpdef SparseArray thaw(self):
+        """
+        Creates a mutable copy of the array
 
-        cdef sparsekey k
+        :returns: the mutable copy
+        :rtype: SparseArray
+        """
+        cdef SparseArray out = SparseArray(self.size, self.ref)
+        cdef size_t i
+
+        # Keys are already in order, so every insert can be hinted at the 
+        # end of the map and the tree never has to be searched
+        for i in range(self.dense_keys.size()):
+            out.append_item(self.dense_keys[i], self.dense_values[i])
+
+        return out
+
+    cpdef FrozenSparseArray copy(self):
+        """
+        Creates a copy of the array.
+
+        :returns: the copy
+        :rtype: FrozenSparseArray
+        """
+        cdef FrozenSparseArray out = FrozenSparseArray(self.size, self.ref)
+        out.dense_keys = self.dense_keys
+        out.dense_values = self.dense_values
+        out.missing_keys = self.missing_keys
+        out.missing_indexed = self.missing_indexed
+        return out
+
+    cdef size_t lower_bound(self, sparsekey k):
+        "Binary search for the position of the first non-sparse key >= k"
+        return search_keys(self.dense_keys, k)
+
+    cdef void index_missing(self):
+        # The array can't change, so the missing sites only have to be 
+        # found once
+        if self.missing_indexed:
+            return
+
+        cdef size_t i
+        for i in range(self.dense_values.size()):
+            if self.dense_values[i] < 0:
+                self.missing_keys.push_back(self.dense_keys[i])
+        self.missing_indexed = True
+
+    cpdef sparsekey missing_count(self, sparsekey start, sparsekey stop):
+        """
+        Counts the missing (negative) values in a region
+
+        :param start: start of the region (inclusive)
+        :param stop: end of the region (exclusive)
+        :type start: uint32_t
+        :type stop: uint32_t
+
+        :returns: number of missing values
+        :rtype: uint32_t
+        """
+        self.index_missing()
+        cdef sparsekey n = (search_keys(self.missing_keys, stop) - 
+                            search_keys(self.missing_keys, start))
+        
+        if self.ref < 0:
+            # Every sparse site is missing too
+            n += (stop - start) - (self.lower_bound(stop) - self.lower_bound(start))
+
+        return n
+
+    def missing_indices(self):
+        """
+        Gets the locations of missing (negative) values
+
+        :returns: sorted locations of missing values
+        :rtype: numpy array of type uint32
+        """
+        if self.ref < 0:
+            return np.flatnonzero(np.array(self.tolist()) < 0).astype(np.uint32)
+
+        self.index_missing()
+        out = np.empty(self.missing_keys.size(), dtype=np.uint32)
+        cdef uint32_t[:] buf = out
+        cdef size_t i
+
+        for i in range(self.missing_keys.size()):
+            buf[i] = self.missing_keys[i]
+
+        return out
+
+    # Value getting
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.get_slice(index)
+        elif isinstance(index, Sequence): 
+            if type(index[0]) is bool:
+                return self.get_boolidx(index)
+            else:
+                return self.get_fancy(index)
+        else:
+            return self.get_item(index)
+
+    def __setitem__(self, index, value):
+        raise TypeError('FrozenSparseArray is immutable, use thaw() first')
+
+    cpdef sparseval get_item(self, int k):
+        cdef size_t i = self.lower_bound(k)
+
+        if i < self.dense_keys.size() and self.dense_keys[i] == <sparsekey>k:
+            return self.dense_values[i]
+
+        return self.ref
+
+    cdef FrozenSparseArray get_fancy(self, indices):
+        cdef sparsekey n = len(indices)
+        cdef FrozenSparseArray out = FrozenSparseArray(n, self.ref)
+
+        cdef sparsekey i = 0
         cdef sparseval v
+        for i in range(n):
+            v = self.get_item(indices[i])
+            if v != self.ref:
+                out.dense_keys.push_back(i)
+                out.dense_values.push_back(v)
 
-        cdef stlmap[sparsekey, sparseval].iterator it = self.data.begin()
-        while it != self.data.end():
-            k = deref(it).first
-            v = deref(it).second
-            out.set_item(k, val == v)
-            inc(it)
+        return out
+
+    cdef FrozenSparseArray get_boolidx(self, indices):
+        cdef sparsekey n = len(indices)
+        if n != self.size:
+            raise ValueError
+
+        cdef sparsekey sz = 0
+        cdef sparsekey i = 0
+        for i in range(n):
+            if indices[i]: inc(sz)
+
+        cdef FrozenSparseArray out = FrozenSparseArray(sz, self.ref)
+        cdef sparsekey keepidx = 0
+        cdef sparseval v
+        for i in range(n):
+            if indices[i]:
+                v = self.get_item(i)
+                if v != self.ref:
+                    out.dense_keys.push_back(keepidx)
+                    out.dense_values.push_back(v)
+                inc(keepidx)
 
         return out
 
-    cpdef SparseArray cmp_single(self, sparseval val, int op):
-        cdef SparseArray out = SparseArray(self.size, sparseval_cmp(self.ref, val, op))
+    cpdef FrozenSparseArray get_slice(self, slice):
+        cdef sparsekey start = slice.start 
+        cdef sparsekey stop = slice.stop
+        cdef FrozenSparseArray out = FrozenSparseArray(stop - start, self.ref) 
+
+        cdef size_t first = self.lower_bound(start)
+        cdef size_t last = self.lower_bound(stop)
+        cdef size_t i
+
+        out.dense_keys.reserve(last - first)
+        out.dense_values.reserve(last - first)
+        for i in range(first, last):
+            out.dense_keys.push_back(self.dense_keys[i] - start)
+            out.dense_values.push_back(self.dense_values[i])
+
+        return out
+
+    # Comparisons
+    def __richcmp__(self, other, int op):
+        return self.richcmp(other, op)
+
+    cpdef FrozenSparseArray richcmp(self, other, int op):
+        if isinstance(other, FrozenSparseArray):
+            return self.sparse_cmp(other, op)
+        elif isinstance(other, SparseArray):
+            return self.sparse_cmp(other.freeze(), op)
+        elif isinstance(other, Sequence):
+            return self.dense_cmp(other, op)
+        else:
+            return self.cmp_single(other, op)
+
+    cpdef FrozenSparseArray sparse_cmp(self, FrozenSparseArray other, int op):
+        if self.size != other.size:
+            raise IndexError('Cannot compare arrays of differing size')
+
+        cdef sparseval outref = sparseval_cmp(self.ref, other.ref, op)
+        cdef FrozenSparseArray out = FrozenSparseArray(self.size, outref)
+
+        cdef size_t i = 0
+        cdef size_t j = 0
+        cdef size_t n = self.dense_keys.size()
+        cdef size_t m = other.dense_keys.size()
 
         cdef sparsekey k
+        cdef sparseval a, b, result
+
+        # Both key arrays are sorted, so walk them together like the merge
+        # step of a merge sort
+        while i < n or j < m:
+            if j == m or (i < n and self.dense_keys[i] < other.dense_keys[j]):
+                k, a, b = self.dense_keys[i], self.dense_values[i], other.ref
+                inc(i)
+            elif i == n or other.dense_keys[j] < self.dense_keys[i]:
+                k, a, b = other.dense_keys[j], self.ref, other.dense_values[j]
+                inc(j)
+            else:
+                k, a, b = self.dense_keys[i], self.dense_values[i], other.dense_values[j]
+                inc(i)
+                inc(j)
+
+            result = sparseval_cmp(a, b, op)
+            if result != outref:
+                out.dense_keys.push_back(k)
+                out.dense_values.push_back(result)
+
+        return out
+
+    cpdef FrozenSparseArray dense_cmp(self, other, int op):
+        cdef sparsekey n = len(other)
+        cdef FrozenSparseArray out = FrozenSparseArray(n, False)
+
+        cdef size_t j = 0
+        cdef sparsekey i
         cdef sparseval v
+        for i in range(n):
+            if j < self.dense_keys.size() and self.dense_keys[j] == i:
+                v = self.dense_values[j]
+                inc(j)
+            else:
+                v = self.ref
 
-        cdef stlmap[sparsekey, sparseval].iterator it = self.data.begin()
-        while it != self.data.end():
-            k = deref(it).first
-            v = deref(it).second
-            out.set_item(k, sparseval_cmp(v, val, op))
-            inc(it)
+            if sparseval_cmp(v, other[i], op):
+                out.dense_keys.push_back(i)
+                out.dense_values.push_back(True)
 
         return out
 
-    cpdef SparseArray logical_not(self):
+    cpdef FrozenSparseArray cmp_single(self, sparseval val, int op):
+        cdef sparseval outref = sparseval_cmp(self.ref, val, op)
+        cdef FrozenSparseArray out = FrozenSparseArray(self.size, outref)
+
+        cdef size_t i
+        cdef sparseval result
+        for i in range(self.dense_keys.size()):
+            result = sparseval_cmp(self.dense_values[i], val, op)
+            if result != outref:
+                out.dense_keys.push_back(self.dense_keys[i])
+                out.dense_values.push_back(result)
+
+        return out
+
+    cpdef FrozenSparseArray logical_not(self):
         """
         Performs a logical not on the entire array
 
         :returns: the not-ed array
         """ 
-        cdef SparseArray out = SparseArray(self.size, not self.ref)
-        
-        for k, v in self.data:
-            out.set_item(k, not v) 
-        
-        return out
+        cdef FrozenSparseArray out = FrozenSparseArray(self.size, not self.ref)
+
+        cdef size_t i
+        for i in range(self.dense_keys.size()):
+            if (not self.dense_values[i]) != out.ref:
+                out.dense_keys.push_back(self.dense_keys[i])
+                out.dense_values.push_back(not self.dense_values[i])
 
+        return out
 
     cpdef vector[sparseval] tolist(self):
         """
-        Returns the SparseArray in a dense format
+        Returns the FrozenSparseArray in a dense format
+
         :rtype: list in python, C++ std::vector<uint8_t>
         """
         cdef vector[sparseval] out = vector[sparseval](self.size, self.ref)
-        cdef sparsekey k
-        cdef sparseval v
+        cdef size_t i
 
-        for k,v in self.data:
-            out[k] = v
+        for i in range(self.dense_keys.size()):
+            out[self.dense_keys[i]] = self.dense_values[i]
 
         return out
+
+
+cdef dense_buffer(out, sparsekey start, sparsekey stop, sparsekey size):
+    # Checks or makes the output array for to_numpy
+    if not start <= stop <= size:
+        raise IndexError('Region out of bounds')
+    if out is None:
+        return np.empty(stop - start, dtype=np.int8)
+    if len(out) != stop - start:
+        raise ValueError('Output array is the wrong size')
+    return out
+
+
+cdef class BufferView:
+    """
+    Exposes memory owned by another object through the buffer protocol, 
+    so numpy can view it without a copy. The owner is kept alive as long
+    as the view is.
+    """
+    cdef object owner
+    cdef void* ptr
+    cdef Py_ssize_t shape[1]
+    cdef Py_ssize_t strides[1]
+    cdef bytes fmt
+
+    @staticmethod
+    cdef BufferView wrap(object owner, void* ptr, Py_ssize_t n, 
+                         Py_ssize_t itemsize, bytes fmt):
+        cdef BufferView view = BufferView.__new__(BufferView)
+        view.owner = owner
+        view.ptr = ptr
+        view.shape[0] = n
+        view.strides[0] = itemsize
+        view.fmt = fmt
+        return view
+
+    def __getbuffer__(self, Py_buffer* buffer, int flags):
+        if flags & PyBUF_WRITABLE:
+            raise BufferError('View is read-only')
+
+        buffer.buf = self.ptr
+        buffer.obj = self
+        buffer.len = self.shape[0] * self.strides[0]
+        buffer.readonly = 1
+        buffer.itemsize = self.strides[0]
+        buffer.format = self.fmt
+        buffer.ndim = 1
+        buffer.shape = self.shape
+        buffer.strides = self.strides
+        buffer.suboffsets = NULL
+        buffer.internal = NULL
+
+    def __releasebuffer__(self, Py_buffer* buffer):
+        pass
+
+
+def unpickle_sparsearray(sparsekey size, sparseval ref, bytes keys, bytes values):
+    "Rebuilds a pickled SparseArray"
+    cdef SparseArray out = SparseArray(size, ref)
+    cdef const uint32_t[:] kbuf = np.frombuffer(keys, dtype=np.uint32)
+    cdef const int8_t[:] vbuf = np.frombuffer(values, dtype=np.int8)
+    cdef Py_ssize_t i
+
+    for i in range(kbuf.shape[0]):
+        out.append_item(kbuf[i], vbuf[i])
+
+    return out
+
+
+def unpickle_frozensparsearray(sparsekey size, sparseval ref, bytes keys, bytes values):
+    "Rebuilds a pickled FrozenSparseArray"
+    cdef FrozenSparseArray out = FrozenSparseArray(size, ref)
+    cdef const uint32_t[:] kbuf = np.frombuffer(keys, dtype=np.uint32)
+    cdef const int8_t[:] vbuf = np.frombuffer(values, dtype=np.int8)
+    cdef Py_ssize_t i
+
+    out.dense_keys.reserve(kbuf.shape[0])
+    out.dense_values.reserve(kbuf.shape[0])
+    for i in range(kbuf.shape[0]):
+        out.dense_keys.push_back(kbuf[i])
+        out.dense_values.push_back(vbuf[i])
+
+    return out
+
+
+cdef inline uint8_t ibs_state(sparseval a, sparseval b, sparseval c, 
+                              sparseval d, uint8_t missingval):
+    # Missing alleles are negative in sparse genotypes. As with dense 
+    # genotypes, only the first chromatid of each individual is checked.
+    if a < 0 or c < 0:
+        return missingval
+    if (a == c and b == d) or (a == d and b == c):
+        return 2
+    if a == c or a == d or b == c or b == d:
+        return 1
+    return 0
+
+
+cdef inline FrozenSparseArray as_frozen(arr):
+    if isinstance(arr, FrozenSparseArray):
+        return arr
+    elif isinstance(arr, SparseArray):
+        return (<SparseArray>arr).freeze()
+    raise TypeError('Expected a SparseArray or FrozenSparseArray')
+
+
+cdef uint8_t merge_ibs(FrozenSparseArray a, FrozenSparseArray b, 
+                       FrozenSparseArray c, FrozenSparseArray d, 
+                       uint8_t missingval, vector[sparsekey]& keys, 
+                       vector[uint8_t]& states):
+    # Walks the non-sparse sites of all four arrays together and records 
+    # the IBS state at each of them. IBS at every other site is the state
+    # of the four reference values, which is returned.
+    cdef vector[sparsekey]* ks[4]
+    cdef vector[sparseval]* vs[4]
+    cdef sparseval refs[4]
+    cdef size_t pos[4]
+    cdef sparseval vals[4]
+    cdef sparsekey k, cur
+    cdef size_t i
+    cdef sparsekey sentinel = 0xFFFFFFFF
+
+    ks[0], ks[1], ks[2], ks[3] = (&a.dense_keys, &b.dense_keys, 
+                                  &c.dense_keys, &d.dense_keys)
+    vs[0], vs[1], vs[2], vs[3] = (&a.dense_values, &b.dense_values, 
+                                  &c.dense_values, &d.dense_values)
+    refs[0], refs[1], refs[2], refs[3] = a.ref, b.ref, c.ref, d.ref
+    pos[0] = pos[1] = pos[2] = pos[3] = 0
+
+    while True:
+        cur = sentinel
+        for i in range(4):
+            if pos[i] < ks[i].size():
+                k = deref(ks[i])[pos[i]]
+                if k < cur:
+                    cur = k
+        
+        if cur == sentinel:
+            break
+
+        for i in range(4):
+            if pos[i] < ks[i].size() and deref(ks[i])[pos[i]] == cur:
+                vals[i] = deref(vs[i])[pos[i]]
+                pos[i] += 1
+            else:
+                vals[i] = refs[i]
+
+        keys.push_back(cur)
+        states.push_back(ibs_state(vals[0], vals[1], vals[2], vals[3], 
+                                   missingval))
+
+    return ibs_state(a.ref, b.ref, c.ref, d.ref, missingval)
+
+
+def sparse_ibs(a, b, c, d, uint8_t missingval=64, out=None):
+    """
+    Evaluates IBS across a diploid pair of sparse genotypes, only visiting
+    the sites that are non-sparse in at least one chromatid.
+
+    :param a: first chromatid of the first individual
+    :param b: second chromatid of the first individual
+    :param c: first chromatid of the second individual
+    :param d: second chromatid of the second individual
+    :param missingval: IBS code for sites where a genotype is missing
+    :param out: optional array (dtype: np.uint8) to write states into
+    :type a: SparseArray or FrozenSparseArray
+
+    :returns: IBS states
+    :rtype: numpy array of type uint8
+    """
+    cdef FrozenSparseArray fa = as_frozen(a), fb = as_frozen(b)
+    cdef FrozenSparseArray fc = as_frozen(c), fd = as_frozen(d)
+
+    if not fa.size == fb.size == fc.size == fd.size:
+        raise ValueError('Genotypes are of different sizes')
+
+    if out is None:
+        out = np.empty(fa.size, dtype=np.uint8)
+    elif len(out) != fa.size:
+        raise ValueError('Output array is the wrong size')
+
+    cdef uint8_t[:] buf = out
+    cdef vector[sparsekey] keys
+    cdef vector[uint8_t] states
+    cdef size_t i
+
+    buf[:] = merge_ibs(fa, fb, fc, fd, missingval, keys, states)
+    for i in range(keys.size()):
+        buf[keys[i]] = states[i]
+
+    return out
+
+
+def sparse_ibs_runs(a, b, c, d, uint8_t missingval=64):
+    """
+    Evaluates IBS across a diploid pair of sparse genotypes, returning 
+    the result as runs of identical state instead of a dense array.
+
+    :param a: first chromatid of the first individual
+    :param b: second chromatid of the first individual
+    :param c: first chromatid of the second individual
+    :param d: second chromatid of the second individual
+    :param missingval: IBS code for sites where a genotype is missing
+    :type a: SparseArray or FrozenSparseArray
+
+    :returns: the start index of each run and its IBS state
+    :rtype: tuple of numpy arrays (dtypes: np.uint32, np.uint8)
+    """
+    cdef FrozenSparseArray fa = as_frozen(a), fb = as_frozen(b)
+    cdef FrozenSparseArray fc = as_frozen(c), fd = as_frozen(d)
+
+    if not fa.size == fb.size == fc.size == fd.size:
+        raise ValueError('Genotypes are of different sizes')
+
+    cdef vector[sparsekey] keys
+    cdef vector[uint8_t] states
+    cdef vector[sparsekey] run_starts
+    cdef vector[uint8_t] run_states
+    cdef uint8_t background = merge_ibs(fa, fb, fc, fd, missingval, 
+                                        keys, states)
+    cdef sparsekey nextsite = 0
+    cdef size_t i
+
+    for i in range(keys.size()):
+        # Sparse sites between the last recorded site and this one
+        if keys[i] > nextsite:
+            if run_states.empty() or run_states.back() != background:
+                run_starts.push_back(nextsite)
+                run_states.push_back(background)
+        if run_states.empty() or run_states.back() != states[i]:
+            run_starts.push_back(keys[i])
+            run_states.push_back(states[i])
+        nextsite = keys[i] + 1
+
+    if nextsite < fa.size:
+        if run_states.empty() or run_states.back() != background:
+            run_starts.push_back(nextsite)
+            run_states.push_back(background)
+
+    starts = np.array(run_starts, dtype=np.uint32)
+    runstates = np.array(run_states, dtype=np.uint8)
+    return starts, runstates
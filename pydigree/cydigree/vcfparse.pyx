@@ -5,6 +5,8 @@ from cpython.mem cimport PyMem_Malloc, PyMem_Free
 
 cimport cython
 
+import numpy as np
+
 cdef struct VariantCall:
     uint32_t alleleidx
     int8_t allele
@@ -147,3 +149,33 @@ def assign_genorow(VariantStack row, inds, int chromidx, int markidx):
 
         PyMem_Free(denseval)
         denseval = row.pop()
+
+def genorow_arrays(VariantStack row):
+    """
+    Empties a row of parsed calls into arrays of haplotype indices and 
+    alleles, in order of haplotype
+
+    :returns: haplotype index and allele for each call
+    :rtype: tuple of numpy arrays (dtypes: np.uint32, np.int8)
+    """
+    cdef Py_ssize_t n = 0
+    cdef VariantCall* item = row.front
+    while item:
+        n += 1
+        item = item.following
+
+    haps = np.empty(n, dtype=np.uint32)
+    alleles = np.empty(n, dtype=np.int8)
+    cdef uint32_t[:] hapbuf = haps
+    cdef int8_t[:] allelebuf = alleles
+
+    # The stack pops in reverse order of haplotype
+    item = row.pop()
+    while item:
+        n -= 1
+        hapbuf[n] = item.alleleidx
+        allelebuf[n] = item.allele
+        PyMem_Free(item)
+        item = row.pop()
+
+    return haps, alleles
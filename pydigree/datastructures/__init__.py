@@ -1 +1 @@
-from pydigree.cydigree.sparsearray import SparseArray
+from pydigree.cydigree.sparsearray import SparseArray, FrozenSparseArray
@@ -1,5 +1,12 @@
 from .genoabc import AlleleContainer
 from .alleles import Alleles
 from .sparsealleles import SparseAlleles
+from .haplotypematrix import SparseHaplotypeMatrix, SparseHaplotypeView
+from .hybridalleles import HybridAlleles
+from .rlealleles import RLEAlleles
+from .packedalleles import PackedAlleles
+from .mosaicalleles import MosaicAlleles
+from .genotypematrix import GenotypeMatrix
+from .allelefrequencies import AlleleFrequencies
 from .chromosometemplate import ChromosomeTemplate, ChromosomeSet
 from .labelledalleles import LabelledAlleles, InheritanceSpan, AncestralAllele
@@ -0,0 +1,155 @@
+import numpy as np
+
+
+def missing_alleles(arr):
+    '''
+    Finds missing alleles in a dense genotype array, coded as in Alleles:
+    '' for string genotypes and 0 for integer genotypes. Arrays made from
+    containers with another convention (e.g. SparseAlleles, where 0 is
+    the reference allele) need the containers' own missing arrays instead.
+
+    :param arr: genotypes
+    :type arr: numpy array
+
+    :rtype: numpy array of bool
+    '''
+    if np.issubdtype(arr.dtype, np.number):
+        return arr == 0
+    return arr == ''
+
+
+class AlleleFrequencies(object):
+    '''
+    Allele counts at every locus on a chromosome, with the frequencies and
+    call rates derived from them
+    '''
+
+    def __init__(self, genotypes, chromosome=None, missing=None):
+        '''
+        Counts alleles in one pass over a cohort's genotypes
+
+        :param genotypes: alleles, with shape (individuals, 2, markers)
+        :param chromosome: the chromosome the markers are on
+        :param missing: which alleles are missing, with the same shape as
+            genotypes. Defaults to the Alleles missing codes
+            (see missing_alleles).
+        :type genotypes: numpy array
+        :type chromosome: ChromosomeTemplate
+        :type missing: numpy array of bool
+        '''
+        genotypes = np.asarray(genotypes)
+        nmark = genotypes.shape[2]
+        self.chromosome = chromosome
+        self.nhaplotypes = genotypes.shape[0] * genotypes.shape[1]
+
+        if missing is None:
+            missing = missing_alleles(genotypes)
+        observed = ~np.asarray(missing, dtype=np.bool_)
+        values, codes = np.unique(genotypes[observed], return_inverse=True)
+
+        # Count every observed (locus, allele) pair at once
+        loci = np.broadcast_to(np.arange(nmark), genotypes.shape)[observed]
+        counts = np.bincount(loci * values.shape[0] + codes,
+                             minlength=nmark * values.shape[0])
+
+        self.alleles = values
+        self.counts = counts.reshape(nmark, values.shape[0])
+        self.called = observed.sum(axis=(0, 1))
+
+    def __len__(self):
+        return self.counts.shape[0]
+
+    @property
+    def frequencies(self):
+        '''
+        Frequency of each allele (columns, in the order of alleles) at each
+        locus (rows), among non-missing alleles
+
+        :rtype: numpy array of floats
+        '''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.counts / self.called[:, np.newaxis].astype(np.float64)
+
+    @property
+    def call_rate(self):
+        '''
+        Proportion of alleles that aren't missing at each locus
+
+        :rtype: numpy array of floats
+        '''
+        return self.called / float(self.nhaplotypes)
+
+    def _ranked(self, rank):
+        order = np.argsort(-self.counts, axis=1, kind='stable')
+        if self.alleles.shape[0] <= rank:
+            return np.zeros(len(self), dtype=np.int64), np.zeros(len(self))
+        idx = order[:, rank]
+        return idx, self.counts[np.arange(len(self)), idx]
+
+    @property
+    def major_allele(self):
+        '''
+        The most common allele at each locus
+
+        :rtype: numpy array
+        '''
+        idx, _ = self._ranked(0)
+        return self._alleles_or_missing(idx, self.called > 0)
+
+    @property
+    def minor_allele(self):
+        '''
+        The second most common allele at each locus. Monomorphic loci have
+        a missing minor allele.
+
+        :rtype: numpy array
+        '''
+        idx, count = self._ranked(1)
+        return self._alleles_or_missing(idx, count > 0)
+
+    @property
+    def maf(self):
+        '''
+        Frequency of the minor allele at each locus
+
+        :rtype: numpy array of floats
+        '''
+        _, count = self._ranked(1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return count / self.called.astype(np.float64)
+
+    def _alleles_or_missing(self, idx, present):
+        if self.alleles.shape[0] == 0:
+            out = np.zeros(len(self), dtype=self.alleles.dtype)
+        else:
+            out = self.alleles[idx]
+        out[~present] = 0 if np.issubdtype(out.dtype, np.number) else ''
+        return out
+
+    def locus(self, idx):
+        '''
+        Allele frequencies at one locus
+
+        :param idx: index of the locus
+        :type idx: int
+
+        :returns: frequency of each allele seen at the locus
+        :rtype: dict
+        '''
+        present = self.counts[idx] > 0
+        return dict(zip(self.alleles[present].tolist(),
+                        self.frequencies[idx, present].tolist()))
+
+    def locus_counts(self, idx):
+        '''
+        Allele counts at one locus
+
+        :param idx: index of the locus
+        :type idx: int
+
+        :returns: count of each allele seen at the locus
+        :rtype: dict
+        '''
+        present = self.counts[idx] > 0
+        return dict(zip(self.alleles[present].tolist(),
+                        self.counts[idx, present].tolist()))
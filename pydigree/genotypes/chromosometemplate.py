@@ -6,6 +6,7 @@ import numpy as np
 
 from pydigree.common import cumsum
 from pydigree.genotypes import Alleles, SparseAlleles
+from pydigree.cydigree.sparsearray import FrozenSparseArray
 from pydigree.exceptions import SimulationError
 from pydigree.io.genomesimla import read_gs_chromosome_template
 
@@ -148,6 +149,10 @@ class ChromosomeTemplate(object):
         self.reference = []
         # Alternates
         self.alternates = []
+        # Text alleles for each integer allele code, one row per marker
+        self.allele_table = None
+        # Number of alleles in each row of the allele table
+        self._nalleles = None
 
     def __str__(self):
         return 'ChromosomeTemplate object %s: %s markers, %s cM' % \
@@ -220,6 +225,16 @@ class ChromosomeTemplate(object):
         self.reference.append(reference)
         self.alternates.append(alternates)
 
+        if self.allele_table is not None:
+            # Give the new marker a row in the allele table
+            known = self._known_alleles(reference, alternates)
+            width = max(self.allele_table.shape[1], len(known))
+            table = np.full((self.nmark(), width), None, dtype=object)
+            table[:-1, :self.allele_table.shape[1]] = self.allele_table
+            table[-1, :len(known)] = known
+            self.allele_table = table
+            self._nalleles = np.append(self._nalleles, len(known))
+
     def set_frequency(self, position, frequency):
         """
         Manually change an allele's frequency
@@ -251,6 +266,88 @@ class ChromosomeTemplate(object):
             return Alleles(np.zeros(self.nmark(), dtype=dtype), 
                            template=self)
 
+    # Allele encoding
+    def init_allele_table(self):
+        """
+        Sets up the table used to encode text alleles as integers. Markers
+        with a reference allele get code 1 for it and codes 2, 3... for 
+        their alternates. Alleles not in the table get the next free code
+        when they're first encoded. Code 0 is missing.
+
+        :rtype: void
+        """
+        known = [self._known_alleles(ref, alts)
+                 for ref, alts in zip(self.reference, self.alternates)]
+        width = max([len(x) for x in known] + [2])
+        self.allele_table = np.full((self.nmark(), width), None, dtype=object)
+        for i, alleles in enumerate(known):
+            self.allele_table[i, :len(alleles)] = alleles
+        self._nalleles = np.array([len(x) for x in known], dtype=np.int64)
+
+    @staticmethod
+    def _known_alleles(reference, alternates):
+        if reference is None:
+            return []
+        return [reference] + list(alternates or [])
+
+    def encode_alleles(self, alleles, missing_code=''):
+        """
+        Converts text alleles for every marker to integer codes, adding 
+        alleles that haven't been seen before to the table
+
+        :param alleles: one allele per marker
+        :param missing_code: the text used for a missing allele
+        :type alleles: sequence of strings
+
+        :returns: allele codes, with 0 for missing
+        :rtype: numpy array of int8
+        """
+        if self.allele_table is None:
+            self.init_allele_table()
+
+        alleles = np.asarray(alleles, dtype=object)
+        if alleles.shape[0] != self.nmark():
+            raise ValueError('Need one allele per marker')
+
+        codes = np.zeros(self.nmark(), dtype=np.int8)
+        for col in range(self.allele_table.shape[1]):
+            codes[alleles == self.allele_table[:, col]] = col + 1
+
+        new = np.flatnonzero((codes == 0) & (alleles != missing_code))
+        if new.shape[0]:
+            nalleles = self._nalleles[new]
+            if nalleles.max() >= np.iinfo(np.int8).max:
+                raise ValueError('Too many alleles for int8 codes')
+            if nalleles.max() >= self.allele_table.shape[1]:
+                extra = np.full((self.nmark(), self.allele_table.shape[1]),
+                                None, dtype=object)
+                self.allele_table = np.hstack([self.allele_table, extra])
+            self.allele_table[new, nalleles] = alleles[new]
+            self._nalleles[new] += 1
+            codes[new] = nalleles + 1
+
+        codes[alleles == missing_code] = 0
+        return codes
+
+    def decode_alleles(self, codes, missing_code=''):
+        """
+        Converts integer allele codes back to text alleles
+
+        :param codes: one allele code per marker
+        :param missing_code: the text to use for missing alleles
+        :type codes: sequence of ints
+
+        :returns: text alleles
+        :rtype: numpy array of objects
+        """
+        if self.allele_table is None:
+            raise ValueError('Chromosome has no allele table')
+        codes = np.asarray(codes, dtype=np.int64)
+        out = self.allele_table[np.arange(self.nmark()), 
+                                np.maximum(codes - 1, 0)]
+        out[codes <= 0] = missing_code
+        return out
+
     def closest_marker(self, position, map_type='physical'):
         """ 
         Returns the index of the closest marker to a position
@@ -321,8 +418,81 @@ class ChromosomeTemplate(object):
         else:
             return Alleles(r, template=self)
 
-    def linkageequilibrium_chromosomes(self, nchrom):
-        """ Returns a numpy array of many randomly generated chromosomes """
+    def linkageequilibrium_chromosomes(self, nchrom, sparse=False):
+        """
+        Returns many randomly generated chromosomes in linkage equilibrium.
+        Dense chromosomes are views into the rows of one matrix from
+        linkageequilibrium_matrix.
+
+        :param nchrom: number of chromosomes
+        :param sparse: Should the output be sparse
+        :type nchrom: int
+        :type sparse: bool
+
+        :rtype: list of Alleles or SparseAlleles
+        """
+        if sparse:
+            return self._linkageequilibrium_sparse(nchrom)
+        return [Alleles(r, template=self)
+                for r in self.linkageequilibrium_matrix(nchrom)]
+
+    def linkageequilibrium_matrix(self, nchrom):
+        """
+        Draws alleles for many chromosomes in linkage equilibrium at once
+
+        :param nchrom: number of chromosomes
+        :type nchrom: int
+
+        :returns: alleles (1 or 2), one row per chromosome
+        :rtype: numpy array of int8, shape (nchrom, markers)
+        """
+        if (self.frequencies < 0).any():
+            raise ValueError('Not all frequencies are specified')
         chroms = np.random.random((nchrom, self.nmark()))
-        chroms = np.int8((chroms < self.frequencies) + 1)
-        return [Alleles(r) for r in chroms]
+        return np.int8((chroms < self.frequencies) + 1)
+
+    def _linkageequilibrium_sparse(self, nchrom):
+        "Draws sparse chromosomes without drawing a value for every marker"
+        freqs = np.asarray(self.frequencies, dtype=np.float64)
+        if (freqs < 0).any():
+            raise ValueError('Not all frequencies are specified')
+
+        nmark = self.nmark()
+        keys = self._rare_allele_positions(freqs, nchrom * nmark)
+        # Positions run through every marker of the first chromosome, then
+        # the second, so each chromosome's keys are already sorted
+        bounds = np.searchsorted(keys, np.arange(nchrom + 1) * nmark)
+        ones = np.ones(keys.shape[0], dtype=np.int8)
+
+        return [SparseAlleles(
+            FrozenSparseArray.from_arrays(keys[lo:hi] - i * nmark,
+                                          ones[lo:hi], nmark, 0),
+            template=self)
+            for i, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:]))]
+
+    @staticmethod
+    def _rare_allele_positions(freqs, total):
+        """
+        Samples positions of the minor allele among total draws, where draw
+        i is at marker i % len(freqs). Gaps between candidate positions are
+        geometric at the highest frequency, and candidates are kept in
+        proportion to their marker's frequency, so the cost scales with the
+        number of minor alleles instead of the number of draws.
+        """
+        pmax = freqs.max() if freqs.shape[0] else 0
+        if pmax <= 0 or total == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        chunks = []
+        position = -1
+        expected = total * pmax
+        chunksize = int(expected + 5 * np.sqrt(expected)) + 16
+        while position < total:
+            gaps = np.random.geometric(pmax, size=chunksize)
+            candidates = position + np.cumsum(gaps)
+            position = candidates[-1]
+            chunks.append(candidates[candidates < total])
+
+        candidates = np.concatenate(chunks)
+        accept = freqs[candidates % freqs.shape[0]] / pmax
+        return candidates[np.random.random(candidates.shape[0]) < accept]
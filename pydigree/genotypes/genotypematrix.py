@@ -0,0 +1,367 @@
+import os
+
+import numpy as np
+
+from pydigree.genotypes import AlleleContainer, Alleles, SparseAlleles
+from pydigree.genotypes import MosaicAlleles
+from pydigree.genotypes.allelefrequencies import missing_alleles
+
+
+def dense_chromatid(chromatid, positions=None):
+    """
+    Gets the alleles of any AlleleContainer as a numpy array
+
+    :param chromatid: the alleles
+    :param positions: marker indices to get, defaults to all of them.
+        Only these markers are looked up in the container.
+    :type chromatid: AlleleContainer
+    :type positions: numpy array of ints
+
+    :rtype: numpy array
+    """
+    if positions is not None and not isinstance(chromatid, np.ndarray):
+        positions = np.asarray(positions, dtype=np.intp)
+        if isinstance(chromatid, MosaicAlleles):
+            return chromatid[positions]
+        if isinstance(chromatid, SparseAlleles):
+            if positions.shape[0] == 0:
+                return np.zeros(0, dtype=np.int8)
+            return chromatid.container[positions.tolist()].to_numpy()
+        if isinstance(chromatid, AlleleContainer):
+            return np.array([chromatid[i] for i in positions.tolist()])
+
+    if hasattr(chromatid, 'todense') and not isinstance(chromatid, Alleles):
+        chromatid = chromatid.todense()
+    chromatid = np.asarray(chromatid)
+    return chromatid if positions is None else chromatid[positions]
+
+
+def chromatid_missing(chromatid, positions=None):
+    """
+    Finds the missing alleles of any AlleleContainer, by the container's
+    own missing code
+
+    :param chromatid: the alleles
+    :param positions: marker indices to check, defaults to all of them
+    :type chromatid: AlleleContainer
+    :type positions: numpy array of ints
+
+    :rtype: numpy array of bool
+    """
+    if positions is None:
+        positions = slice(None)
+    if hasattr(chromatid, 'missing'):
+        return np.asarray(chromatid.missing)[positions]
+    return missing_alleles(np.asarray(chromatid)[positions])
+
+
+class GenotypeMatrix(object):
+    '''
+    Dense genotypes for a cohort, stored as one contiguous array per
+    chromosome with shape (individuals, 2, markers). Individuals attached
+    to the matrix have Alleles chromatids that are views into these
+    arrays, so writing to an individual's genotypes writes to the matrix
+    and cohort-wide summaries don't have to loop over individuals.
+
+    Giving an individual new chromatid objects (e.g. with get_genotypes)
+    detaches them from the matrix. refresh() copies them back in.
+
+    The arrays can be np.memmap files in a working directory instead, for
+    cohorts that don't fit in memory. The views individuals get are the
+    same either way.
+    '''
+
+    def __init__(self, individuals, chromosomes, dtype=np.uint8,
+                 directory=None):
+        '''
+        Create a matrix of missing genotypes
+
+        :param individuals: the individuals in the matrix, in row order
+        :param chromosomes: the chromosomes in the matrix
+        :param dtype: allele type
+        :param directory: if given, the arrays are memory-mapped files in
+            this directory instead of being kept in memory
+        :type individuals: sequence of Individual
+        :type chromosomes: ChromosomeSet
+        :type directory: string
+        '''
+        self.individuals = list(individuals)
+        self.chromosomes = chromosomes
+        self.directory = directory
+        self.index = {ind: i for i, ind in enumerate(self.individuals)}
+        self._storage = [self._allocate(c, len(self.individuals), dtype)
+                         for c in range(len(chromosomes))]
+        self._trim()
+
+    @staticmethod
+    def open(directory, individuals, chromosomes, dtype=np.uint8):
+        '''
+        Opens a memory-mapped matrix written earlier to a directory, and 
+        attaches the individuals to it
+
+        :param directory: directory the matrix was written to
+        :param individuals: the individuals in the matrix, in row order
+        :param chromosomes: the chromosomes in the matrix
+        :param dtype: allele type
+        :type directory: string
+
+        :rtype: GenotypeMatrix
+        '''
+        matrix = GenotypeMatrix.__new__(GenotypeMatrix)
+        matrix.individuals = list(individuals)
+        matrix.chromosomes = chromosomes
+        matrix.directory = directory
+        matrix.index = {ind: i for i, ind in enumerate(matrix.individuals)}
+        matrix._storage = [
+            np.memmap(matrix._filename(c), dtype=dtype, mode='r+',
+                      shape=(len(matrix.individuals), 2, chrom.nmark()))
+            for c, chrom in enumerate(chromosomes)]
+        matrix._trim()
+        matrix.attach()
+        return matrix
+
+    def _filename(self, chromidx):
+        return os.path.join(self.directory, 'chrom{}.geno'.format(chromidx))
+
+    def _allocate(self, chromidx, nrows, dtype, mode='w+'):
+        shape = (nrows, 2, self.chromosomes[chromidx].nmark())
+        if self.directory is None:
+            return np.zeros(shape, dtype=dtype)
+        # Files can't be mapped if they're empty
+        shape = (max(nrows, 1),) + shape[1:]
+        return np.memmap(self._filename(chromidx), dtype=dtype, mode=mode,
+                         shape=shape)
+
+    def _trim(self):
+        self.arrays = [x[:len(self.individuals)] for x in self._storage]
+
+    @staticmethod
+    def from_individuals(individuals, chromosomes, directory=None):
+        '''
+        Copies the genotypes of a set of individuals into a new matrix and
+        attaches them to it. Individuals without genotypes are left out.
+
+        :param individuals: the individuals to include
+        :param chromosomes: the chromosomes the genotypes are on
+        :param directory: directory for memory-mapped storage
+        :type individuals: iterable of Individual
+        :type chromosomes: ChromosomeSet
+        :type directory: string
+
+        :rtype: GenotypeMatrix
+        '''
+        individuals = [x for x in individuals if x.has_genotypes()]
+        if not individuals:
+            raise ValueError('No individuals with genotypes')
+
+        dtype = dense_chromatid(individuals[0].genotypes[0][0]).dtype
+        matrix = GenotypeMatrix(individuals, chromosomes, dtype=dtype,
+                                directory=directory)
+        for i, ind in enumerate(individuals):
+            matrix._load(i, ind)
+        matrix.attach()
+        return matrix
+
+    def append(self, ind):
+        '''
+        Adds an individual to the end of the matrix, copying in its
+        genotypes and attaching it. Storage grows by doubling, so appending
+        one individual at a time (like a file reader does) is cheap.
+
+        :param ind: the individual to add
+        :type ind: Individual
+
+        :returns: the individual's row
+        :rtype: int
+        '''
+        row = len(self.individuals)
+        capacity = self._storage[0].shape[0]
+        if row >= capacity:
+            self._grow(max(2 * capacity, 1))
+
+        self.individuals.append(ind)
+        self.index[ind] = row
+        self._trim()
+        if ind.has_genotypes():
+            self._load(row, ind)
+        ind.genotypes = self.genotypes(row)
+        return row
+
+    def _grow(self, nrows):
+        if self.directory is None:
+            old = self._storage
+            self._storage = [self._allocate(c, nrows, x.dtype)
+                             for c, x in enumerate(old)]
+            for new, x in zip(self._storage, old):
+                new[:x.shape[0]] = x
+        else:
+            # Mapping the files with a bigger shape extends them
+            self.flush()
+            self._storage = [self._allocate(c, nrows, x.dtype, mode='r+')
+                             for c, x in enumerate(self._storage)]
+
+        # The individuals' views are into the old arrays
+        self._trim()
+        self.attach()
+
+    def flush(self):
+        '''
+        Writes any changes to memory-mapped storage to disk
+
+        :rtype: void
+        '''
+        for x in self._storage:
+            if isinstance(x, np.memmap):
+                x.flush()
+
+    def _load(self, row, ind):
+        for chromidx, chromosome in enumerate(ind.genotypes):
+            for hap, chromatid in enumerate(chromosome):
+                self.arrays[chromidx][row, hap] = dense_chromatid(chromatid)
+
+    @property
+    def nind(self):
+        "The number of individuals in the matrix"
+        return len(self.individuals)
+
+    @property
+    def dtype(self):
+        return self.arrays[0].dtype
+
+    @property
+    def missingcode(self):
+        return 0 if np.issubdtype(self.dtype, np.integer) else ''
+
+    def __getitem__(self, chromidx):
+        return self.arrays[chromidx]
+
+    def __len__(self):
+        return len(self.arrays)
+
+    # Individual views
+    def chromatid(self, row, chromidx, hap):
+        '''
+        Gets a chromatid backed by the matrix
+
+        :param row: index of the individual
+        :param chromidx: index of the chromosome
+        :param hap: which chromatid (0 or 1)
+        :type row: int
+        :type chromidx: int
+        :type hap: int
+
+        :rtype: Alleles
+        '''
+        return Alleles(np.asarray(self.arrays[chromidx][row, hap]),
+                       template=self.chromosomes[chromidx])
+
+    def genotypes(self, row):
+        '''
+        Gets a full set of genotypes for an individual, backed by the matrix
+
+        :param row: index of the individual
+        :type row: int
+
+        :returns: a pair of chromatids for each chromosome
+        :rtype: list of lists of Alleles
+        '''
+        return [[self.chromatid(row, c, 0), self.chromatid(row, c, 1)]
+                for c in range(len(self.arrays))]
+
+    def attach(self):
+        '''
+        Sets the genotypes of each individual to views into the matrix
+
+        :rtype: void
+        '''
+        for i, ind in enumerate(self.individuals):
+            ind.genotypes = self.genotypes(i)
+
+    def is_attached(self, ind):
+        '''
+        Tests if all of an individual's chromatids are backed by the matrix
+
+        :type ind: Individual
+        :rtype: bool
+        '''
+        row = self.index[ind]
+        if not ind.has_genotypes():
+            return False
+        return all(np.shares_memory(chromatid, self.arrays[c][row, hap])
+                   for c, chromosome in enumerate(ind.genotypes)
+                   for hap, chromatid in enumerate(chromosome))
+
+    def refresh(self):
+        '''
+        Copies genotypes back from individuals that have been given new
+        chromatids, and reattaches them
+
+        :rtype: void
+        '''
+        for i, ind in enumerate(self.individuals):
+            if ind.has_genotypes() and not self.is_attached(ind):
+                self._load(i, ind)
+                ind.genotypes = self.genotypes(i)
+
+    # Cohort summaries
+    def missing(self, chromidx):
+        '''
+        Finds missing alleles on a chromosome
+
+        :param chromidx: index of the chromosome
+        :type chromidx: int
+
+        :rtype: numpy array of bool, shape (individuals, 2, markers)
+        '''
+        return self.arrays[chromidx] == self.missingcode
+
+    def missing_counts(self, chromidx):
+        '''
+        Counts the missing alleles at each marker on a chromosome
+
+        :param chromidx: index of the chromosome
+        :type chromidx: int
+
+        :rtype: numpy array
+        '''
+        return self.missing(chromidx).sum(axis=(0, 1))
+
+    def allele_counts(self, chromidx, allele):
+        '''
+        Counts the copies of an allele at each marker on a chromosome
+
+        :param chromidx: index of the chromosome
+        :param allele: the allele to count
+        :type chromidx: int
+
+        :rtype: numpy array
+        '''
+        return (self.arrays[chromidx] == allele).sum(axis=(0, 1))
+
+    def ibs_states(self, row, chromidx, missingval=64):
+        '''
+        Evaluates IBS between one individual and every individual in the
+        matrix, with the same rules as pydigree.ibs.chromwide_ibs
+
+        :param row: index of the individual
+        :param chromidx: index of the chromosome
+        :param missingval: IBS state for missing genotypes
+        :type row: int
+        :type chromidx: int
+
+        :returns: IBS states, one row per individual
+        :rtype: numpy array of uint8, shape (individuals, markers)
+        '''
+        arr = self.arrays[chromidx]
+        a, b = arr[row, 0], arr[row, 1]
+        c, d = arr[:, 0], arr[:, 1]
+
+        a_eq_c, a_eq_d = a == c, a == d
+        b_eq_c, b_eq_d = b == c, b == d
+        ibs1 = a_eq_c | a_eq_d | b_eq_c | b_eq_d
+        ibs2 = (a_eq_c & b_eq_d) | (a_eq_d & b_eq_c)
+
+        states = ibs1.astype(np.uint8)
+        states[ibs2] = 2
+        states[(a == self.missingcode) | (c == self.missingcode)] = missingval
+        return states
@@ -0,0 +1,276 @@
+import numpy as np
+
+from pydigree.cydigree.sparsearray import FrozenSparseArray
+from pydigree.genotypes.alleles import Alleles
+from pydigree.genotypes.sparsealleles import SparseAlleles
+
+
+class SparseHaplotypeMatrix(object):
+    '''
+    Sparse genotypes for every haplotype of a cohort on one chromosome,
+    stored as a compressed sparse column matrix. Variants are rows and
+    haplotypes are columns, so individual i has its chromatids in columns
+    2i and 2i + 1. Only non-reference alleles are stored: column j's
+    variant indices are indices[indptr[j]:indptr[j+1]], with alleles at
+    the same positions in data.
+
+    Cohort-wide summaries work directly on these arrays. Individuals get
+    SparseHaplotypeView chromatids, which only read from the matrix.
+    '''
+
+    def __init__(self, indptr, indices, data, nmark, refcode=0,
+                 template=None):
+        '''
+        Create the matrix from its CSC arrays
+
+        :param indptr: start of each column in indices and data
+        :param indices: variant index of each stored allele
+        :param data: stored alleles
+        :param nmark: number of variants
+        :param refcode: the allele that is not stored
+        :param template: the chromosome the variants are on
+        :type indptr: numpy array
+        :type indices: numpy array
+        :type data: numpy array
+        :type nmark: int
+        :type refcode: int
+        :type template: ChromosomeTemplate
+        '''
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.uint32)
+        self.data = np.asarray(data, dtype=np.int8)
+        self.nmark = nmark
+        self.refcode = refcode
+        self.template = template
+        self._roworder = None
+
+        if self.indices.shape != self.data.shape:
+            raise ValueError('indices and data are different lengths')
+        if self.indptr[-1] != self.data.shape[0]:
+            raise ValueError('indptr does not match data')
+
+    @staticmethod
+    def from_triplets(rows, cols, values, nmark, nhaplotypes, refcode=0,
+                      template=None):
+        '''
+        Builds a matrix from the location and value of each stored allele,
+        in any order.
+
+        :param rows: variant index of each allele
+        :param cols: haplotype index of each allele
+        :param values: the alleles
+        :param nmark: number of variants
+        :param nhaplotypes: number of haplotypes
+        :param refcode: the allele that is not stored
+
+        :rtype: SparseHaplotypeMatrix
+        '''
+        rows = np.asarray(rows, dtype=np.uint32)
+        cols = np.asarray(cols, dtype=np.int64)
+        values = np.asarray(values, dtype=np.int8)
+
+        keep = values != refcode
+        rows, cols, values = rows[keep], cols[keep], values[keep]
+
+        order = np.lexsort((rows, cols))
+        rows, cols, values = rows[order], cols[order], values[order]
+
+        counts = np.bincount(cols, minlength=nhaplotypes)
+        indptr = np.zeros(nhaplotypes + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+
+        return SparseHaplotypeMatrix(indptr, rows, values, nmark,
+                                     refcode=refcode, template=template)
+
+    @property
+    def nhaplotypes(self):
+        "The number of haplotypes (columns) in the matrix"
+        return self.indptr.shape[0] - 1
+
+    @property
+    def nnz(self):
+        "The number of stored alleles"
+        return self.data.shape[0]
+
+    def column(self, hapidx):
+        '''
+        Gets the genotypes of one haplotype
+
+        :param hapidx: haplotype index
+        :type hapidx: int
+
+        :rtype: FrozenSparseArray
+        '''
+        start, stop = self.indptr[hapidx], self.indptr[hapidx + 1]
+        return FrozenSparseArray.from_arrays(self.indices[start:stop],
+                                             self.data[start:stop],
+                                             self.nmark, self.refcode)
+
+    def chromatid(self, hapidx):
+        '''
+        Gets a chromatid that reads its genotypes from the matrix
+
+        :param hapidx: haplotype index
+        :type hapidx: int
+
+        :rtype: SparseHaplotypeView
+        '''
+        return SparseHaplotypeView(self, hapidx)
+
+    def chromatids(self, indidx):
+        '''
+        Gets both chromatids of an individual
+
+        :param indidx: index of the individual in the matrix
+        :type indidx: int
+
+        :rtype: tuple of SparseHaplotypeView
+        '''
+        return self.chromatid(2 * indidx), self.chromatid(2 * indidx + 1)
+
+    def allele_counts(self, allele):
+        '''
+        Counts the copies of an allele at each variant
+
+        :param allele: the allele to count
+        :type allele: int
+
+        :rtype: numpy array
+        '''
+        if allele == self.refcode:
+            stored = np.bincount(self.indices, minlength=self.nmark)
+            return self.nhaplotypes - stored
+
+        return np.bincount(self.indices[self.data == allele],
+                           minlength=self.nmark)
+
+    def missing_counts(self):
+        '''
+        Counts the haplotypes with a missing allele at each variant
+
+        :rtype: numpy array
+        '''
+        if self.refcode < 0:
+            return self.allele_counts(self.refcode)
+        return np.bincount(self.indices[self.data < 0], minlength=self.nmark)
+
+    def carriers(self, variant, allele=None):
+        '''
+        Finds the haplotypes carrying a non-reference allele at a variant
+
+        :param variant: index of the variant
+        :param allele: only find carriers of this allele. Missing alleles
+            are excluded if not given.
+        :type variant: int
+
+        :returns: haplotype indices
+        :rtype: numpy array
+        '''
+        if self._roworder is None:
+            # Sort the stored alleles by variant once, so each lookup is
+            # a binary search instead of a scan over the whole matrix
+            cols = np.repeat(np.arange(self.nhaplotypes),
+                             np.diff(self.indptr))
+            order = np.argsort(self.indices, kind='stable')
+            self._roworder = (self.indices[order], cols[order],
+                              self.data[order])
+
+        rows, cols, values = self._roworder
+        start, stop = np.searchsorted(rows, [variant, variant + 1])
+        cols, values = cols[start:stop], values[start:stop]
+
+        if allele is None:
+            return cols[values >= 0]
+        return cols[values == allele]
+
+    def todense(self):
+        '''
+        Converts the matrix to a dense variants by haplotypes array
+
+        :rtype: numpy array of type int8
+        '''
+        out = np.full((self.nmark, self.nhaplotypes), self.refcode,
+                      dtype=np.int8)
+        cols = np.repeat(np.arange(self.nhaplotypes), np.diff(self.indptr))
+        out[self.indices, cols] = self.data
+        return out
+
+
+class SparseHaplotypeView(SparseAlleles):
+    '''
+    A chromatid backed by a column of a SparseHaplotypeMatrix, which
+    behaves like a frozen SparseAlleles. Reads are served from the
+    matrix's arrays, and the view doesn't keep a copy of the column, so a
+    cohort of views takes no more memory than the matrix however often
+    they're read. Writing to a view thaws it into its own container as
+    usual, and the change isn't seen by the matrix.
+    '''
+
+    def __init__(self, matrix, hapidx):
+        self.matrix = matrix
+        self.hapidx = hapidx
+        self.template = matrix.template
+        self.size = matrix.nmark
+        self._container = None
+
+    @property
+    def container(self):
+        if self._container is not None:
+            return self._container
+        # Built for each use and not kept
+        return self.matrix.column(self.hapidx)
+
+    @container.setter
+    def container(self, value):
+        self._container = value
+
+    def _column(self):
+        "Variant indices and alleles of the haplotype's stored alleles"
+        start = self.matrix.indptr[self.hapidx]
+        stop = self.matrix.indptr[self.hapidx + 1]
+        return (self.matrix.indices[start:stop],
+                self.matrix.data[start:stop])
+
+    def __getitem__(self, key):
+        if self._container is not None or isinstance(key, slice):
+            return self.container[key]
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError('Marker index out of range')
+        indices, data = self._column()
+        i = indices.searchsorted(key)
+        if i < indices.shape[0] and indices[i] == key:
+            return int(data[i])
+        return self.refcode
+
+    @property
+    def refcode(self):
+        if self._container is not None:
+            return self._container.ref
+        return self.matrix.refcode
+
+    @property
+    def frozen(self):
+        if self._container is not None:
+            return SparseAlleles.frozen.fget(self)
+        return True
+
+    def missing_indices(self):
+        if self._container is not None:
+            return self._container.missing_indices()
+        indices, data = self._column()
+        return indices[data < 0]
+
+    def todense(self):
+        if self._container is not None:
+            return SparseAlleles.todense(self)
+        indices, data = self._column()
+        dense = np.full(self.size, self.refcode, dtype=np.int8)
+        dense[indices] = data
+        return Alleles(dense, template=self.template)
+
+    def __reduce__(self):
+        # Don't send the whole matrix along with each chromatid
+        return (SparseAlleles,
+                (self.container, self.refcode, None, self.template))
@@ -0,0 +1,335 @@
+import numpy as np
+
+from pydigree.cydigree.sparsearray import SparseArray
+from pydigree.genotypes import AlleleContainer, Alleles
+
+
+class HybridAlleles(AlleleContainer):
+    '''
+    A haploid genotype container that splits the chromosome into fixed size
+    blocks and picks the cheapest storage for each one:
+
+        * constant blocks, where every marker has the same allele, are
+          stored as a single value
+        * sparse blocks are stored as a SparseArray with the most common
+          allele in the block as its reference
+        * dense blocks are stored as an int8 numpy array
+
+    Blocks are re-encoded when a span is written over them. A sparse block
+    becomes dense when more than dense_threshold of it differs from its
+    reference, and a dense block becomes sparse when less than
+    sparse_threshold does. Writing single markers to a dense block doesn't
+    re-encode it; use compact() for that.
+
+    As with SparseAlleles, alleles are signed 8-bit integers and negative
+    values are missing.
+    '''
+
+    sparse_threshold = 0.05
+    dense_threshold = 0.1
+
+    def __init__(self, data=None, size=None, template=None, block_size=4096):
+        '''
+        Create the container
+
+        :param data: dense alleles to store
+        :param size: number of markers, if data isn't given
+        :param template: the chromosome the alleles are on
+        :param block_size: number of markers per block
+        :type data: sequence of int8
+        :type size: int
+        :type template: ChromosomeTemplate
+        :type block_size: int
+        '''
+        self.template = template
+        self.block_size = block_size
+
+        if data is None:
+            if size is None:
+                if template is None:
+                    raise ValueError('No template or size')
+                size = template.nmark()
+            self.size = size
+            self.blocks = [0] * self.nblocks
+            return
+
+        data = np.asarray(data, dtype=np.int8)
+        self.size = data.shape[0]
+        self.blocks = [self._encode(data[start:stop])
+                       for start, stop in self._block_bounds()]
+
+    # Block bookkeeping
+    @property
+    def nblocks(self):
+        "The number of blocks in the container"
+        return (self.size + self.block_size - 1) // self.block_size
+
+    def _block_bounds(self):
+        for start in range(0, self.size, self.block_size):
+            yield start, min(start + self.block_size, self.size)
+
+    def _encode(self, dense):
+        "Picks the storage for a block from its dense alleles"
+        counts = np.bincount(dense.astype(np.int16) + 128, minlength=256)
+        ref = counts.argmax() - 128
+        density = 1 - counts[ref + 128] / float(dense.shape[0])
+
+        if density == 0:
+            return int(ref)
+        elif density < self.sparse_threshold:
+            keys = np.flatnonzero(dense != ref)
+            return SparseArray.from_items(zip(keys, dense[keys]),
+                                          dense.shape[0], ref)
+        else:
+            return dense.copy()
+
+    def _decode(self, idx):
+        "Returns the dense alleles of a block, which must not be modified"
+        block = self.blocks[idx]
+        if isinstance(block, np.ndarray):
+            return block
+        elif isinstance(block, SparseArray):
+            return block.to_numpy()
+
+        start = idx * self.block_size
+        length = min(self.block_size, self.size - start)
+        return np.full(length, block, dtype=np.int8)
+
+    def block_kinds(self):
+        '''
+        Reports how each block is stored
+
+        :returns: 'constant', 'sparse' or 'dense' for each block
+        :rtype: list of str
+        '''
+        kinds = []
+        for block in self.blocks:
+            if isinstance(block, np.ndarray):
+                kinds.append('dense')
+            elif isinstance(block, SparseArray):
+                kinds.append('sparse')
+            else:
+                kinds.append('constant')
+        return kinds
+
+    def compact(self):
+        '''
+        Re-encodes every block with its cheapest storage
+
+        :rtype: void
+        '''
+        self.blocks = [self._encode(self._decode(i))
+                       for i in range(self.nblocks)]
+
+    # Container interface
+    @property
+    def missingcode(self):
+        "Returns the code used for missing values"
+        return -1
+
+    @property
+    def dtype(self):
+        return np.int8
+
+    def nmark(self):
+        '''
+        Return the number of markers represented by the container
+
+        :returns: number of markers
+        :rtype: int
+        '''
+        return self.size
+
+    def _fix_slice(self, key):
+        start, stop, step = key.indices(self.size)
+        if step != 1:
+            raise IndexError('Slices with steps are not supported')
+        return start, max(start, stop)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop = self._fix_slice(key)
+            return self._get_span(start, stop)
+
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError('Marker index out of range')
+
+        idx, offset = divmod(key, self.block_size)
+        block = self.blocks[idx]
+        if isinstance(block, (np.ndarray, SparseArray)):
+            return int(block[offset])
+        return block
+
+    def _get_span(self, start, stop):
+        if start == stop:
+            return np.empty(0, dtype=np.int8)
+
+        first = start // self.block_size
+        last = (stop - 1) // self.block_size
+        out = np.concatenate([self._decode(i) for i in range(first, last + 1)])
+        offset = first * self.block_size
+        return out[start - offset:stop - offset]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            start, stop = self._fix_slice(key)
+            values = np.empty(stop - start, dtype=np.int8)
+            values[:] = value
+            self._set_span(start, stop, values)
+            return
+
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError('Marker index out of range')
+
+        idx, offset = divmod(key, self.block_size)
+        block = self.blocks[idx]
+        if isinstance(block, np.ndarray):
+            block[offset] = value
+        elif isinstance(block, SparseArray):
+            block[offset] = value
+            if block.density() > self.dense_threshold:
+                self.blocks[idx] = block.to_numpy()
+        elif value != block:
+            length = min(self.block_size, self.size - idx * self.block_size)
+            sparse = SparseArray(length, block)
+            sparse[offset] = value
+            self.blocks[idx] = sparse
+
+    def _set_span(self, start, stop, values):
+        values = np.asarray(values, dtype=np.int8)
+        for idx in range(start // self.block_size, self.nblocks):
+            bstart = idx * self.block_size
+            bstop = min(bstart + self.block_size, self.size)
+            if bstart >= stop:
+                break
+
+            lo, hi = max(start, bstart), min(stop, bstop)
+            segment = values[lo - start:hi - start]
+            if lo == bstart and hi == bstop:
+                self.blocks[idx] = self._encode(segment)
+            else:
+                dense = self._decode(idx).copy()
+                dense[lo - bstart:hi - bstart] = segment
+                self.blocks[idx] = self._encode(dense)
+
+    def copy_span(self, template, copy_start, copy_stop):
+        """
+        Copies a span of another AlleleContainer to this one
+
+        :param template: Container to copy from
+        :type template: AlleleContainer
+        :param copy_start: start point for copy (inclusive)
+        :type copy_start: int
+        :param copy_stop: end_point for copy (exclusive), or None for the
+            end of the chromosome
+        :type copy_stop: int
+
+        :rtype: void
+        """
+        start, stop = self._fix_slice(slice(copy_start, copy_stop))
+
+        if not (isinstance(template, HybridAlleles) and
+                template.block_size == self.block_size):
+            self._set_span(start, stop, np.asarray(template[start:stop]))
+            return
+
+        # Whole blocks are copied over in their existing encoding
+        for idx in range(start // self.block_size, self.nblocks):
+            bstart = idx * self.block_size
+            bstop = min(bstart + self.block_size, self.size)
+            if bstart >= stop:
+                break
+
+            if start <= bstart and bstop <= stop:
+                block = template.blocks[idx]
+                if isinstance(block, (np.ndarray, SparseArray)):
+                    block = block.copy()
+                self.blocks[idx] = block
+            else:
+                lo, hi = max(start, bstart), min(stop, bstop)
+                self._set_span(lo, hi, template._get_span(lo, hi))
+
+    def empty_like(self):
+        '''
+        Returns an empty container like this one
+
+        :rtype: HybridAlleles
+        '''
+        return HybridAlleles(size=self.size, template=self.template,
+                             block_size=self.block_size)
+
+    def copy(self):
+        '''
+        Creates a copy of the current data
+
+        :rtype: HybridAlleles
+        '''
+        out = self.empty_like()
+        out.copy_span(self, 0, None)
+        return out
+
+    def todense(self):
+        """
+        Converts to a dense representation of the same genotypes (Alleles).
+
+        :returns: dense version
+        :rtype: Alleles
+        """
+        return Alleles(self._get_span(0, self.size), template=self.template)
+
+    @property
+    def missing(self):
+        " Returns a numpy array indicating which markers have missing data "
+        out = np.empty(self.size, dtype=np.bool_)
+        for idx, (start, stop) in enumerate(self._block_bounds()):
+            block = self.blocks[idx]
+            if isinstance(block, np.ndarray):
+                out[start:stop] = block < 0
+            elif isinstance(block, SparseArray):
+                out[start:stop] = False
+                out[start + block.missing_indices()] = True
+            else:
+                out[start:stop] = block < 0
+        return out
+
+    def __eq__(self, other):
+        if not (isinstance(other, HybridAlleles) and
+                other.block_size == self.block_size):
+            return self._get_span(0, self.size) == np.asarray(other)
+
+        if other.size != self.size:
+            raise ValueError('Containers are different sizes')
+
+        out = np.empty(self.size, dtype=np.bool_)
+        for idx, (start, stop) in enumerate(self._block_bounds()):
+            a, b = self.blocks[idx], other.blocks[idx]
+            if not isinstance(a, (np.ndarray, SparseArray)):
+                a, b = b, a
+
+            if not isinstance(b, (np.ndarray, SparseArray)):
+                # At least one of the blocks is constant
+                if not isinstance(a, (np.ndarray, SparseArray)):
+                    out[start:stop] = a == b
+                elif isinstance(a, SparseArray):
+                    out[start:stop] = a.ref == b
+                    out[start + a.keys_array()] = a.values_array() == b
+                else:
+                    out[start:stop] = a == b
+            else:
+                out[start:stop] = self._decode(idx) == other._decode(idx)
+
+        return out
+
+    def __ne__(self, other):
+        return np.logical_not(self == other)
+
+    def __array__(self, dtype=None):
+        out = self._get_span(0, self.size)
+        return out if dtype is None else out.astype(dtype)
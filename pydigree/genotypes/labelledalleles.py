@@ -1,26 +1,124 @@
+import numpy as np
 
-from pydigree.common import all_same_type
 from .genoabc import AlleleContainer
+from .alleles import Alleles
+
+# Columns of the span table
+START, STOP, ANCESTOR, CHROMOSOME, HAPLOTYPE = range(5)
+
 
 class LabelledAlleles(AlleleContainer):
+    '''
+    A chromatid of labels saying which founder chromatid each allele was
+    inherited from. The inheritance spans are stored as rows of an integer
+    table, in order along the chromosome, with columns for the start, 
+    stop, ancestor, chromosome and haplotype of each span. Ancestors are
+    stored as indices into the list ancestors, which only holds the
+    ancestors the chromatid's spans came from. Spans copied from another
+    chromatid are relabelled to indices into this one's list.
+    '''
+
+    # Average span length (in markers) above which delabel_many copies
+    # spans as slices instead of gathering every marker
+    gather_span = 64
 
     def __init__(self, spans=None, chromobj=None, nmark=None):
         if not (chromobj or nmark):
             raise ValueError('One of chromobj or nmark must be specified')
-        self.spans = spans if spans is not None else []
         self.chromobj = chromobj
         self.nmark = nmark if self.chromobj is None else self.chromobj.nmark()
+        self.ancestors = []
+        self._ancestor_index = {}
+        self.table = np.zeros((0, 5), dtype=np.int64)
+        for span in (spans if spans is not None else []):
+            self.add_span(span)
+
+    def _ancestor_id(self, ancestor):
+        key = id(ancestor)
+        if key not in self._ancestor_index:
+            self._ancestor_index[key] = len(self.ancestors)
+            self.ancestors.append(ancestor)
+        return self._ancestor_index[key]
+
+    @property
+    def starts(self):
+        "First marker of each span"
+        return self.table[:, START]
+
+    @property
+    def stops(self):
+        "End of each span (exclusive)"
+        return self.table[:, STOP]
+
+    @property
+    def ancestor_ids(self):
+        "Index in ancestors of the founder each span came from"
+        return self.table[:, ANCESTOR]
+
+    @property
+    def chromosomeidx(self):
+        "Chromosome index of each span"
+        return self.table[:, CHROMOSOME]
+
+    @property
+    def haplotypes(self):
+        "Founder haplotype (0 or 1) each span came from"
+        return self.table[:, HAPLOTYPE]
+
+    @property
+    def nspans(self):
+        "The number of inheritance spans"
+        return self.table.shape[0]
+
+    @property
+    def spans(self):
+        "The inheritance spans of the chromatid, as InheritanceSpan objects"
+        return [InheritanceSpan(self.ancestors[a], c, h, start, stop)
+                for start, stop, a, c, h in self.table.tolist()]
 
     def __eq__(self, other):
         if not isinstance(other, LabelledAlleles):
             return False
-        return all(x == y for x, y in zip(self.spans, other.spans))
+        if self.nspans != other.nspans:
+            return False
+        columns = [START, STOP, CHROMOSOME, HAPLOTYPE]
+        if not (self.table[:, columns] == other.table[:, columns]).all():
+            return False
+        return all(self.ancestors[x] == other.ancestors[y]
+                   for x, y in zip(self.ancestor_ids.tolist(),
+                                   other.ancestor_ids.tolist()))
+
+    def _span_index(self, loci):
+        loci = np.asarray(loci)
+        if ((loci < 0) | (loci >= self.nmark)).any():
+            raise ValueError('Index out of bounds: {}'.format(loci))
+        idx = np.searchsorted(self.starts, loci, side='right') - 1
+        if ((idx < 0) | (loci >= self.stops[idx])).any():
+            raise ValueError('Index not in a span: {}'.format(loci))
+        return idx
 
     def __getitem__(self, index):
-        for span in self.spans:
-            if span.contains(index):
-                return span.ancestral_allele
-        raise ValueError('Index out of bounds: {}'.format(index))
+        if not 0 <= index < self.nmark:
+            raise ValueError('Index out of bounds: {}'.format(index))
+        span = self.starts.searchsorted(index, side='right') - 1
+        if span < 0 or index >= self.table[span, STOP]:
+            raise ValueError('Index not in a span: {}'.format(index))
+        return AncestralAllele(self.ancestors[self.table[span, ANCESTOR]],
+                               int(self.table[span, HAPLOTYPE]))
+
+    def origins(self, loci):
+        '''
+        Finds the founder chromatid the alleles at many loci came from
+
+        :param loci: marker indices
+        :type loci: sequence of ints
+
+        :returns: index of the ancestor in ancestors, and haplotype, for 
+            each locus
+        :rtype: tuple of numpy arrays
+        '''
+        spans = self._span_index(loci)
+        return self.ancestor_ids[spans], self.haplotypes[spans]
 
     def empty_like(self):
         return LabelledAlleles([], chromobj=self.chromobj, nmark=self.nmark)
@@ -35,14 +133,20 @@ class LabelledAlleles(AlleleContainer):
         spans = [InheritanceSpan(ind, chromidx, hap, 0, n)]
         return LabelledAlleles(spans=spans, chromobj=chromobj, nmark=nmark)
 
+    def _append(self, rows):
+        "Adds contiguous spans to the end of the chromatid"
+        last_stop = self.table[-1, STOP] if self.nspans else 0
+        if rows[0, START] != last_stop:
+            raise ValueError('Spans not contiguous')
+        self.table = np.concatenate((self.table, rows))
+
     def add_span(self, new_span):
-        if any(new_span.stop < x.stop for x in self.spans):
+        if self.nspans and new_span.stop < self.table[-1, STOP]:
             raise ValueError('Overwriting not supported for LabelledAlleles')
-        if len(self.spans) == 0 and new_span.start > 0:
-            raise ValueError('Spans not contiguous')
-        if len(self.spans) > 0 and (not new_span.start == self.spans[-1].stop):
-            raise ValueError('Spans not contiguous')
-        self.spans.append(new_span)
+        self._append(np.array([[new_span.start, new_span.stop,
+                                self._ancestor_id(new_span.ancestor),
+                                new_span.chromosomeidx, new_span.haplotype]],
+                              dtype=np.int64))
 
     def copy_span(self, template, copy_start, copy_stop):
         if not isinstance(template, LabelledAlleles):
@@ -51,89 +155,128 @@ class LabelledAlleles(AlleleContainer):
 
         if copy_stop is None:
             copy_stop = self.nmark
-
-        for span in template.spans:
-            if copy_start > span.stop or copy_stop < span.start:
-                # These are the segments that aren't relevant
-                # Ours           [-------------]
-                # Template [---]      OR          [-----]
-                continue
-            elif copy_start == span.start and copy_stop == span.stop:
-                # Ours             [----------]
-                # Template         [----------]
-
-                new_span = InheritanceSpan(span.ancestor,
-                                           span.chromosomeidx,
-                                           span.haplotype,
-                                           copy_start,
-                                           copy_stop)
-
-                self.add_span(new_span)
-
-            elif span.contains(copy_start) and span.contains(copy_stop):
-                # Ours:         [----------------]
-                # Template:  [-----------------------]
-                # The span we want is a sub-span of this span
-
-                new_span = InheritanceSpan(span.ancestor,
-                                           span.chromosomeidx,
-                                           span.haplotype,
-                                           copy_start,
-                                           copy_stop)
-
-                self.add_span(new_span)
-
-            elif span.contains(copy_start):
-                # Ours:        [------------------]
-                # Template: [--------]
-                new_span = InheritanceSpan(span.ancestor,
-                                           span.chromosomeidx,
-                                           span.haplotype,
-                                           copy_start,
-                                           span.stop)
-                self.add_span(new_span)
-
-            elif span.contains(copy_stop):
-                # Ours       [-----------------]
-                # Template:                [-----------]
-                new_span = InheritanceSpan(span.ancestor,
-                                           span.chromosomeidx,
-                                           span.haplotype,
-                                           span.start,
-                                           copy_stop)
-                self.add_span(new_span)
-                return
-
-            elif span.start > copy_start and span.stop < copy_stop:
-                # This span is a sub-span of ours
-                # Ours       [------------------------]
-                # Template         [-------------]
-                # Make a new span object anyway for object ownership purposes
-                new_span = InheritanceSpan(span.ancestor,
-                                           span.chromosomeidx,
-                                           span.haplotype,
-                                           span.start,
-                                           span.stop)
-                self.add_span(new_span)
-            else:
-                raise ValueError('Unforseen combination of spans')
+        if copy_start >= copy_stop:
+            return
+
+        # The template's spans that overlap the copy, clipped to it
+        first = template.stops.searchsorted(copy_start, side='right')
+        last = template.starts.searchsorted(copy_stop, side='left')
+        if first >= last:
+            raise ValueError('Template has no spans in {}-{}'.format(
+                copy_start, copy_stop))
+        rows = template.table[first:last].copy()
+        rows[0, START] = max(rows[0, START], copy_start)
+        rows[-1, STOP] = min(rows[-1, STOP], copy_stop)
+
+        if template.ancestors is not self.ancestors:
+            # Only the ancestors the copied spans use are added. There are
+            # only a few spans in a copy, so this is quicker in Python.
+            ids = rows[:, ANCESTOR].tolist()
+            relabel = {x: self._ancestor_id(template.ancestors[x])
+                       for x in set(ids)}
+            rows[:, ANCESTOR] = [relabel[x] for x in ids]
+
+        self._append(rows)
 
     def delabel(self):
+        spans = self.spans
         # Check to make sure all the founders are delabeled
-        if not all_same_type(self.spans, InheritanceSpan):
-            for span in self.spans:
-                if isinstance(span.ancestral_chromosome, LabelledAlleles):
-                    raise ValueError('Ancestral chromosome {} {} {}'
-                                     'has not been delabeled'.format(
-                                         self.individual,
-                                         self.chromosomeidx,
-                                         self.haplotype))
-
-        nc = self.spans[0].ancestral_chromosome.empty_like()
-        for span in self.spans:
+        for span in spans:
+            if isinstance(span.ancestral_chromosome, LabelledAlleles):
+                raise ValueError('Ancestral chromosome {} {} {} '
+                                 'has not been delabeled'.format(
+                                     span.ancestor,
+                                     span.chromosomeidx,
+                                     span.haplotype))
+
+        nc = spans[0].ancestral_chromosome.empty_like()
+        for span in spans:
             nc.copy_span(span.ancestral_chromosome, span.start, span.stop)
         return nc
 
+    @staticmethod
+    def delabel_many(chromatids):
+        '''
+        Delabels many chromatids at once. The founder chromatids they 
+        came from are stacked into one array, each chromatid's spans are
+        expanded to the row of that array each marker comes from, and 
+        every allele is filled in with one gather. 
+
+        When the spans average gather_span markers or more, each span is
+        copied as a slice of the stacked founders instead, which is 
+        quicker for long spans. Founder chromatids that aren't dense 
+        Alleles are delabelled one at a time with delabel.
+
+        :param chromatids: label chromatids, all of the same length
+        :type chromatids: sequence of LabelledAlleles
+
+        :returns: the delabelled chromatids, in order
+        :rtype: list of AlleleContainers
+        '''
+        if not chromatids:
+            return []
+        nmark = chromatids[0].nmark
+
+        # Number the founders across every chromatid's ancestor list
+        founders, founder_index, relabels = [], {}, {}
+        for chromatid in chromatids:
+            if id(chromatid.ancestors) in relabels:
+                continue
+            relabel = []
+            for ancestor in chromatid.ancestors:
+                if id(ancestor) not in founder_index:
+                    founder_index[id(ancestor)] = len(founders)
+                    founders.append(ancestor)
+                relabel.append(founder_index[id(ancestor)])
+            relabels[id(chromatid.ancestors)] = np.array(relabel,
+                                                         dtype=np.int64)
+
+        table = np.concatenate([chromatid.table for chromatid in chromatids])
+        ancestors = np.concatenate(
+            [relabels[id(chromatid.ancestors)][chromatid.ancestor_ids]
+             for chromatid in chromatids])
+        lengths = table[:, STOP] - table[:, START]
+        if lengths.sum() != nmark * len(chromatids):
+            raise ValueError('Label chromatids do not cover the chromosome')
+
+        # One row for each founder chromatid used
+        nchrom = table[:, CHROMOSOME].max() + 1
+        keys = (ancestors * nchrom + table[:, CHROMOSOME]) * 2 + \
+            table[:, HAPLOTYPE]
+        keys, rows = np.unique(keys, return_inverse=True)
+        sources = [founders[key // 2 // nchrom].genotypes[key // 2 % nchrom]
+                   [key % 2] for key in keys.tolist()]
+
+        for source in sources:
+            if isinstance(source, LabelledAlleles):
+                raise ValueError('Ancestral chromosome has not been '
+                                 'delabeled')
+        if not all(type(source) is Alleles for source in sources):
+            return [chromatid.delabel() for chromatid in chromatids]
+
+        nspans = rows.shape[0]
+        if nmark * len(chromatids) < LabelledAlleles.gather_span * nspans:
+            # Short spans: expand the spans to the founder row of every
+            # marker and gather
+            stacked = np.array(sources)
+            index = np.repeat(rows.astype(np.int32), lengths)
+            index = index.reshape(len(chromatids), nmark)
+            alleles = stacked[index, np.arange(nmark)]
+        else:
+            # Long spans are quicker to copy as slices
+            sources_dense = [np.asarray(source) for source in sources]
+            alleles = np.empty((len(chromatids), nmark), 
+                               dtype=sources_dense[0].dtype)
+            owners = np.repeat(np.arange(len(chromatids)), 
+                               [chromatid.nspans for chromatid in chromatids])
+            for owner, row, start, stop in zip(owners.tolist(), rows.tolist(),
+                                               table[:, START].tolist(),
+                                               table[:, STOP].tolist()):
+                alleles[owner, start:stop] = sources_dense[row][start:stop]
+
+        template = sources[0].template
+        return [Alleles(x, template=template) for x in alleles]
+
 
 class InheritanceSpan(object):
     __slots__ = ['ancestor', 'chromosomeidx', 'haplotype', 'start', 'stop']
@@ -0,0 +1,277 @@
+import numpy as np
+
+from pydigree.genotypes import AlleleContainer, Alleles
+
+
+class MosaicAlleles(AlleleContainer):
+    '''
+    A haploid genotype container made by recombination that doesn't copy
+    any alleles. It keeps the two parental chromatids and the markers where
+    the gamete crosses over between them, and looks alleles up in the
+    parent they came from.
+
+    Alleles are copied into a container of the parents' type (materialised)
+    the first time the mosaic is written to, or when it is built from
+    mosaics more than max_depth generations deep, so lookups never have to
+    go through too many generations.
+
+    The parental chromatids are shared, not copied: changing a parent's
+    alleles after the mosaic is made changes the mosaic too.
+    '''
+
+    max_depth = 16
+
+    def __init__(self, chr1, chr2, breaks, first=0):
+        '''
+        Create the container
+
+        :param chr1: first parental chromatid
+        :param chr2: second parental chromatid
+        :param breaks: markers where the gamete switches chromatids, in
+            increasing order
+        :param first: which chromatid (0 or 1) the gamete starts on
+        :type chr1: AlleleContainer
+        :type chr2: AlleleContainer
+        :type breaks: sequence of ints
+        :type first: int
+        '''
+        self.sources = (chr1, chr2)
+        self.breaks = np.asarray(breaks, dtype=np.int64)
+        self.first = int(first)
+        self.template = getattr(chr1, 'template', None)
+        # LabelledAlleles keep their marker count as an attribute
+        nmark = chr1.nmark
+        self.size = nmark() if callable(nmark) else nmark
+        self.depth = 1 + max(getattr(c, 'depth', 0) for c in self.sources)
+        self._data = None
+
+        if self.depth > self.max_depth:
+            self.materialise()
+
+    @property
+    def materialised(self):
+        "True if the alleles have been copied out of the parents"
+        return self._data is not None
+
+    @property
+    def storage_type(self):
+        "The container type the alleles are materialised to"
+        if self._data is not None:
+            return type(self._data)
+        source = self.sources[0]
+        if isinstance(source, MosaicAlleles):
+            return source.storage_type
+        return type(source)
+
+    def _segments(self, start, stop):
+        "Yields (source, start, stop) for each segment in [start, stop)"
+        first = np.searchsorted(self.breaks, start, side='right')
+        last = np.searchsorted(self.breaks, stop, side='left')
+        bounds = [start] + self.breaks[first:last].tolist() + [stop]
+        for i in range(len(bounds) - 1):
+            if bounds[i] != bounds[i + 1]:
+                source = self.sources[(self.first + first + i) % 2]
+                yield source, bounds[i], bounds[i + 1]
+
+    def materialise(self):
+        '''
+        Copies the alleles out of the parental chromatids. Later reads and
+        writes use the copy, and the parents are released.
+
+        :rtype: void
+        '''
+        if self._data is not None:
+            return
+        data = self.sources[0].empty_like()
+        for source, start, stop in self._segments(0, self.size):
+            data.copy_span(source, start, stop)
+        self._data = data
+        self.sources = None
+        self.depth = 0
+
+    def _gather(self, positions):
+        "Dense alleles at an array of marker indices"
+        from pydigree.genotypes.genotypematrix import dense_chromatid
+        if self._data is not None:
+            return dense_chromatid(self._data, positions)
+        switches = np.searchsorted(self.breaks, positions, side='right')
+        which = (self.first + switches) % 2
+        out = np.empty(positions.shape[0], dtype=self.dtype)
+        for i, source in enumerate(self.sources):
+            chosen = which == i
+            if chosen.any():
+                out[chosen] = dense_chromatid(source, positions[chosen])
+        return out
+
+    def _span(self, start, stop):
+        "Dense alleles in [start, stop)"
+        if self._data is not None:
+            return _dense_span(self._data, start, stop)
+        pieces = [_dense_span(source, a, b)
+                  for source, a, b in self._segments(start, stop)]
+        if not pieces:
+            return np.zeros(0, dtype=self.dtype)
+        return np.concatenate(pieces)
+
+    # Container interface
+    @property
+    def dtype(self):
+        if self._data is not None:
+            return self._data.dtype
+        return self.sources[0].dtype
+
+    @property
+    def missingcode(self):
+        if self._data is not None:
+            return self._data.missingcode
+        return self.sources[0].missingcode
+
+    @property
+    def missing(self):
+        " Returns a numpy array indicating which markers have missing data "
+        return self._missing_span(0, self.size)
+
+    def _missing_span(self, start, stop, found=None):
+        """
+        Missingness of the markers in [start, stop). Each mosaic only looks
+        up its segments in its sources, and found keeps the missing arrays
+        of the other containers, so each is built once.
+        """
+        if found is None:
+            found = {}
+        if self._data is not None:
+            return self._source_missing(self._data, found)[start:stop]
+        out = np.empty(stop - start, dtype=np.bool_)
+        for source, a, b in self._segments(start, stop):
+            if isinstance(source, MosaicAlleles):
+                span = source._missing_span(a, b, found)
+            else:
+                span = self._source_missing(source, found)[a:b]
+            out[a - start:b - start] = span
+        return out
+
+    @staticmethod
+    def _source_missing(source, found):
+        key = id(source)
+        if key not in found:
+            found[key] = np.asarray(source.missing)
+        return found[key]
+
+    def nmark(self):
+        '''
+        Return the number of markers represented by the container
+
+        :returns: number of markers
+        :rtype: int
+        '''
+        return self.size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step != 1:
+                return np.asarray(self)[key]
+            return self._span(start, max(start, stop))
+
+        if np.ndim(key) > 0:
+            key = np.asarray(key)
+            if key.dtype == np.bool_:
+                key = np.flatnonzero(key)
+            key = np.where(key < 0, key + self.size, key).astype(np.intp)
+            if ((key < 0) | (key >= self.size)).any():
+                raise IndexError('Marker index out of range')
+            return self._gather(key)
+
+        if self._data is not None:
+            return self._data[key]
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError('Marker index out of range')
+        switches = np.searchsorted(self.breaks, key, side='right')
+        return self.sources[(self.first + switches) % 2][key]
+
+    def __setitem__(self, key, value):
+        self.materialise()
+        self._data[key] = value
+
+    def copy_span(self, template, copy_start, copy_stop):
+        """
+        Copies a span of another AlleleContainer to this one
+
+        :param template: Container to copy from
+        :type template: AlleleContainer
+        :param copy_start: start point for copy (inclusive)
+        :type copy_start: int
+        :param copy_stop: end_point for copy (exclusive)
+        :type copy_stop: int
+
+        :rtype: void
+        """
+        self.materialise()
+        self._data.copy_span(template, copy_start, copy_stop)
+
+    def empty_like(self):
+        '''
+        Returns an empty container of the type the parental chromatids are
+
+        :rtype: AlleleContainer
+        '''
+        if self._data is not None:
+            return self._data.empty_like()
+        return self.sources[0].empty_like()
+
+    def copy(self):
+        '''
+        Creates a copy of the current data. The copy shares the parental
+        chromatids.
+
+        :rtype: MosaicAlleles
+        '''
+        out = MosaicAlleles.__new__(MosaicAlleles)
+        out.__dict__.update(self.__dict__)
+        if self._data is not None:
+            out._data = self._data.copy()
+        return out
+
+    def astype(self, dtype):
+        '''
+        Returns the alleles as a numpy array of another type
+
+        :param dtype: the type
+        :rtype: numpy array
+        '''
+        return np.asarray(self).astype(dtype)
+
+    def todense(self):
+        """
+        Converts to a dense representation of the same genotypes (Alleles).
+
+        :returns: dense version
+        :rtype: Alleles
+        """
+        return Alleles(np.asarray(self), template=self.template)
+
+    def __eq__(self, other):
+        return np.asarray(self) == np.asarray(other)
+
+    def __ne__(self, other):
+        return np.logical_not(self == other)
+
+    def __array__(self, dtype=None):
+        out = self._span(0, self.size)
+        return out if dtype is None else out.astype(dtype)
+
+
+def _dense_span(chromatid, start, stop):
+    "Gets a span of any AlleleContainer as a numpy array"
+    if isinstance(chromatid, MosaicAlleles):
+        return chromatid._span(start, stop)
+    span = chromatid[start:stop]
+    if hasattr(span, 'to_numpy'):
+        # Sparse containers give SparseArrays
+        span = span.to_numpy()
+    return np.asarray(span)
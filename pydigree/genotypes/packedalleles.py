@@ -0,0 +1,223 @@
+import numpy as np
+
+from pydigree.genotypes import AlleleContainer, Alleles
+
+# Alleles per packed word, and the bit offset of each one in the word
+LANES = 32
+SHIFTS = np.arange(0, 2 * LANES, 2, dtype=np.uint64)
+ALL_BITS = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+class PackedAlleles(AlleleContainer):
+    '''
+    A haploid genotype container for diallelic markers that stores each
+    allele in 2 bits, 32 markers to a uint64 word. Alleles are coded as in
+    integer Alleles: 1 and 2 for the two alleles, and 0 for missing.
+
+    Spans copied between PackedAlleles are copied a word at a time, and IBS
+    between four PackedAlleles is evaluated on whole words (see
+    pydigree.ibs.chromwide_ibs).
+    '''
+
+    def __init__(self, data=None, template=None, size=None):
+        '''
+        Create the container
+
+        :param data: dense alleles to store
+        :param template: the chromosome the alleles are on
+        :param size: number of markers, if data isn't given
+        :type data: sequence of ints in 0, 1, 2
+        :type template: ChromosomeTemplate
+        :type size: int
+        '''
+        self.template = template
+
+        if data is None:
+            if size is None:
+                if template is None:
+                    raise ValueError('No template or size')
+                size = template.nmark()
+            self.size = size
+            self.words = np.zeros(self.nwords, dtype=np.uint64)
+            return
+
+        data = np.asarray(data)
+        self.size = data.shape[0]
+        self.words = PackedAlleles._pack(data)
+
+    @property
+    def nwords(self):
+        "The number of words used to store the alleles"
+        return (self.size + LANES - 1) // LANES
+
+    @staticmethod
+    def _pack(dense):
+        "Packs dense alleles into words, starting at the first lane"
+        if dense.shape[0] and (dense.min() < 0 or dense.max() > 2):
+            raise ValueError('Packed alleles must be 0, 1 or 2')
+
+        nwords = (dense.shape[0] + LANES - 1) // LANES
+        lanes = np.zeros(nwords * LANES, dtype=np.uint64)
+        lanes[:dense.shape[0]] = dense
+        lanes = lanes.reshape(nwords, LANES) << SHIFTS
+        return np.bitwise_or.reduce(lanes, axis=1)
+
+    @staticmethod
+    def _unpack(words):
+        "Unpacks every lane of the words into uint8 alleles"
+        lanes = (words[:, np.newaxis] >> SHIFTS) & np.uint64(3)
+        return lanes.astype(np.uint8).ravel()
+
+    # Container interface
+    @property
+    def dtype(self):
+        return np.dtype(np.uint8)
+
+    @property
+    def missingcode(self):
+        return 0
+
+    @property
+    def missing(self):
+        " Returns a numpy array indicating which markers have missing data "
+        return np.asarray(self) == 0
+
+    def nmark(self):
+        '''
+        Return the number of markers represented by the container
+
+        :returns: number of markers
+        :rtype: int
+        '''
+        return self.size
+
+    def __len__(self):
+        return self.size
+
+    def _fix_slice(self, key):
+        start, stop, step = key.indices(self.size)
+        if step != 1:
+            raise IndexError('Slices with steps are not supported')
+        return start, max(start, stop)
+
+    def _fix_index(self, key):
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError('Marker index out of range')
+        return key
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop = self._fix_slice(key)
+            if start == stop:
+                return np.zeros(0, dtype=np.uint8)
+            first, last = start // LANES, (stop - 1) // LANES
+            dense = PackedAlleles._unpack(self.words[first:last + 1])
+            offset = first * LANES
+            return dense[start - offset:stop - offset]
+
+        key = self._fix_index(key)
+        word = self.words[key // LANES]
+        return int((word >> SHIFTS[key % LANES]) & np.uint64(3))
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            start, stop = self._fix_slice(key)
+            values = np.empty(stop - start, dtype=np.int16)
+            values[:] = value
+        else:
+            start = self._fix_index(key)
+            stop = start + 1
+            values = np.array([value], dtype=np.int16)
+
+        if start == stop:
+            return
+
+        # Pack the values lined up with the words they're going into
+        offset = start % LANES
+        aligned = np.zeros(offset + values.shape[0], dtype=np.int16)
+        aligned[offset:] = values
+        self._copy_words(PackedAlleles._pack(aligned), start, stop)
+
+    def _copy_words(self, words, start, stop):
+        "Copies lanes [start, stop) from words, which begin at start's word"
+        first, last = start // LANES, (stop - 1) // LANES
+        mask = np.full(last - first + 1, ALL_BITS, dtype=np.uint64)
+        mask[0] &= ~((np.uint64(1) << SHIFTS[start % LANES]) - np.uint64(1))
+        if stop % LANES:
+            mask[-1] &= (np.uint64(1) << SHIFTS[stop % LANES]) - np.uint64(1)
+
+        target = self.words[first:last + 1]
+        target &= ~mask
+        target |= words & mask
+
+    def copy_span(self, template, copy_start, copy_stop):
+        """
+        Copies a span of another AlleleContainer to this one
+
+        :param template: Container to copy from
+        :type template: AlleleContainer
+        :param copy_start: start point for copy (inclusive)
+        :type copy_start: int
+        :param copy_stop: end_point for copy (exclusive), or None for the
+            end of the chromosome
+        :type copy_stop: int
+
+        :rtype: void
+        """
+        start, stop = self._fix_slice(slice(copy_start, copy_stop))
+        if start == stop:
+            return
+
+        if isinstance(template, PackedAlleles):
+            first, last = start // LANES, (stop - 1) // LANES
+            self._copy_words(template.words[first:last + 1], start, stop)
+        else:
+            self[start:stop] = template[start:stop]
+
+    def empty_like(self):
+        '''
+        Returns an empty container like this one
+
+        :rtype: PackedAlleles
+        '''
+        return PackedAlleles(size=self.size, template=self.template)
+
+    def copy(self):
+        '''
+        Creates a copy of the current data
+
+        :rtype: PackedAlleles
+        '''
+        out = self.empty_like()
+        out.words[:] = self.words
+        return out
+
+    def todense(self):
+        """
+        Converts to a dense representation of the same genotypes (Alleles).
+
+        :returns: dense version
+        :rtype: Alleles
+        """
+        return Alleles(np.asarray(self), template=self.template)
+
+    def __eq__(self, other):
+        if not isinstance(other, PackedAlleles):
+            return np.asarray(self) == np.asarray(other)
+
+        if other.size != self.size:
+            raise ValueError('Containers are different sizes')
+
+        # Lanes where both bits match, moved to the low bit of each lane
+        diff = self.words ^ other.words
+        same = ~(diff | (diff >> np.uint64(1))) & np.uint64(0x5555555555555555)
+        return PackedAlleles._unpack(same)[:self.size].astype(np.bool_)
+
+    def __ne__(self, other):
+        return np.logical_not(self == other)
+
+    def __array__(self, dtype=None):
+        out = PackedAlleles._unpack(self.words)[:self.size]
+        return out if dtype is None else out.astype(dtype)
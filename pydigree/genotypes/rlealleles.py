@@ -0,0 +1,280 @@
+import numpy as np
+
+from pydigree.genotypes import AlleleContainer, Alleles
+
+
+class RLEAlleles(AlleleContainer):
+    '''
+    A haploid genotype container that stores alleles as runs of identical
+    values. Each run is kept as its first marker and its allele, so a
+    chromatid that is a mosaic of a few long segments (like those made by
+    recombination from a low diversity founder pool) only takes a few
+    entries. Copying a span from another RLEAlleles splices runs and never
+    touches the individual markers.
+
+    Missing values follow Alleles: 0 for integer alleles and '' for string
+    alleles.
+    '''
+
+    def __init__(self, data=None, template=None, size=None, dtype=np.uint8):
+        '''
+        Create the container
+
+        :param data: dense alleles to store
+        :param template: the chromosome the alleles are on
+        :param size: number of markers, if data isn't given
+        :param dtype: allele type, if data isn't given
+        :type data: sequence
+        :type template: ChromosomeTemplate
+        :type size: int
+        '''
+        self.template = template
+
+        if data is None:
+            if size is None:
+                if template is None:
+                    raise ValueError('No template or size')
+                size = template.nmark()
+            self.size = size
+            self.starts = np.zeros(1 if size else 0, dtype=np.int64)
+            self.values = np.zeros(self.starts.shape[0], dtype=dtype)
+            return
+
+        data = np.asarray(data)
+        self.size = data.shape[0]
+        self.starts, self.values = RLEAlleles._encode(data, 0)
+
+    @staticmethod
+    def from_runs(starts, values, size, template=None):
+        '''
+        Creates a container from its runs
+
+        :param starts: first marker of each run, in increasing order
+        :param values: allele of each run
+        :param size: number of markers
+        :type size: int
+
+        :rtype: RLEAlleles
+        '''
+        starts = np.asarray(starts, dtype=np.int64)
+        values = np.asarray(values)
+        if starts.shape != values.shape:
+            raise ValueError('starts and values are different lengths')
+        if size and (starts.shape[0] == 0 or starts[0] != 0):
+            raise ValueError('First run must start at 0')
+        if (np.diff(starts) <= 0).any() or (starts >= size).any():
+            raise ValueError('Invalid run starts')
+
+        out = RLEAlleles(size=0, template=template, dtype=values.dtype)
+        out.size = size
+        out.starts, out.values = RLEAlleles._merge(starts, values)
+        return out
+
+    @staticmethod
+    def _encode(dense, offset):
+        "Returns the runs of a dense array, with starts shifted by offset"
+        if dense.shape[0] == 0:
+            return np.zeros(0, dtype=np.int64), dense.copy()
+        breaks = np.flatnonzero(dense[1:] != dense[:-1]) + 1
+        starts = np.concatenate(([0], breaks)).astype(np.int64)
+        return starts + offset, dense[starts]
+
+    @staticmethod
+    def _merge(starts, values):
+        "Joins neighbouring runs with the same allele"
+        if values.shape[0] < 2:
+            return starts, values
+        keep = np.empty(values.shape[0], dtype=np.bool_)
+        keep[0] = True
+        np.not_equal(values[1:], values[:-1], out=keep[1:])
+        if keep.all():
+            return starts, values
+        return starts[keep], values[keep]
+
+    @property
+    def nruns(self):
+        "The number of runs in the container"
+        return self.starts.shape[0]
+
+    def runs(self, start=0, stop=None):
+        '''
+        Gets the runs overlapping a span of markers. The first run is
+        clipped to start at the start of the span.
+
+        :param start: start of the span (inclusive)
+        :param stop: end of the span (exclusive), or None for the end of
+            the chromosome
+        :type start: int
+        :type stop: int
+
+        :returns: starts and alleles of the runs
+        :rtype: tuple of numpy arrays
+        '''
+        start, stop = self._fix_slice(slice(start, stop))
+        if start == stop:
+            return np.zeros(0, dtype=np.int64), self.values[:0].copy()
+
+        first = np.searchsorted(self.starts, start, side='right') - 1
+        last = np.searchsorted(self.starts, stop, side='left')
+        starts = self.starts[first:last].copy()
+        starts[0] = start
+        return starts, self.values[first:last].copy()
+
+    def _lengths(self):
+        return np.diff(np.append(self.starts, self.size))
+
+    # Container interface
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def missingcode(self):
+        return 0 if np.issubdtype(self.dtype, np.integer) else ''
+
+    @property
+    def missing(self):
+        " Returns a numpy array indicating which markers have missing data "
+        return np.repeat(self.values == self.missingcode, self._lengths())
+
+    def nmark(self):
+        '''
+        Return the number of markers represented by the container
+
+        :returns: number of markers
+        :rtype: int
+        '''
+        return self.size
+
+    def __len__(self):
+        return self.size
+
+    def _fix_slice(self, key):
+        start, stop, step = key.indices(self.size)
+        if step != 1:
+            raise IndexError('Slices with steps are not supported')
+        return start, max(start, stop)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            starts, values = self.runs(*self._fix_slice(key))
+            if starts.shape[0] == 0:
+                return values
+            stop = self._fix_slice(key)[1]
+            return np.repeat(values, np.diff(np.append(starts, stop)))
+
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError('Marker index out of range')
+        return self.values[np.searchsorted(self.starts, key, side='right') - 1]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            start, stop = self._fix_slice(key)
+        else:
+            if key < 0:
+                key += self.size
+            if not 0 <= key < self.size:
+                raise IndexError('Marker index out of range')
+            start, stop = key, key + 1
+
+        if start == stop:
+            return
+
+        values = np.empty(stop - start, dtype=self.dtype)
+        values[:] = value
+        self._splice(start, stop, *RLEAlleles._encode(values, start))
+
+    def _splice(self, start, stop, starts, values):
+        "Replaces the runs in [start, stop) with new ones"
+        left = np.searchsorted(self.starts, start, side='left')
+        right = np.searchsorted(self.starts, stop, side='right') - 1
+
+        pieces_s = [self.starts[:left], starts]
+        pieces_v = [self.values[:left], values.astype(self.dtype, copy=False)]
+        if stop < self.size:
+            pieces_s += [[stop], self.starts[right + 1:]]
+            pieces_v += [self.values[right:right + 1], self.values[right + 1:]]
+
+        self.starts, self.values = RLEAlleles._merge(
+            np.concatenate(pieces_s).astype(np.int64, copy=False),
+            np.concatenate(pieces_v))
+
+    def copy_span(self, template, copy_start, copy_stop):
+        """
+        Copies a span of another AlleleContainer to this one
+
+        :param template: Container to copy from
+        :type template: AlleleContainer
+        :param copy_start: start point for copy (inclusive)
+        :type copy_start: int
+        :param copy_stop: end_point for copy (exclusive), or None for the
+            end of the chromosome
+        :type copy_stop: int
+
+        :rtype: void
+        """
+        start, stop = self._fix_slice(slice(copy_start, copy_stop))
+        if start == stop:
+            return
+
+        if isinstance(template, RLEAlleles):
+            starts, values = template.runs(start, stop)
+        else:
+            dense = np.asarray(template[start:stop], dtype=self.dtype)
+            starts, values = RLEAlleles._encode(dense, start)
+
+        self._splice(start, stop, starts, values)
+
+    def empty_like(self):
+        '''
+        Returns an empty container like this one
+
+        :rtype: RLEAlleles
+        '''
+        return RLEAlleles(size=self.size, template=self.template,
+                          dtype=self.dtype)
+
+    def copy(self):
+        '''
+        Creates a copy of the current data
+
+        :rtype: RLEAlleles
+        '''
+        out = self.empty_like()
+        out.starts = self.starts.copy()
+        out.values = self.values.copy()
+        return out
+
+    def todense(self):
+        """
+        Converts to a dense representation of the same genotypes (Alleles).
+
+        :returns: dense version
+        :rtype: Alleles
+        """
+        return Alleles(np.repeat(self.values, self._lengths()),
+                       template=self.template)
+
+    def __eq__(self, other):
+        if not isinstance(other, RLEAlleles):
+            return np.asarray(self) == np.asarray(other)
+
+        if other.size != self.size:
+            raise ValueError('Containers are different sizes')
+
+        # Compare each stretch of markers where neither container changes
+        # allele, instead of each marker
+        bounds = np.union1d(self.starts, other.starts)
+        a = self.values[np.searchsorted(self.starts, bounds, side='right') - 1]
+        b = other.values[
+            np.searchsorted(other.starts, bounds, side='right') - 1]
+        return np.repeat(a == b, np.diff(np.append(bounds, self.size)))
+
+    def __ne__(self, other):
+        return np.logical_not(self == other)
+
+    def __array__(self, dtype=None):
+        out = np.repeat(self.values, self._lengths())
+        return out if dtype is None else out.astype(dtype)
@@ -1,6 +1,6 @@
 import numpy as np
 
-from pydigree.cydigree.sparsearray import SparseArray
+from pydigree.cydigree.sparsearray import SparseArray, FrozenSparseArray
 from pydigree.genotypes import AlleleContainer, Alleles
 from pydigree.common import mode
 
@@ -13,6 +13,11 @@ class SparseAlleles(AlleleContainer):
     In the interest of conserving memory for sequencing data, all alleles must
     be represented by a signed 8-bit integer (i.e. between -128 and 127). 
     Negative values are interpreted as missing.
+
+    Genotypes that won't change much (e.g. observed data) can be frozen with
+    SparseAlleles.freeze(), which moves them to a compact array-backed 
+    container. Frozen containers are shared between copies, and are thawed 
+    back to a mutable one the first time they're written to.
     '''
 
     def __init__(self, data=None, refcode=0, size=None, template=None):
@@ -31,6 +36,10 @@ class SparseAlleles(AlleleContainer):
 
         elif type(data) is SparseArray:
             self.container = data.copy()
+
+        elif type(data) is FrozenSparseArray:
+            # Immutable, so safe to share
+            self.container = data
         
         else:    
             if not isinstance(data, np.ndarray):
@@ -45,6 +54,7 @@ class SparseAlleles(AlleleContainer):
         return self.container[key]
 
     def __setitem__(self, key, value):
+        self.thaw()
         self.container[key] = value
 
     def keys(self):
@@ -62,6 +72,31 @@ class SparseAlleles(AlleleContainer):
         """
         return self.container.ref
 
+    @property
+    def frozen(self):
+        "Returns True if the genotypes are in the immutable array backend"
+        return type(self.container) is FrozenSparseArray
+
+    def freeze(self):
+        """
+        Moves the genotypes into a compact, immutable container 
+        (FrozenSparseArray). Reads and comparisons get faster and memory
+        use goes down, at the cost of a copy on the next write.
+
+        :rtype: void
+        """
+        if not self.frozen:
+            self.container = self.container.freeze()
+
+    def thaw(self):
+        """
+        Moves the genotypes back into a mutable container (SparseArray)
+
+        :rtype: void
+        """
+        if self.frozen:
+            self.container = self.container.thaw()
+
     @property
     def missingcode(self):
         "Returns the code used for missing values"
@@ -74,11 +109,35 @@ class SparseAlleles(AlleleContainer):
     @property
     def missing(self):
         " Returns a numpy array indicating which markers have missing data "
-        missingindices = [i for i,v in self.container.items() if v == self.missingcode]
         base = np.zeros(self.size, dtype=np.bool_)
-        base[missingindices] = 1
+        base[self.container.missing_indices()] = 1
         return base
 
+    def missing_indices(self):
+        """
+        Returns the locations of markers with missing data. The container
+        keeps an index of these, so this doesn't scan the genotypes.
+
+        :returns: sorted marker indices
+        :rtype: numpy array of type uint32
+        """
+        return self.container.missing_indices()
+
+    def missing_count(self, start=0, stop=None):
+        """
+        Counts markers with missing data in a region
+
+        :param start: start of the region (inclusive)
+        :param stop: end of the region (exclusive), defaults to the end of 
+            the chromosome
+
+        :returns: number of missing markers
+        :rtype: int
+        """
+        if stop is None:
+            stop = self.size
+        return self.container.missing_count(start, stop)
+
     def __eq__(self, other):
         if type(other) is SparseAlleles:
             return self.container == other.container
@@ -108,7 +167,7 @@ class SparseAlleles(AlleleContainer):
         :returns: dense version
         :rtype: Alleles
         """
-        dense = Alleles(self.container.tolist(), template=self.template)
+        dense = Alleles(self.container.to_numpy(), template=self.template)
         return dense
 
     def empty_like(self):
@@ -133,6 +192,7 @@ class SparseAlleles(AlleleContainer):
         :type copy_stop: int
         :rtype void:
         """
+        self.thaw()
         if isinstance(template, SparseAlleles):
             self.container[copy_start:copy_stop] = template.container[copy_start:copy_stop]
         else:
@@ -146,7 +206,11 @@ class SparseAlleles(AlleleContainer):
         :rtype: SparseAlleles
         """
         outp = self.empty_like()
-        outp.container = self.container.copy()
+        if self.frozen:
+            # Copy-on-write: the copy is only made if someone writes to it
+            outp.container = self.container
+        else:
+            outp.container = self.container.copy()
         return outp
 
     @staticmethod
@@ -1,12 +1,20 @@
 import numpy as np
-from pydigree.cydigree.cyfuncs import ibs
+from pydigree.cydigree.cyfuncs import ibs, packed_ibs, dense_ibs, state_runs
+from pydigree.cydigree.sparsearray import sparse_ibs
 
 
-def get_ibs_states(ind1, ind2, chromosome_index, missingval=64):
+# Dense allele types the compiled IBS kernel handles
+KERNEL_DTYPES = {np.dtype(x) for x in 
+                 (np.uint8, np.int8, np.int16, np.int32, np.int64)}
+
+
+def get_ibs_states(ind1, ind2, chromosome_index, missingval=64, out=None,
+                   runs=False):
     '''
     Efficiently returns IBS states across an entire chromsome.
 
     Arguments: Two individuals, and the index of the chromosome to scan.
+    out and runs are passed on to chromwide_ibs.
 
     Returns: A numpy array (dtype: np.uint8) of IBS states, with IBS between
     missing values coded as missingval
@@ -15,31 +23,76 @@ def get_ibs_states(ind1, ind2, chromosome_index, missingval=64):
     a, b = ind1.genotypes[chromosome_index]
     c, d = ind2.genotypes[chromosome_index]
 
-    return chromwide_ibs(a, b, c, d, missingval=missingval)
+    return chromwide_ibs(a, b, c, d, missingval=missingval, out=out, 
+                         runs=runs)
 
 
-def chromwide_ibs(a, b, c, d, missingval=64):
+def chromwide_ibs(a, b, c, d, missingval=64, out=None, runs=False):
     '''
     Efficiently evaluates IBS across a diploid set of chromosomes,
     sets IBS where one genotype is missing to missingval.
 
+    If all four chromatids are SparseAlleles, IBS is evaluated by 
+    merging their non-sparse sites instead of densifying them. If all four
+    are PackedAlleles, IBS is evaluated 32 markers at a time on the packed
+    words. Dense integer genotypes of the same type are evaluated in one 
+    compiled pass without temporary arrays.
+
     :param a: haploid genotypes
     :param b: haploid genotypes
     :param c: haploid genotypes
     :param d: haploid genotypes
+    :param missingval: IBS state for missing genotypes
+    :param out: array to write the IBS states into, so repeated calls 
+        don't have to allocate
+    :param runs: also return the runs of identical IBS state
     :type a: AlleleContainer
     :type b: AlleleContainer
     :type c: AlleleContainer
     :type d: AlleleContainer
+    :type out: numpy array of type uint8
+    :type runs: bool
 
 
-    :returns: IBS states, with missing values coded as missingval
-    :rtype: numpy array of type uint8
+    :returns: IBS states, with missing values coded as missingval. If runs 
+        is set, also the start of each run of identical state and its state.
+    :rtype: numpy array of type uint8, or a tuple of numpy arrays
     '''
 
     if not 0 <= missingval <= 255:
         raise ValueError('Missing code must be between 0 and 255 inclusive')
 
+    if out is not None and (out.dtype != np.uint8 or out.ndim != 1):
+        raise ValueError('Output array must be one dimensional uint8')
+
+    # Imported here to avoid a circular import through pydigree.genotypes
+    from pydigree.genotypes import Alleles, SparseAlleles, PackedAlleles
+    chromatids = (a, b, c, d)
+
+    if (all(isinstance(x, Alleles) for x in chromatids) and 
+            a.dtype in KERNEL_DTYPES and 
+            all(x.dtype == a.dtype for x in chromatids)):
+        return dense_ibs(a, b, c, d, missingcode=a.missingcode,
+                         missingval=missingval, out=out, runs=runs)
+
+    if all(isinstance(x, SparseAlleles) for x in chromatids):
+        ibs_states = sparse_ibs(a.container, b.container, c.container, 
+                                d.container, missingval=missingval, out=out)
+    elif all(isinstance(x, PackedAlleles) for x in chromatids):
+        ibs_states = packed_ibs(a.words, b.words, c.words, d.words, 
+                                a.nmark(), missingval=missingval, out=out)
+    else:
+        ibs_states = _chromwide_ibs_numpy(a, b, c, d, missingval)
+        if out is not None:
+            out[:] = ibs_states
+            ibs_states = out
+
+    if runs:
+        return (ibs_states,) + state_runs(ibs_states)
+    return ibs_states
+
+
+def _chromwide_ibs_numpy(a, b, c, d, missingval):
     a_eq_c = a == c
     a_eq_d = a == d
     b_eq_c = b == c
@@ -61,3 +114,154 @@ def chromwide_ibs(a, b, c, d, missingval=64):
     ibs_states[missing] = missingval
 
     return ibs_states
+
+
+class PairwiseIBS(object):
+    '''
+    Genome-wide IBS counts for every pair of individuals in a cohort
+
+    :ivar individuals: the individuals, in row order
+    :ivar ibs0: markers sharing no alleles, for each pair
+    :ivar ibs1: markers sharing one allele, for each pair
+    :ivar ibs2: markers sharing both alleles, for each pair
+    :ivar nvalid: markers where neither genotype is missing, for each pair
+    '''
+
+    def __init__(self, individuals, ibs0, ibs1, ibs2, nvalid):
+        self.individuals = individuals
+        self.ibs0 = ibs0
+        self.ibs1 = ibs1
+        self.ibs2 = ibs2
+        self.nvalid = nvalid
+
+    @property
+    def distance(self):
+        '''
+        IBS distance for each pair, adjusted for missingness: one minus 
+        the proportion of alleles shared over the markers both individuals
+        are genotyped at (as in PLINK's --distance). Pairs without any 
+        markers in common are NaN.
+
+        :rtype: numpy array of floats
+        '''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return 1 - (self.ibs2 + 0.5 * self.ibs1) / self.nvalid
+
+
+def _onehot(keys, valid):
+    "Indicator matrix with a column for each distinct key in valid cells"
+    rows = np.nonzero(valid)[0]
+    columns, cols = np.unique(keys[valid], return_inverse=True)
+    out = np.zeros((valid.shape[0], columns.shape[0]), dtype=np.float32)
+    out[rows, cols] = 1
+    return out, columns
+
+
+def _block_ibs_counts(block, missing=None):
+    '''
+    Counts IBS states for every pair at a block of markers, as matrix 
+    products so that no pair is visited on its own.
+
+    :param block: genotypes with shape (individuals, 2, markers)
+    :param missing: which of the first chromatids' alleles are missing,
+        with shape (individuals, markers). Defaults to the Alleles missing
+        codes.
+    :returns: ibs0, ibs1, ibs2 and valid marker counts for each pair
+    '''
+    from pydigree.genotypes.allelefrequencies import missing_alleles
+
+    nmark = block.shape[2]
+    values, codes = np.unique(block, return_inverse=True)
+    codes = codes.reshape(block.shape).astype(np.int64)
+    nvalues = values.shape[0]
+
+    # As in chromwide_ibs, only the first chromatid decides missingness
+    if missing is None:
+        missing = missing_alleles(block[:, 0])
+    valid = ~missing
+    marker = np.arange(nmark)
+
+    # Each unordered genotype at each marker gets a column. Matching 
+    # columns are IBS2.
+    lo = np.minimum(codes[:, 0], codes[:, 1])
+    hi = np.maximum(codes[:, 0], codes[:, 1])
+    genotypes, columns = _onehot((marker * nvalues + lo) * nvalues + hi,
+                                 valid)
+    ibs2 = genotypes.dot(genotypes.T)
+    het = genotypes[:, (columns // nvalues) % nvalues != columns % nvalues]
+    het2 = het.dot(het.T)
+
+    # Each allele present at each marker gets a column. A pair's product
+    # counts the distinct alleles they share: one for IBS1 and homozygous
+    # IBS2 markers, two for heterozygous IBS2 markers.
+    present = np.concatenate([marker * nvalues + codes[:, 0],
+                              marker * nvalues + codes[:, 1]], axis=1)
+    alleles, _ = _onehot(present, np.concatenate([valid, valid], axis=1))
+    shared = alleles.dot(alleles.T)
+
+    valid = valid.astype(np.float32)
+    nvalid = valid.dot(valid.T)
+
+    ibs1 = shared - het2 - ibs2
+    ibs0 = nvalid - ibs1 - ibs2
+    return [np.rint(x).astype(np.int64) for x in (ibs0, ibs1, ibs2, nvalid)]
+
+
+def _block_ibs_job(job):
+    "Runs _block_ibs_counts on a (genotypes, missing) pair"
+    return _block_ibs_counts(*job)
+
+
+def pairwise_ibs_matrix(pop, chromosomes=None, block_size=2048, 
+                        processes=1):
+    '''
+    Counts IBS0, IBS1 and IBS2 markers for every pair of genotyped 
+    individuals across the genome, with the same rules as chromwide_ibs. 
+    Markers are processed in blocks, each as a few matrix products over 
+    the whole cohort.
+
+    :param pop: the individuals to compare
+    :param chromosomes: indices of the chromosomes to use, defaults to all
+    :param block_size: number of markers per block
+    :param processes: number of processes to spread blocks over
+    :type pop: IndividualContainer
+    :type chromosomes: sequence of ints
+    :type block_size: int
+    :type processes: int
+
+    :rtype: PairwiseIBS
+    '''
+    if chromosomes is None:
+        chromosomes = range(len(pop.chromosomes))
+    individuals = [x for x in pop.individuals if x.has_genotypes()]
+
+    def blocks():
+        for chrom in chromosomes:
+            genotypes = pop.genotype_array(chrom)
+            missing = pop.missing_array(chrom)[:, 0]
+            for start in range(0, genotypes.shape[2], block_size):
+                stop = start + block_size
+                yield (np.asarray(genotypes[:, :, start:stop]),
+                       missing[:, start:stop])
+
+    n = len(individuals)
+    totals = [np.zeros((n, n), dtype=np.int64) for _ in range(4)]
+
+    if processes > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(_block_ibs_job, blocks())
+    else:
+        pool = None
+        results = map(_block_ibs_job, blocks())
+
+    try:
+        for counts in results:
+            for total, count in zip(totals, counts):
+                total += count
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return PairwiseIBS(individuals, *totals)
@@ -1,6 +1,6 @@
 "A class representing individuals"
 
-from pydigree.recombination import recombine
+from pydigree.recombination import recombine, recombine_many
 from pydigree.paths import kinship
 from pydigree.common import flatten
 from pydigree.genotypes import LabelledAlleles
@@ -390,9 +390,13 @@ class Individual(object):
     # Functions for breeding
     #
 
-    def gamete(self):
+    def gamete(self, lazy=False):
         """ 
         Provides a set of half-genotypes to use with method fertilize
+
+        :param lazy: make MosaicAlleles that refer to this individual's 
+            chromatids instead of copying alleles
+        :type lazy: bool
         
         :returns: a collection of AlleleContainers
         :rtype: list
@@ -402,11 +406,41 @@ class Individual(object):
 
         g = [recombine(chrom[0],
                        chrom[1],
-                       self.chromosomes[i].genetic_map)
+                       self.chromosomes[i].genetic_map,
+                       lazy=lazy)
              for i, chrom in enumerate(self.genotypes)]
 
         return g
 
+    @staticmethod
+    def gametes(parents, lazy=False):
+        """
+        Provides a gamete from each of many individuals, drawing the
+        crossovers for every meiosis on a chromosome at once
+
+        :param parents: individuals to get gametes from, in any order and
+            with repeats for individuals giving more than one gamete
+        :param lazy: make MosaicAlleles instead of copying alleles
+        :type parents: sequence of Individual
+        :type lazy: bool
+
+        :returns: a collection of AlleleContainers for each parent
+        :rtype: list of lists
+        """
+        if not parents:
+            return []
+
+        for parent in parents:
+            if not parent.genotypes:
+                parent.get_genotypes()
+
+        by_chrom = [recombine_many([x.genotypes[i][0] for x in parents],
+                                   [x.genotypes[i][1] for x in parents],
+                                   chrom.genetic_map, lazy=lazy)
+                    for i, chrom in enumerate(parents[0].chromosomes)]
+
+        return [list(g) for g in zip(*by_chrom)]
+
     def constrained_gamete(self, constraints, attempts=1000):
         # Constraints here is a list of ((location, index), alleles) tuples
         # for alleles that the gamete has to have
@@ -1,9 +1,16 @@
 import pandas as pd
+import numpy as np
 from itertools import chain
 from operator import add
 from functools import reduce
 
 from pydigree.common import table
+from pydigree.individual import Individual
+from pydigree.genotypes import GenotypeMatrix, AlleleFrequencies
+from pydigree.genotypes import LabelledAlleles
+from pydigree.genotypes.genotypematrix import (dense_chromatid,
+                                               chromatid_missing)
+from pydigree.genotypes.allelefrequencies import missing_alleles
 
 
 class IndividualContainer(object):
@@ -126,12 +133,261 @@ class IndividualContainer(object):
         for x in self.founders():
             x.get_founder_genotypes()
 
-    def get_genotypes(self):
-        "Have individuals request genotypes"
+    def get_genotypes(self, lazy=False):
+        """
+        Have individuals request genotypes. Nonfounders get theirs a 
+        generation at a time, with the gametes for a generation made 
+        together by Individual.gametes.
+
+        :param lazy: give nonfounders MosaicAlleles that refer to their 
+            parents' chromatids instead of copies
+        :type lazy: bool
+        """
+        pending = []
         for x in self.individuals:
-            x.get_genotypes()
+            if x.is_founder() or x.has_genotypes():
+                x.get_genotypes()
+            else:
+                pending.append(x)
+
+        while pending:
+            waiting = set(pending)
+            ready = [x for x in pending
+                     if x.father not in waiting and x.mother not in waiting]
+            pending = [x for x in pending 
+                       if x.father in waiting or x.mother in waiting]
+
+            gametes = Individual.gametes([x.father for x in ready] +
+                                         [x.mother for x in ready],
+                                         lazy=lazy)
+            for x, paternal, maternal in zip(ready, gametes, 
+                                             gametes[len(ready):]):
+                x.genotypes = Individual.fertilize(paternal, maternal)
+
+    def delabel_genotypes(self, individuals=None):
+        """
+        Replaces label genotypes with the alleles they were inherited 
+        from, for many individuals at once. Each chromosome is delabelled 
+        with one call to LabelledAlleles.delabel_many.
+
+        :param individuals: individuals to delabel (default: nonfounders)
+        :type individuals: sequence of Individual
+
+        :rtype: void
+        """
+        if individuals is None:
+            individuals = self.nonfounders()
+        individuals = [x for x in individuals if x.has_genotypes()]
+        if not individuals:
+            return
+
+        for chromidx in range(len(individuals[0].genotypes)):
+            chromatids = [chromatid for x in individuals 
+                          for chromatid in x.genotypes[chromidx]]
+            delabelled = LabelledAlleles.delabel_many(chromatids)
+            for i, x in enumerate(individuals):
+                x.genotypes[chromidx] = [delabelled[2 * i],
+                                         delabelled[2 * i + 1]]
+
+    def build_genotype_matrix(self, directory=None):
+        """
+        Copies the genotypes of every genotyped individual into a 
+        GenotypeMatrix, and replaces their genotypes with views into it. 
+        The matrix is kept as genotype_matrix.
+
+        :param directory: if given, store the matrix in memory-mapped files
+            in this directory
+        :type directory: string
+
+        :returns: the matrix
+        :rtype: GenotypeMatrix
+        """
+        self.genotype_matrix = GenotypeMatrix.from_individuals(
+            self.individuals, self.chromosomes, directory=directory)
+        return self.genotype_matrix
 
     # Genotype frequency functions
+    def genotype_array(self, chrom, constraint=None):
+        """
+        Stacks the genotypes of every genotyped individual on a chromosome
+        into one array. If the collection has a genotype_matrix holding 
+        everyone, its arrays are used without copying.
+
+        :param chrom: index of the chromosome
+        :param constraint: Function that acts on an individual. If
+            constraint(individual) can evaluate as True that person is included
+        :type chrom: int
+        :type constraint: callable
+
+        :returns: alleles, with shape (individuals, 2, markers)
+        :rtype: numpy array
+        """
+        return self._stack_genotypes(self._genotyped(constraint), chrom)
+
+    def missing_array(self, chrom, constraint=None):
+        """
+        Finds the missing alleles of every genotyped individual on a
+        chromosome, by each chromatid's own missing code. Rows and columns
+        line up with genotype_array.
+
+        :param chrom: index of the chromosome
+        :param constraint: Function that acts on an individual. If
+            constraint(individual) can evaluate as True that person is included
+        :type chrom: int
+        :type constraint: callable
+
+        :returns: missingness, with shape (individuals, 2, markers)
+        :rtype: numpy array of bool
+        """
+        return self._stack_missing(self._genotyped(constraint), chrom)
+
+    def _genotyped(self, constraint=None):
+        return [x for x in self.individuals if x.has_genotypes() and
+                (constraint is None or constraint(x))]
+
+    def _stack_genotypes(self, inds, chrom, positions=None):
+        matrix = getattr(self, 'genotype_matrix', None)
+        if matrix is not None and all(x in matrix.index for x in inds):
+            matrix.refresh()
+            arr = matrix[chrom]
+            rows = np.array([matrix.index[x] for x in inds], dtype=np.intp)
+            if not (rows.shape[0] == matrix.nind and 
+                    (rows == np.arange(matrix.nind)).all()):
+                arr = arr[rows]
+            return arr if positions is None else arr[:, :, positions]
+
+        if positions is None:
+            nmark = self.chromosomes[chrom].nmark()
+        else:
+            nmark = len(positions)
+
+        if not inds:
+            return np.zeros((0, 2, nmark))
+
+        return np.array([[dense_chromatid(h, positions)
+                          for h in x.genotypes[chrom]]
+                         for x in inds])
+
+    def _stack_missing(self, inds, chrom, positions=None):
+        # Missingness comes from each chromatid's own missing code, since
+        # the dense arrays from _stack_genotypes lose it (e.g. 0 is the
+        # reference allele in sparse containers, not a missing one)
+        matrix = getattr(self, 'genotype_matrix', None)
+        if matrix is not None and all(x in matrix.index for x in inds):
+            return missing_alleles(self._stack_genotypes(inds, chrom,
+                                                         positions))
+
+        if positions is None:
+            nmark = self.chromosomes[chrom].nmark()
+        else:
+            nmark = len(positions)
+
+        if not inds:
+            return np.zeros((0, 2, nmark), dtype=np.bool_)
+
+        return np.array([[chromatid_missing(h, positions)
+                          for h in x.genotypes[chrom]]
+                         for x in inds])
+
+    def allele_frequencies(self, chrom=None, constraint=None):
+        """
+        Counts alleles at every locus of a chromosome (or of every 
+        chromosome) in one pass over the genotypes.
+
+        :param chrom: index of the chromosome, or None for all of them
+        :param constraint: Function that acts on an individual. If
+            constraint(individual) can evaluate as True that person is included
+        :type chrom: int
+        :type constraint: callable
+
+        :returns: allele counts, frequencies, major and minor alleles and
+            call rates for each locus
+        :rtype: AlleleFrequencies, or a list of them if chrom is None
+        """
+        if chrom is None:
+            return [self.allele_frequencies(i, constraint)
+                    for i in range(len(self.chromosomes))]
+
+        inds = self._genotyped(constraint)
+        return AlleleFrequencies(self._stack_genotypes(inds, chrom),
+                                 chromosome=self.chromosomes[chrom],
+                                 missing=self._stack_missing(inds, chrom))
+
+    def missingness_by_locus(self, chrom=None, constraint=None):
+        """
+        Returns the proportion of genotyped individuals missing a genotype
+        at each locus, as in genotype_missingness. 
+
+        :param chrom: index of the chromosome, or None for all of them
+        :param constraint: Function that acts on an individual. If
+            constraint(individual) can evaluate as True that person is included
+        :type chrom: int
+        :type constraint: callable
+
+        :rtype: numpy array of floats, or a list of them if chrom is None
+        """
+        if chrom is None:
+            return [self.missingness_by_locus(i, constraint)
+                    for i in range(len(self.chromosomes))]
+
+        missing = self._stack_missing(self._genotyped(constraint), chrom)
+        with np.errstate(invalid='ignore'):
+            return missing.all(axis=1).mean(axis=0)
+
+    def dosage_matrix(self, loci, allele=None, individuals=None):
+        """
+        Counts copies of an allele at a batch of loci for a set of 
+        individuals, with one fancy indexing pass per chromosome.
+
+        :param loci: (chromosome, marker) indices of the loci
+        :param allele: the allele to count, either one for every locus or
+            a sequence with one per locus. If not given, the minor allele 
+            among the individuals is counted at each locus.
+        :param individuals: individuals to include, in row order. Defaults
+            to every genotyped individual in the collection.
+        :type loci: sequence of 2-tuples
+        :type individuals: sequence of Individual
+
+        :returns: allele counts with shape (individuals, loci). Genotypes
+            with a missing allele are NaN.
+        :rtype: numpy array of floats
+        """
+        if individuals is None:
+            individuals = [x for x in self.individuals if x.has_genotypes()]
+        individuals = list(individuals)
+        loci = list(loci)
+
+        if allele is not None and np.ndim(allele) > 0:
+            if len(allele) != len(loci):
+                raise ValueError('Need one allele per locus')
+        elif allele is not None:
+            allele = [allele] * len(loci)
+
+        out = np.empty((len(individuals), len(loci)), dtype=np.float64)
+        
+        chroms = sorted({chrom for chrom, _ in loci})
+        for chrom in chroms:
+            cols = [i for i, (c, _) in enumerate(loci) if c == chrom]
+            positions = np.array([loci[i][1] for i in cols], dtype=np.intp)
+            genotypes = self._stack_genotypes(individuals, chrom, positions)
+            missing = self._stack_missing(individuals, chrom, positions)
+
+            if allele is None:
+                freqs = AlleleFrequencies(genotypes, missing=missing)
+                counted = freqs.minor_allele
+                # Monomorphic loci have no minor allele to count
+                present = freqs.maf > 0
+            else:
+                counted = np.array([allele[i] for i in cols])
+                present = np.ones(len(cols), dtype=np.bool_)
+
+            hits = (genotypes == counted) & present
+            dosage = hits.sum(axis=1).astype(np.float64)
+            dosage[missing.any(axis=1)] = np.nan
+            out[:, cols] = dosage
+
+        return out
+
     def genotype_missingness(self, location):
         """
         Returns the percentage of individuals in the population missing a
@@ -298,7 +298,8 @@ def write_phenotypes(pedigrees, filename, predicate=None,
             ofile.write(row + '\n')
 
 
-def genotypes_from_sequential_alleles(chromosomes, data, missing_code='0'):
+def genotypes_from_sequential_alleles(chromosomes, data, missing_code='0',
+                                      encode=False):
     '''
     Takes a series of alleles and turns them into genotypes.
 
@@ -316,9 +317,12 @@ def genotypes_from_sequential_alleles(chromosomes, data, missing_code='0'):
     :param chromosomes: genotype data
     :param data: The alleles to be turned into genotypes
     :param missing_code: value representing a missing allele
+    :param encode: store text alleles as int8 codes from each chromosome's
+        allele table (see ChromosomeTemplate.encode_alleles)
 
     :type chromosomes: list of ChromosomeTemplate
     :type missing_code: string
+    :type encode: bool
     :returns: A list of 2-tuples of Alleles objects
     '''
 
@@ -343,8 +347,14 @@ def genotypes_from_sequential_alleles(chromosomes, data, missing_code='0'):
     for chrom in chromosomes:
         size = chrom.nmark()
         stop = start + size
-        chroma = Alleles(strand_a[start:stop], template=chrom)
-        chromb = Alleles(strand_b[start:stop], template=chrom)
+        if encode:
+            chroma = Alleles(chrom.encode_alleles(strand_a[start:stop]),
+                             template=chrom)
+            chromb = Alleles(chrom.encode_alleles(strand_b[start:stop]),
+                             template=chrom)
+        else:
+            chroma = Alleles(strand_a[start:stop], template=chrom)
+            chromb = Alleles(strand_b[start:stop], template=chrom)
 
         genotypes.append((chroma, chromb))
         start += size
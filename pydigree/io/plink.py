@@ -2,11 +2,15 @@
 
 from pydigree.common import interleave
 from pydigree.genotypes import ChromosomeTemplate, ChromosomeSet, SparseAlleles
+from pydigree.genotypes import GenotypeMatrix
 from pydigree.io.base import read_ped
 from pydigree.io.base import genotypes_from_sequential_alleles as gt_from_seq
 from pydigree.exceptions import FileFormatError
 from pydigree.io.smartopen import smartopen
 import collections
+from functools import partial
+
+import numpy as np
 
 
 def create_pop_handler_func(mapfile):
@@ -36,18 +40,21 @@ def create_pop_handler_func(mapfile):
     return pop_handler
 
 
-def plink_data_handler(ind, data):
+def plink_data_handler(ind, data, encode=False):
     """
     A function to handle the data payload from a plink line.
 
     :param ind: Individual for the record
     :param data: the data for the record
+    :param encode: store alleles as int8 codes instead of text
     :type ind: Individual
     :type data: string
+    :type encode: bool
 
     :rtype: void
     """
-    ind.genotypes = gt_from_seq(ind.chromosomes, data, missing_code='0')
+    ind.genotypes = gt_from_seq(ind.chromosomes, data, missing_code='0',
+                                encode=encode)
 
 
 def read_map(mapfile):
@@ -88,7 +95,35 @@ def read_map(mapfile):
     return chroms
 
 
-def read_plink(pedfile=None, mapfile=None, prefix=None, **kwargs):
+def create_matrix_data_handler(directory, encode=False):
+    """
+    Creates a data handler for read_ped that writes each individual's 
+    genotypes into a memory-mapped GenotypeMatrix as it's read, so only 
+    one individual's genotypes are held in memory at a time.
+
+    :param directory: directory for the matrix files
+    :param encode: store alleles as int8 codes instead of text
+    :type directory: string
+    :type encode: bool
+
+    :returns: the handler, and a list that will hold the matrix
+    :rtype: tuple
+    """
+    holder = []
+
+    def data_handler(ind, data):
+        plink_data_handler(ind, data, encode=encode)
+        if not holder:
+            holder.append(GenotypeMatrix([], ind.chromosomes,
+                                         dtype=ind.genotypes[0][0].dtype,
+                                         directory=directory))
+        holder[0].append(ind)
+
+    return data_handler, holder
+
+
+def read_plink(pedfile=None, mapfile=None, prefix=None, directory=None,
+               encode_alleles=False, **kwargs):
     '''
     Read a plink file by specifying pedfile and mapfile directly,
     or by using a prefix. Pass additional arguments to 
@@ -98,6 +133,12 @@ def read_plink(pedfile=None, mapfile=None, prefix=None, **kwargs):
     :param pedfile: a plink PED file to be read
     :param mapfile: a plink MAP file to be read
     :param prefix: sets mapfile to 'prefix.map' and pedfile to 'prefix.ped'
+    :param directory: if given, genotypes are stored in a memory-mapped
+        GenotypeMatrix in this directory (kept as genotype_matrix on the
+        returned collection)
+    :param encode_alleles: store alleles as int8 codes, with the text 
+        alleles kept in each chromosome's allele table. Comparisons on 
+        codes are much cheaper than on text, and write_plink decodes them.
     :param kwargs: additional arguments passed to read_ped
     
     Returns: A PedigreeCollection object
@@ -107,9 +148,21 @@ def read_plink(pedfile=None, mapfile=None, prefix=None, **kwargs):
         mapfile = prefix + '.map'
 
     pop_handler = create_pop_handler_func(mapfile)
-    return read_ped(pedfile, population_handler=pop_handler,
-                    data_handler=plink_data_handler, connect_inds=False,
-                    **kwargs)
+
+    if directory is None:
+        data_handler = partial(plink_data_handler, encode=encode_alleles)
+        return read_ped(pedfile, population_handler=pop_handler,
+                        data_handler=data_handler, connect_inds=False,
+                        **kwargs)
+
+    data_handler, holder = create_matrix_data_handler(directory, 
+                                                      encode=encode_alleles)
+    peds = read_ped(pedfile, population_handler=pop_handler,
+                    data_handler=data_handler, connect_inds=False, **kwargs)
+    if holder:
+        holder[0].flush()
+        peds.genotype_matrix = holder[0]
+    return peds
 
 
 def write_plink(pedigrees, filename_prefix, predicate=None, mapfile=False,
@@ -188,7 +241,10 @@ def write_ped(pedigrees, pedfile, delim=' ', predicate=None,
         """
         Gets the label of an individual, or return different value ind is None
         """
-        return ind.label if ind is not None else default
+        if ind is None:
+            return default
+        # Parents of individuals read without connect_inds are still labels
+        return getattr(ind, 'label', ind)
 
     with smartopen(pedfile, 'w') as f:
         for pedigree in pedigrees.pedigrees:
@@ -211,11 +267,18 @@ def write_ped(pedigrees, pedfile, delim=' ', predicate=None,
                     if checkchroms and template.outputlabel not in output_chromosomes:
                         continue
                     chroma, chromb = chromatids
-                    if isinstance(chroma, SparseAlleles):
+                    storage = getattr(chroma, 'storage_type', type(chroma))
+                    if issubclass(storage, SparseAlleles):
                         raise ValueError("Plink output not for Sparse Data")
 
-                    ga = chroma.astype(str).tolist()
-                    gb = chromb.astype(str).tolist()
+                    coded = np.issubdtype(np.asarray(chroma).dtype,
+                                          np.integer)
+                    if coded and template.allele_table is not None:
+                        ga = template.decode_alleles(chroma, '0').tolist()
+                        gb = template.decode_alleles(chromb, '0').tolist()
+                    else:
+                        ga = chroma.astype(str).tolist()
+                        gb = chromb.astype(str).tolist()
                     gn = interleave(ga, gb)
                     g.extend(gn)
 
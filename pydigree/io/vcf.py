@@ -1,10 +1,13 @@
 from pydigree.population import Population
 from pydigree.individual import Individual
-from pydigree.genotypes import ChromosomeTemplate
+import numpy as np
+
+from pydigree.genotypes import ChromosomeTemplate, SparseHaplotypeMatrix
 from pydigree.io import smartopen
 from pydigree.exceptions import FileFormatError
 
 from pydigree.cydigree.vcfparse import vcf_allele_parser, assign_genorow
+from pydigree.cydigree.vcfparse import genorow_arrays
 
 class VCFRecord(object):
     ''' A class for parsing lines in VCF files '''
@@ -87,7 +90,8 @@ def _vcf_get_infofreq(info, freq_info):
 
     return freq 
 
-def read_vcf(filename, require_pass=False, freq_info=None):
+def read_vcf(filename, require_pass=False, freq_info=None, freeze=False,
+             matrix=False):
     """
     Reads a VCF file and returns a Population object with the
     individuals represented in the file
@@ -98,6 +102,13 @@ def read_vcf(filename, require_pass=False, freq_info=None):
     :type require_pass: bool
     :param freq_info: INFO field to get allele frequency from
     :param freq_info: string
+    :param freeze: move genotypes to the compact read-only sparse backend
+        after reading (see SparseAlleles.freeze)
+    :type freeze: bool
+    :param matrix: store the genotypes for each chromosome in one 
+        SparseHaplotypeMatrix (kept in Population.haplotype_matrices), with
+        each individual's chromatids read from it
+    :type matrix: bool
 
     :returns: Individuals in the VCF
     :rtype: Population
@@ -138,6 +149,11 @@ def read_vcf(filename, require_pass=False, freq_info=None):
 
         pop.add_chromosome(chromobj)
         pop.chromosomes.finalize()
+
+    if matrix:
+        _vcf_build_matrices(pop, inds, genotypes)
+        return pop
+
     for ind in inds:
         # Initialize new genotypes
         ind._init_genotypes(sparse=True)
@@ -157,8 +173,41 @@ def read_vcf(filename, require_pass=False, freq_info=None):
 
         # Kill the row so we don't end up with the whole dataset in memory twice
         genotypes[raw] = None
+
+    if freeze:
+        for ind in inds:
+            for chromatids in ind.genotypes:
+                for chromatid in chromatids:
+                    chromatid.freeze()
     
     return pop
 
 
 
+
+def _vcf_build_matrices(pop, inds, genotypes):
+    nhaplotypes = 2 * len(inds)
+    matrices = []
+    rowidx = 0
+    for chromobj in pop.chromosomes:
+        rows, cols, values = [], [], []
+        for markidx in range(chromobj.nmark()):
+            haps, alleles = genorow_arrays(genotypes[rowidx])
+            rows.append(np.full(haps.shape[0], markidx, dtype=np.uint32))
+            cols.append(haps)
+            values.append(alleles)
+            
+            # Drop the row so we don't end up with the data in memory twice
+            genotypes[rowidx] = None
+            rowidx += 1
+
+        mat = SparseHaplotypeMatrix.from_triplets(
+            np.concatenate(rows) if rows else [],
+            np.concatenate(cols) if cols else [],
+            np.concatenate(values) if values else [],
+            chromobj.nmark(), nhaplotypes, template=chromobj)
+        matrices.append(mat)
+
+    pop.haplotype_matrices = matrices
+    for i, ind in enumerate(inds):
+        ind.genotypes = [mat.chromatids(i) for mat in matrices]
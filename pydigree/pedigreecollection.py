@@ -8,6 +8,7 @@ class PedigreeCollection(IndividualContainer):
 
     def __init__(self, peds=None):
         self.container = {}
+        self.genotype_matrix = None
         if peds:
             for ped in peds:
                 self.add_pedigree(ped)
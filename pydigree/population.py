@@ -60,6 +60,8 @@ class Population(IndividualContainer):
     def __init__(self, intial_pop_size=0, name=None):
         self.chromosomes = ChromosomeSet()
         self.pool = None
+        self.haplotype_matrices = None
+        self.genotype_matrix = None
         self.population = {}
         self.n0 = intial_pop_size
         self.name = name
@@ -220,21 +222,15 @@ class Population(IndividualContainer):
         from the chromosome pool. If there is no pool, genotypes are generated
         under linkage equilibrium
         '''
-        for ind in self.individuals:
-            if not self.pool:
-                genotypes = self.get_linkage_equilibrium_genotypes()
-            else: 
-                genotypes = self.pool.get_genotype_set()
-
-            ind.genotypes = genotypes
+        if not self.pool:
+            genotype_sets = self.get_linkage_equilibrium_genotype_sets(
+                len(self.individuals))
+            for ind, genotypes in zip(self.individuals, genotype_sets):
+                ind.genotypes = genotypes
+            return
 
-    def get_genotypes(self):
-        ''' 
-        Causes each Individual object in the pedigree to request genotypes
-        from its parents
-        '''
-        for x in self.individuals:
-            x.get_genotypes()
+        for ind in self.individuals:
+            ind.genotypes = self.pool.get_genotype_set()
 
     def get_linkage_equilibrium_genotypes(self):
         '''
@@ -244,4 +240,23 @@ class Population(IndividualContainer):
                  c.linkageequilibrium_chromosome()]
                 for c in self.chromosomes]
 
+    def get_linkage_equilibrium_genotype_sets(self, n, sparse=False):
+        '''
+        Returns sets of genotypes for many individuals in linkage
+        equilibrium. The 2n chromatids for each chromosome are drawn at
+        once, and dense chromatids are views into the rows of one matrix.
+
+        :param n: number of individuals
+        :param sparse: should the chromatids be sparse
+        :type n: int
+        :type sparse: bool
+
+        :returns: a set of genotypes for each individual
+        :rtype: list
+        '''
+        chromatids = [c.linkageequilibrium_chromosomes(2 * n, sparse=sparse)
+                      for c in self.chromosomes]
+        return [[[chrom[2 * i], chrom[2 * i + 1]] for chrom in chromatids]
+                for i in range(n)]
+
 
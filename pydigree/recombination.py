@@ -2,84 +2,216 @@
 Functions for recombining haploid chromosomes
 """
 
-from bisect import bisect_left
-from pydigree.genotypes import AlleleContainer
+from pydigree.genotypes import AlleleContainer, Alleles, MosaicAlleles
+from pydigree.genotypes import LabelledAlleles
 
 import numpy as np
 
 
-def recombine(chr1, chr2, genetic_map):
+def recombine(chr1, chr2, genetic_map, lazy=False):
     """
     Takes two chromatids and returns a simulated one by an exponential process
     
     :param chr1: first chrom
     :param chr2: second chrom
     :param genetic_map: map positions (in centiMorgans)
+    :param lazy: return a MosaicAlleles that refers to chr1 and chr2 
+        instead of copying alleles. LabelledAlleles only copy their spans,
+        so they're always recombined directly.
     :type chr1: AlleleContainer
     :type chr2: AlleleContainer
     :type genetic_map: sequence of floats
+    :type lazy: bool
 
     :returns: Recombined chromosome
     :rtype: AlleleContainer
     """
+    _check_chromatids(chr1, chr2)
+
+    # An optimization for gene dropping procedures on IBD states.
+    # If there is only one marker, choose one at random, and return that.
+    # There's no need for searching through the map to find crossover points
+    if len(genetic_map) == 1:
+        return chr1 if np.random.randint(0, 2) else chr2
+
+    newchrom = _recombine_haldane(chr1, chr2, genetic_map, lazy=lazy)
+    return newchrom
+
+def recombine_many(chr1s, chr2s, genetic_map, lazy=False):
+    """
+    Recombines many pairs of chromatids on the same chromosome at once.
+    Crossovers for every meiosis are drawn together, and when every 
+    chromatid is a dense Alleles the gametes are rows of one array.
+
+    :param chr1s: first chromatid of each pair
+    :param chr2s: second chromatid of each pair
+    :param genetic_map: map positions (in centiMorgans)
+    :param lazy: return MosaicAlleles instead of copying alleles (except
+        for LabelledAlleles, as in recombine)
+    :type chr1s: sequence of AlleleContainer
+    :type chr2s: sequence of AlleleContainer
+    :type genetic_map: sequence of floats
+    :type lazy: bool
+
+    :returns: a recombined chromatid for each pair
+    :rtype: list of AlleleContainer
+    """
+    if len(chr1s) != len(chr2s):
+        raise ValueError('Different numbers of chromatids')
+
+    for chr1, chr2 in zip(chr1s, chr2s):
+        _check_chromatids(chr1, chr2)
+
+    if len(genetic_map) == 1:
+        first = np.random.randint(0, 2, size=len(chr1s))
+        return [pair[f] for pair, f in zip(zip(chr1s, chr2s), first)]
+
+    breaks, offsets, first = crossover_indices(genetic_map, len(chr1s))
+
+    if lazy and not (chr1s and _labelled(chr1s[0])):
+        return [MosaicAlleles(chr1, chr2, breaks[offsets[i]:offsets[i + 1]],
+                              first[i])
+                for i, (chr1, chr2) in enumerate(zip(chr1s, chr2s))]
+
+    if chr1s and all(type(c) is Alleles for c in chr1s):
+        dtype = _batch_dtype(chr1s)
+        if dtype is not None:
+            return _assemble_dense(chr1s, chr2s, breaks, offsets, first,
+                                   dtype)
+
+    nmark = len(genetic_map)
+    return [_assemble(chr1, chr2, breaks[offsets[i]:offsets[i + 1]], first[i],
+                      nmark)
+            for i, (chr1, chr2) in enumerate(zip(chr1s, chr2s))]
+
+
+def crossover_indices(genetic_map, nmeioses=1):
+    """
+    Draws crossovers for many meioses at once under the Haldane map 
+    function: a Poisson number of crossovers for each meiosis, placed 
+    uniformly along the map. A crossover at index i means the gamete 
+    switches chromatids at marker i. 
+
+    :param genetic_map: map positions (in centiMorgans)
+    :param nmeioses: number of meioses
+    :type genetic_map: sequence of floats
+    :type nmeioses: int
+
+    :returns: sorted crossover indices of every meiosis (concatenated), the
+        offset of each meiosis's crossovers in that array, and the 
+        chromatid (0 or 1) each meiosis starts on
+    :rtype: tuple of numpy arrays
+    """
+    genetic_map = np.asarray(genetic_map)
+    maxmap = max(genetic_map[-1], 0)
+
+    counts = np.random.poisson(maxmap / 100.0, size=nmeioses)
+    offsets = np.zeros(nmeioses + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    # Sort positions within each meiosis
+    positions = np.random.uniform(0, maxmap, size=offsets[-1])
+    meiosis = np.repeat(np.arange(nmeioses), counts)
+    positions = positions[np.lexsort((positions, meiosis))]
+
+    breaks = np.searchsorted(genetic_map, positions, side='left')
+    first = np.random.randint(0, 2, size=nmeioses)
+    return breaks, offsets, first
+
+
+def crossover_mask(genetic_map, nmeioses=1):
+    """
+    Draws which chromatid every marker of many gametes comes from
+
+    :param genetic_map: map positions (in centiMorgans)
+    :param nmeioses: number of meioses
+    :type genetic_map: sequence of floats
+    :type nmeioses: int
+
+    :returns: True where a gamete's marker comes from the second chromatid
+    :rtype: numpy array of bool, shape (nmeioses, markers)
+    """
+    nmark = len(genetic_map)
+    if nmark == 1:
+        return np.random.randint(0, 2, size=(nmeioses, 1)).astype(np.bool_)
+
+    breaks, offsets, first = crossover_indices(genetic_map, nmeioses)
+
+    # Each crossover flips which chromatid the rest of the gamete is from
+    flips = np.zeros((nmeioses, nmark + 1), dtype=np.uint8)
+    flips[:, 0] = first
+    meiosis = np.repeat(np.arange(nmeioses), np.diff(offsets))
+    np.add.at(flips, (meiosis, breaks), 1)
+    # (uint8 sums wrap around, but keep their parity)
+    parity = np.cumsum(flips[:, :nmark], axis=1, dtype=np.uint8) & 1
+    return parity.astype(np.bool_)
+
+
+def _check_chromatids(chr1, chr2):
     if not isinstance(chr1, AlleleContainer): 
         raise ValueError(
             'Invalid chromosome type for recombination: {}'.format(type(chr1))) 
 
-    if type(chr1) is not type(chr2):
+    if _storage_type(chr1) is not _storage_type(chr2):
         raise ValueError("Can't mix chromosome types in recombination")
 
     if chr1.dtype != chr2.dtype:
         raise ValueError('Chromosomes have different data types')
 
-    # An optimization for gene dropping procedures on IBD states.
-    # If there is only one marker, choose one at random, and return that.
-    # There's no need for searching through the map to find crossover points
-    if len(genetic_map) == 1:
-        return chr1 if np.random.randint(0, 2) else chr2
 
-    newchrom = _recombine_haldane(chr1, chr2, genetic_map)
-    return newchrom
+def _storage_type(chromatid):
+    if isinstance(chromatid, MosaicAlleles):
+        return chromatid.storage_type
+    return type(chromatid)
 
-def _recombine_haldane(chr1, chr2, genetic_map):    
 
-    # The map is sorted list, and the last item will always be largest.
-    maxmap = genetic_map[-1]
-    nmark = len(genetic_map)
-    
-    # Return a new genotype container with the same specs as chr1
-    newchrom = chr1.empty_like() 
+def _labelled(chromatid):
+    return _storage_type(chromatid) is LabelledAlleles
 
-    # Randomly pick a chromosome to start from
-    # np.random.randint works on a half open interval, so the upper bound
-    # specified is 2. We'll get zeros and ones out of it.
-    flipped = np.random.randint(0, 2)
-
-    last_crossover_index = 0
-    crossover_position = 0
-    while True:
-        # Get from the next chromosome
-        flipped = not flipped
-        c = chr1 if flipped else chr2
-
-        # Find the next crossover point
-        # np.random.exponential is parameterized with the RECIPROCAL of the
-        # rate parameter. With random.expovariate I would have used (0.01),
-        # here I supply 100 as an argument.
-        crossover_position += np.random.exponential(100)
-
-        if crossover_position > maxmap:
-            # We've reached the end of our journey here.
-            newchrom.copy_span(c, last_crossover_index, None)
-            break
-
-        # Find the next crossover point in the chromosome by binary search
-        nextidx = bisect_left(genetic_map, crossover_position, 
-                              last_crossover_index, nmark)
-        
-        newchrom.copy_span(c, last_crossover_index, nextidx)
-
-        # Get ready to do it all over again
-        last_crossover_index = nextidx
 
+def _assemble(chr1, chr2, breaks, first, nmark):
+    "Copies the segments between crossovers into a new chromatid"
+    newchrom = chr1.empty_like() 
+    chroms = (chr1, chr2) if first == 0 else (chr2, chr1)
+    bounds = [0] + breaks.tolist() + [nmark]
+    for i, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+        if start != stop:
+            newchrom.copy_span(chroms[i % 2], start, stop)
     return newchrom
+
+
+def _batch_dtype(chromatids):
+    "The type of an array that can hold all the chromatids, if there is one"
+    dtypes = {c.dtype for c in chromatids}
+    if len(dtypes) == 1:
+        return dtypes.pop()
+    # Text alleles only differ in width, e.g. between PLINK individuals
+    kinds = {x.kind for x in dtypes}
+    if kinds == {'U'} or kinds == {'S'}:
+        return np.result_type(*dtypes)
+    return None
+
+
+def _assemble_dense(chr1s, chr2s, breaks, offsets, first, dtype):
+    "Builds dense gametes as rows of one array"
+    nmark = chr1s[0].nmark()
+    out = np.empty((len(chr1s), nmark), dtype=dtype)
+
+    breaks, offsets = breaks.tolist(), offsets.tolist()
+    for i, (chr1, chr2) in enumerate(zip(chr1s, chr2s)):
+        chroms = (chr1, chr2) if first[i] == 0 else (chr2, chr1)
+        chroms = [np.asarray(c) for c in chroms]
+        bounds = [0] + breaks[offsets[i]:offsets[i + 1]] + [nmark]
+        row = out[i]
+        for j in range(len(bounds) - 1):
+            start, stop = bounds[j], bounds[j + 1]
+            row[start:stop] = chroms[j % 2][start:stop]
+
+    return [Alleles(g, template=c.template) for g, c in zip(out, chr1s)]
+
+
+def _recombine_haldane(chr1, chr2, genetic_map, lazy=False):
+    breaks, _, first = crossover_indices(genetic_map)
+    if lazy and not _labelled(chr1):
+        return MosaicAlleles(chr1, chr2, breaks, first[0])
+    return _assemble(chr1, chr2, breaks, first[0], len(genetic_map))
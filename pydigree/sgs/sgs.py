@@ -8,6 +8,7 @@ from scipy.sparse import lil_matrix
 
 from pydigree.ibs import get_ibs_states
 from pydigree.cydigree.cyfuncs import set_intervals_to_value, runs_gte_uint8
+from pydigree.cydigree.cyfuncs import runs_gte_from_runs
 from pydigree.io import smartopen as open
 from pydigree import Individual, ChromosomeTemplate
 from functools import reduce
@@ -430,11 +431,15 @@ def sgs_unphased(ind1, ind2, chromosome_idx, seed_size=255,
     ''' Returns IBD states for each marker along a chromosome '''
 
     chromosome = ind1.chromosomes[chromosome_idx]
-    identical = get_ibs_states(ind1, ind2, chromosome_idx)
+    identical, run_starts, run_states = get_ibs_states(ind1, ind2, 
+                                                       chromosome_idx, 
+                                                       runs=True)
+    state_runs = run_starts, run_states
     nmark = chromosome.nmark()
 
     # First get the segments that are IBD=1
     ibd1_segs = list(_process_segments(identical, min_seg=seed_size,
+                                       state_runs=state_runs,
                                        min_val=1, chromobj=chromosome,
                                        min_length=min_length,
                                        size_unit=size_unit,
@@ -444,6 +449,7 @@ def sgs_unphased(ind1, ind2, chromosome_idx, seed_size=255,
 
     # Then the segments that are IBD=2
     ibd2_segs = list(_process_segments(identical, min_seg=seed_size,
+                                       state_runs=state_runs,
                                        min_val=2, chromobj=chromosome,
                                        min_length=min_length,
                                        size_unit=size_unit,
@@ -462,9 +468,15 @@ def sgs_unphased(ind1, ind2, chromosome_idx, seed_size=255,
 
 def _process_segments(identical, min_seg=100, min_val=1, chromobj=None,
                       min_density=100, size_unit='mb',
-                      min_length=1, maxmiss=0.25):
-    # IBD segments are long runs of identical genotypes
-    ibd = runs_gte_uint8(identical, min_val, minlength=min_seg)
+                      min_length=1, maxmiss=0.25, state_runs=None):
+    # IBD segments are long runs of identical genotypes. If the runs of
+    # identical state are already known, only they need to be visited.
+    if state_runs is not None:
+        starts, values = state_runs
+        ibd = runs_gte_from_runs(starts, values, identical.shape[0], min_val,
+                                 minlength=min_seg)
+    else:
+        ibd = runs_gte_uint8(identical, min_val, minlength=min_seg)
 
     if not ibd:
         return ibd
@@ -4,7 +4,7 @@ from itertools import chain
 
 import numpy as np
 
-from pydigree.recombination import recombine
+from pydigree.recombination import recombine_many
 
 
 def richards(A, C, M, B, T):
@@ -79,23 +79,15 @@ class ChromosomePool(object):
         # non-integer values, which doesn't make much sense here.
         gensize = int(gensize)
         for i, c in enumerate(self.chromosomes):
-
-            # Chromosomes have a 1/2 chance of being recombined with another
-            def choose_chrom(pool, chrmap):
-                """
-                Get two random chromosomes, recombine them, return the result
-                """
-                # Since Alleles is a subclass of ndarray, numpy has been
-                # treating pool as a multidimensional array. We'll generate
-                # the indices ourself and get them that way. Eventually
-                # I'll come back and fix the isinstancing of Alleles.
-                qi, qw = np.random.randint(0, len(pool), 2)
-                q, w = pool[qi], pool[qw]
-                r = recombine(q, w, chrmap)
-                return r
-
-            newpool = [choose_chrom(self.pool[i], c.genetic_map)
-                       for x in range(gensize)]
+            # Pick two random chromosomes for each member of the new pool 
+            # and recombine every pair at once. The pool is indexed as a 
+            # list, since numpy would treat a list of Alleles as a 
+            # multidimensional array.
+            pool = self.pool[i]
+            picks = np.random.randint(0, len(pool), (gensize, 2))
+            newpool = recombine_many([pool[q] for q in picks[:, 0]],
+                                     [pool[w] for w in picks[:, 1]],
+                                     c.genetic_map)
             self.pool[i] = newpool
 
     # Chromosome functions
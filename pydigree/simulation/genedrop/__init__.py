@@ -2,3 +2,4 @@
 
 from .constrained_mendelian import ConstrainedMendelianSimulation
 from .naivegenedrop import NaiveGeneDroppingSimulation
+from .batch import BatchGeneDrop
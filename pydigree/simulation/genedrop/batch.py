@@ -0,0 +1,149 @@
+"Gene dropping many replicates at once"
+
+import numpy as np
+
+from pydigree.recombination import crossover_mask
+
+
+class BatchGeneDrop(object):
+    """
+    Simulates inheritance through a pedigree for many replicates at once.
+
+    Each chromatid is represented by the founder chromatid every marker
+    came from, coded 2 * f + h for haplotype h of the fth founder in
+    founders. The origins for a chromosome are kept in one array of
+    shape (replicates, individuals, 2, markers), and each generation's
+    meioses are drawn for every replicate together. Genotypes for all of
+    the replicates are then filled in from founder alleles with one
+    gather (see genotypes).
+    """
+
+    def __init__(self, pedigree, chromosomes=None):
+        """
+        Create the simulation
+
+        :param pedigree: the pedigree to drop genes through
+        :param chromosomes: chromosomes to simulate (default: the
+            pedigree's)
+        :type pedigree: IndividualContainer
+        :type chromosomes: ChromosomeSet
+        """
+        self.chromosomes = (chromosomes if chromosomes is not None
+                            else pedigree.chromosomes)
+        self.founders = pedigree.founders()
+
+        # Order nonfounders so parents come before their children, and
+        # group them into generations that can be simulated together
+        self.individuals = list(self.founders)
+        self.index = {ind: i for i, ind in enumerate(self.individuals)}
+        self.generations = []
+        pending = pedigree.nonfounders()
+        while pending:
+            ready = [x for x in pending
+                     if x.father in self.index and x.mother in self.index]
+            if not ready:
+                raise ValueError('Parents missing from pedigree')
+            for x in ready:
+                self.index[x] = len(self.individuals)
+                self.individuals.append(x)
+            self.generations.append(
+                (np.array([self.index[x] for x in ready]),
+                 np.array([self.index[x.father] for x in ready]),
+                 np.array([self.index[x.mother] for x in ready])))
+            pending = [x for x in pending if x not in self.index]
+
+    @property
+    def nfounders(self):
+        "The number of founders in the pedigree"
+        return len(self.founders)
+
+    def simulate(self, replicates):
+        """
+        Drops founder labels through the pedigree
+
+        :param replicates: number of replicates
+        :type replicates: int
+
+        :returns: founder chromatid origins for each chromosome
+        :rtype: list of numpy arrays of int32, each with shape
+            (replicates, individuals, 2, markers)
+        """
+        return [self._simulate_chromosome(c, replicates)
+                for c in self.chromosomes]
+
+    def _simulate_chromosome(self, chromosome, replicates):
+        nmark = chromosome.nmark()
+        origins = np.empty((replicates, len(self.individuals), 2, nmark),
+                           dtype=np.int32)
+
+        labels = np.arange(2 * self.nfounders, dtype=np.int32)
+        origins[:, :self.nfounders] = labels.reshape(-1, 2, 1)
+
+        for kids, fathers, mothers in self.generations:
+            for hap, parents in enumerate((fathers, mothers)):
+                parental = origins[:, parents]
+                second = crossover_mask(chromosome.genetic_map,
+                                        replicates * len(kids))
+                second = second.reshape(replicates, len(kids), nmark)
+                origins[:, kids, hap] = np.where(second,
+                                                 parental[:, :, 1],
+                                                 parental[:, :, 0])
+        return origins
+
+    def genotypes(self, origins, chromidx, founder_alleles=None):
+        """
+        Fills in alleles for every individual in every replicate from the
+        founders' alleles
+
+        :param origins: origins for one chromosome, from simulate
+        :param chromidx: index of the chromosome
+        :param founder_alleles: alleles of each founder, with shape
+            (founders, 2, markers) to use the same ones in every
+            replicate or (replicates, founders, 2, markers). If None,
+            they're drawn in linkage equilibrium for each replicate.
+        :type origins: numpy array
+        :type chromidx: int
+        :type founder_alleles: numpy array
+
+        :returns: alleles with the same shape as origins
+        :rtype: numpy array
+        """
+        replicates, nind, _, nmark = origins.shape
+        if founder_alleles is None:
+            chromosome = self.chromosomes[chromidx]
+            founder_alleles = chromosome.linkageequilibrium_matrix(
+                replicates * 2 * self.nfounders)
+        founder_alleles = np.asarray(founder_alleles)
+        if founder_alleles.ndim == 3:
+            # The same founder alleles for every replicate
+            flat = founder_alleles.reshape(2 * self.nfounders, nmark)
+            return flat[origins, np.arange(nmark)]
+
+        flat = founder_alleles.reshape(replicates, 2 * self.nfounders, nmark)
+        alleles = np.take_along_axis(
+            flat, origins.reshape(replicates, 2 * nind, nmark), axis=1)
+        return alleles.reshape(origins.shape)
+
+    def ibd_states(self, origins, pairs):
+        """
+        Counts alleles shared identical by descent by pairs of individuals,
+        with the same rules as pydigree.ibs
+
+        :param origins: origins for one chromosome, from simulate
+        :param pairs: pairs of individuals
+        :type origins: numpy array
+        :type pairs: sequence of pairs of Individual
+
+        :returns: IBD states (0, 1 or 2)
+        :rtype: numpy array of uint8, shape (replicates, pairs, markers)
+        """
+        first = np.array([self.index[x] for x, _ in pairs], dtype=np.intp)
+        second = np.array([self.index[y] for _, y in pairs], dtype=np.intp)
+        a, b = origins[:, first, 0], origins[:, first, 1]
+        c, d = origins[:, second, 0], origins[:, second, 1]
+
+        a_eq_c, a_eq_d = a == c, a == d
+        b_eq_c, b_eq_d = b == c, b == d
+        states = (a_eq_c | a_eq_d | b_eq_c | b_eq_d).astype(np.uint8)
+        states += (a_eq_c & b_eq_d) | (a_eq_d & b_eq_c)
+        return states
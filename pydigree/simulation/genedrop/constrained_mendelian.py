@@ -85,8 +85,7 @@ class ConstrainedMendelianSimulation(GeneDroppingSimulation):
         else:
             siminds = self.template.nonfounders()
 
-        for nf in siminds:
-            nf.delabel_genotypes()
+        self.template.delabel_genotypes(siminds)
 
         # Predict phenotypes
         if self.trait:
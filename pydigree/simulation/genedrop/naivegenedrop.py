@@ -64,8 +64,7 @@ class NaiveGeneDroppingSimulation(GeneDroppingSimulation):
                     else:
                         founder.get_genotypes()
 
-                for nf in ped.nonfounders():
-                    nf.delabel_genotypes()
+                ped.delabel_genotypes()
 
                 if self.trait:
                     accuracy = self.predicted_trait_accuracy(ped)
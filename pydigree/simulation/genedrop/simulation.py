@@ -37,10 +37,25 @@ class GeneDroppingSimulation(object):
 
     def get_founder_genotypes(self, linkeq=True):
         geno_constraints = self.constraints['genotype']
-        
-        for ind in self.template.founders():
+        founders = self.template.founders()
+
+        for ind in founders:
             ind.clear_genotypes()
-            
+
+        # Founders drawn in linkage equilibrium get theirs in one batch for
+        # each population
+        batches = {}
+        for ind in founders:
+            pop = ind.population
+            if not ind.observed_genos and (linkeq or not pop.pool):
+                batches.setdefault(id(pop), (pop, []))[1].append(ind)
+
+        for pop, inds in batches.values():
+            genotype_sets = pop.get_linkage_equilibrium_genotype_sets(len(inds))
+            for ind, genotypes in zip(inds, genotype_sets):
+                ind.genotypes = genotypes
+
+        for ind in founders:
             if ind not in geno_constraints:
                 ind.get_genotypes(linkeq=linkeq)
             else:
@@ -66,6 +66,23 @@ class QuantitativeGeneticEffect(object):
         else:
             raise ValueError('Bad genotype: {}'.format(gt))
 
+    def genotypic_values(self, dosages):
+        """
+        The genotypic values for a batch of genotypes, as in genotypic_value
+
+        :param dosages: number of minor alleles (allele 2) in each genotype
+        :type dosages: numpy array
+
+        :returns: genotypic values, NaN where the dosage is missing
+        :rtype: numpy array of floats
+        """
+        dosages = np.asarray(dosages, dtype=np.float64)
+        if ((dosages < 0) | (dosages > 2)).any():
+            raise ValueError('Bad dosage')
+        values = dosages * self.a
+        values[dosages == 1] = self.a * (1 + self.k)
+        return values
+
     @property
     def expected_genotypic_value(self):
         """
@@ -334,6 +351,52 @@ class QuantitativeTrait(object):
             return 1 if phenotype >= self.liability_threshold else 0
         return phenotype
 
+    def predict_phenotypes(self, container, individuals=None):
+        """
+        Generates predicted phenotypes for a batch of individuals, with the
+        genotypes at every effect locus read in one dosage_matrix call
+
+        :param container: the collection the individuals are in
+        :param individuals: individuals to predict, defaults to every 
+            genotyped individual in the container
+        :type container: IndividualContainer
+        :type individuals: sequence of Individual
+
+        :returns: Trait values if quantitative, affectation status if 
+            dichotomous, in the order of individuals
+        :rtype: numpy array
+
+        Raises ValueError if an individual is missing a genotype at an
+        effect locus, since there's no phenotype (or affectation status)
+        to predict for them.
+        """
+        if individuals is None:
+            individuals = [x for x in container.individuals 
+                           if x.has_genotypes()]
+        individuals = list(individuals)
+
+        dosages = container.dosage_matrix([x.locus for x in self.effects],
+                                          allele=2, individuals=individuals)
+        missing = np.isnan(dosages)
+        if missing.any():
+            row, col = np.argwhere(missing)[0]
+            raise ValueError('Missing genotype for {} at effect locus '
+                             '{}'.format(individuals[row],
+                                         self.effects[col].locus))
+        phenotype = np.zeros(len(individuals)) + self.intercept
+        for i, eff in enumerate(self.effects):
+            phenotype += eff.genotypic_values(dosages[:, i])
+
+        if self.h2 < 1.0:
+            enviro = self.environmental_variance
+            phenotype += np.random.normal(0, np.sqrt(enviro), len(individuals))
+
+        if self.traittype == 'dichotomous':
+            if self.liability_threshold is None:
+                raise ValueError('No liability threshold set')
+            return (phenotype >= self.liability_threshold).astype(np.int64)
+        return phenotype
+
     def add_dummy_polygene_chromosomes(self, population, nloc,
                                        mean=0,
                                        sd=1,
@@ -24,12 +24,12 @@ def formatted(*cells):
     return '\t'.join([str(x) for x in cells])
 
 for chromidx, chromobj in enumerate(peds.chromosomes):
+    chromfreqs = peds.allele_frequencies(chromidx)
     for locidx, markername in enumerate(chromobj.labels):
         if args.snps is not None and markername not in onlysnps:
             continue
 
-        locus = chromidx, locidx
-        freqs = list(peds.allele_frequencies(locus).items())
+        freqs = list(chromfreqs.locus(locidx).items())
         freqs = sorted(freqs, key=lambda x: x[1], reverse=True)
         maj_allele = freqs[0][0]
         for min_allele, maf in freqs[1:]:
@@ -7,7 +7,7 @@ import argparse
 
 import numpy as np
 
-from pydigree.ibs import ibs
+from pydigree.simulation.genedrop import BatchGeneDrop
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-f', '--file', required=True,
@@ -25,6 +25,9 @@ parser.add_argument('--include-marryins',
 parser.add_argument('--scorefunction', '-s', 
                     dest='scorefunc', default='sbool')
 parser.add_argument('--seed', type=int, help='Random seed', default=None)
+parser.add_argument('--chunksize', type=lambda x: int(float(x)),
+                    default=10000, 
+                    help='Number of simulations to run at once')
 args = parser.parse_args()
 
 
@@ -32,32 +35,32 @@ if args.seed is not None:
     pydigree.set_seed(args.seed)
 
 
-def spairs(inds, loc):
+def spairs(states):
     
     "Returns total number of IBD alleles"
 
-    r = [ibs(j.get_genotype(loc, checkhasgeno=False),
-             k.get_genotype(loc, checkhasgeno=False)) 
-         for j, k in itertools.combinations(inds, 2)]
-    return sum(r)
+    return states.sum(axis=1)
 
-def sbool(inds, loc):
+def sbool(states):
     
     "Returns proportion of pairs IBD != 0"
 
-    npairs = float(len(inds) * (len(inds) - 1) / 2)
-    r = [ibs(j.get_genotype(loc, checkhasgeno=False),
-             k.get_genotype(loc, checkhasgeno=False)) > 0
-         for j, k in itertools.combinations(inds, 2)]
-    return sum(r) / npairs
+    return (states > 0).mean(axis=1)
 
 
-def genedrop(pedigree, affs, scorer, iteration):
-    if iteration % (args.niter / 10) == 0:
-        print('Simulation %s' % iteration)
-    pedigree.simulate_ibd_states(inds=affs)
-    s = scorer(affs, (0, 0))
-    return s
+def genedrop(pedigree, affs, scorer, niter):
+    "Scores IBD sharing among affecteds in niter replicates"
+    sim = BatchGeneDrop(pedigree)
+    pairs = list(itertools.combinations(affs, 2))
+    scores = []
+    for start in range(0, niter, args.chunksize):
+        print('Simulation %s' % start)
+        replicates = min(args.chunksize, niter - start)
+        origins = sim.simulate(replicates)[0]
+        # IBD states at the first marker, for every pair in every replicate
+        states = sim.ibd_states(origins, pairs)[:, :, 0]
+        scores.append(scorer(states))
+    return np.concatenate(scores)
 
 try:
     scorefunction = {'sbool': sbool, 'spairs': spairs}[args.scorefunc]
@@ -85,7 +88,7 @@ if args.remove_mif:
     naff = sum(1 for ind in peds.individuals if ind.phenotypes['affected'])
     print('{} affecteds after removing marry-in founders'.format(naff))
 
-for i, ped in enumerate(sorted(peds, key=lambda q: q.label)):
+for i, ped in enumerate(sorted(peds.pedigrees, key=lambda q: q.label)):
     if args.onlypeds and ped.label not in args.onlypeds:
         continue
 
@@ -93,7 +96,7 @@ for i, ped in enumerate(sorted(peds, key=lambda q: q.label)):
     # Clear the genotypes, if present
     ped.clear_genotypes()
 
-    affs = {x for x in ped if x.phenotypes['affected']}
+    affs = [x for x in ped.individuals if x.phenotypes['affected']]
 
     if len(affs) < 2:
         print('Error in pedigree {}: '.format(ped.label), end='') 
@@ -105,8 +108,7 @@ for i, ped in enumerate(sorted(peds, key=lambda q: q.label)):
                                                          ped.bit_size(),
                                                          args.niter))
 
-    sim_share = np.array([genedrop(ped, affs, scorefunction, x)
-                             for x in range(args.niter)])
+    sim_share = genedrop(ped, affs, scorefunction, args.niter)
     nulldist[ped.label] = sim_share
 
     print() 
@@ -128,7 +130,7 @@ for ped, dist in nulldist.items():
 if args.writedist:
     with open(args.writedist, 'w') as of:
         print("Outputting distribution to %s" % args.writedist)
-        for ped in sorted(peds, key=lambda q: q.label):
+        for ped in sorted(peds.pedigrees, key=lambda q: q.label):
             try:
                 nd = ' '.join(str(x) for x in nulldist[ped.label])
                 of.write('{} {}\n'.format(ped.label, nd))
@@ -2,7 +2,6 @@ import argparse
 import numpy as np
 import pydigree as pyd
 from pydigree.stats import MixedModel
-from pydigree.common import table
 from pydigree.stats.stattests import LikelihoodRatioTest
 
 parser = argparse.ArgumentParser()
@@ -95,6 +94,7 @@ for chromidx, chromobj in enumerate(peds.chromosomes):
     if granges and (chromobj.label not in [x[0] for x in granges]):
         continue
 
+    chromfreqs = peds.allele_frequencies(chromidx)
     for locidx, markerlabel in enumerate(chromobj.labels):
 
         if granges:
@@ -108,7 +108,7 @@ for chromidx, chromobj in enumerate(peds.chromosomes):
         if args.only is not None and markerlabel not in only:
             continue
 
-        freqs = table(peds.allele_list(locus))
+        freqs = chromfreqs.locus_counts(locidx)
         alleles = [x[0]
                    for x in sorted(list(freqs.items()),
                                    key=lambda x: x[1],
@@ -3,7 +3,7 @@ from nose.tools import raises, assert_raises
 from pydigree.population import Population
 from pydigree.individual import Individual
 from pydigree.genotypes import Alleles, SparseAlleles, ChromosomeTemplate
-from pydigree.genotypes import LabelledAlleles, InheritanceSpan
+from pydigree.genotypes import LabelledAlleles, InheritanceSpan, AncestralAllele
 from pydigree.exceptions import NotMeaningfulError
 import numpy as np
 
@@ -98,6 +98,59 @@ def test_sparsealleles_copyspan():
     c = SparseAlleles(np.array([1,1,1,1,1,1,1], dtype=np.int), refcode=1)
     a.copy_span(c, 2, 6)
     assert all(a.todense() == np.array([1,1,1,1,1,1,1]))
+
+
+def test_sparsealleles_freeze():
+    a = SparseAlleles([0, 1, 0, -1, 2], refcode=0)
+    a.freeze()
+    assert a.frozen
+    assert (a.todense() == [0, 1, 0, -1, 2]).all()
+    assert list(a.missing) == [False, False, False, True, False]
+    assert a[1] == 1
+
+    # Copies share the frozen container until one of them is written to
+    b = a.copy()
+    assert b.container is a.container
+    b[0] = 2
+    assert not b.frozen and a.frozen
+    assert a[0] == 0 and b[0] == 2
+
+    c = SparseAlleles([2, 2, 2, 2, 2], refcode=0)
+    c.freeze()
+    a.copy_span(c, 0, 2)
+    assert not a.frozen
+    assert list(a.todense()) == [2, 2, 0, -1, 2]
+
+    a.freeze()
+    assert list((a == c).tolist()) == [True, True, False, False, True]
+
+
+def test_sparsealleles_missing():
+    a = SparseAlleles([0, -1, 1, -1, 0], refcode=0)
+    assert list(a.missing) == [False, True, False, True, False]
+    assert a.missing_indices().tolist() == [1, 3]
+    assert a.missing_count() == 2
+    assert a.missing_count(2) == 1
+
+    a[1] = 1
+    assert a.missing_indices().tolist() == [3]
+    a.freeze()
+    assert a.missing_count(0, 3) == 0
+    assert list(a.missing) == [False, False, False, True, False]
+
+
+def test_sparsealleles_pickle():
+    import pickle
+    a = SparseAlleles([0, -1, 1, 2, 0], refcode=0)
+    b = pickle.loads(pickle.dumps(a))
+    assert list(b.todense()) == [0, -1, 1, 2, 0]
+    assert b.missing_indices().tolist() == [1]
+
+    a.freeze()
+    b = pickle.loads(pickle.dumps(a))
+    assert b.frozen
+    assert list(b.todense()) == [0, -1, 1, 2, 0]
+    
 #############
 # InheritanceSpan
 #############
@@ -165,3 +218,348 @@ def test_labelledallele_delabeler():
     actual_value = chromatid.delabel()
     assert all(actual_value == expected_value)
 
+
+def test_labelledalleles_copyspan():
+    p = Population()
+    c = ChromosomeTemplate()
+    for i in range(20):
+        c.add_genotype()
+    p.add_chromosome(c)
+
+    a, b = Individual(p, 1), Individual(p, 2)
+    fa = LabelledAlleles.founder_chromosome(a, 0, 1, chromobj=c)
+    fb = LabelledAlleles.founder_chromosome(b, 0, 0, chromobj=c)
+
+    x = fa.empty_like()
+    assert x.ancestors == [] and fa.ancestors == [a]
+    x.copy_span(fa, 0, 5)
+    x.copy_span(fb, 5, 12)
+    x.copy_span(fa, 12, None)
+    assert x.nspans == 3
+    assert x.starts.tolist() == [0, 5, 12]
+    assert x.stops.tolist() == [5, 12, 20]
+    assert x.spans[1] == InheritanceSpan(b, 0, 0, 5, 12)
+    assert x[4] == AncestralAllele(a, 1)
+    assert x[5] == AncestralAllele(b, 0)
+    assert x[19] == AncestralAllele(a, 1)
+    assert_raises(ValueError, x.__getitem__, 20)
+    assert_raises(ValueError, x.copy_span, fa, 3, 8)
+
+    ancestors, haps = x.origins([0, 5, 11, 12])
+    assert [x.ancestors[i] for i in ancestors] == [a, b, b, a]
+    assert haps.tolist() == [1, 0, 0, 1]
+
+    # Copying from a chromatid with different ancestor labels
+    y = fb.empty_like()
+    y.copy_span(x, 0, 8)
+    y.copy_span(fb, 8, 20)
+    assert y.spans == [InheritanceSpan(a, 0, 1, 0, 5),
+                       InheritanceSpan(b, 0, 0, 5, 8),
+                       InheritanceSpan(b, 0, 0, 8, 20)]
+
+    # Only the ancestors of the copied spans are added
+    z = fa.empty_like()
+    z.copy_span(fb, 0, 5)
+    z.copy_span(x, 5, 12)
+    z.copy_span(fb, 12, 20)
+    assert z.ancestors == [b]
+    assert x.ancestors == [a, b] and fb.ancestors == [b]
+
+
+def test_labelledalleles_delabel_many():
+    from pydigree.recombination import recombine
+    p = Population()
+    c = ChromosomeTemplate()
+    for i in range(200):
+        c.add_genotype(0.5, i)
+    c.finalize()
+    p.add_chromosome(c)
+
+    founders = [p.founder_individual() for _ in range(3)]
+    for f in founders:
+        f.label_genotypes()
+    chromatids = [recombine(founders[i % 3].genotypes[0][0],
+                            founders[(i + 1) % 3].genotypes[0][1],
+                            c.genetic_map) for i in range(6)]
+    for f in founders:
+        f.clear_genotypes()
+        f.get_genotypes(linkeq=True)
+
+    expected = [x.delabel() for x in chromatids]
+    old = LabelledAlleles.gather_span
+    try:
+        for gather_span in (0, 10 ** 6):
+            LabelledAlleles.gather_span = gather_span
+            actual = LabelledAlleles.delabel_many(chromatids)
+            assert all(type(x) is Alleles for x in actual)
+            assert all((x == y).all() for x, y in zip(actual, expected))
+    finally:
+        LabelledAlleles.gather_span = old
+
+    assert LabelledAlleles.delabel_many([]) == []
+    founders[0].label_genotypes()
+    assert_raises(ValueError, LabelledAlleles.delabel_many, chromatids)
+
+
+def test_sparse_haplotype_matrix():
+    import pickle
+    from pydigree.genotypes import SparseHaplotypeMatrix, SparseHaplotypeView
+    # 4 variants, 2 individuals
+    dense = np.array([[0, 1, 0, 0],
+                      [0, 0, -1, 2],
+                      [1, 1, 0, 0],
+                      [0, 0, 0, 0]], dtype=np.int8)
+    rows, cols = np.nonzero(dense)
+    mat = SparseHaplotypeMatrix.from_triplets(rows, cols, dense[rows, cols], 
+                                              4, 4)
+    assert mat.nnz == 5
+    assert (mat.todense() == dense).all()
+    assert mat.allele_counts(1).tolist() == [1, 0, 2, 0]
+    assert mat.allele_counts(0).tolist() == [3, 2, 2, 4]
+    assert mat.missing_counts().tolist() == [0, 1, 0, 0]
+    assert mat.carriers(2).tolist() == [0, 1]
+    assert mat.carriers(1).tolist() == [3]
+    assert mat.carriers(1, allele=-1).tolist() == [2]
+
+    a, b = mat.chromatids(1)
+    assert isinstance(a, SparseHaplotypeView) and isinstance(a, SparseAlleles)
+    assert list(a.todense()) == [0, -1, 0, 0]
+    assert a.missing_indices().tolist() == [1]
+    assert list(b.todense()) == [0, 2, 0, 0]
+    assert b[1] == 2 and b[0] == 0 and b[-3] == 2 and a[1] == -1
+    assert b[1:3].to_numpy().tolist() == [2, 0]
+    assert_raises(IndexError, b.__getitem__, 4)
+    assert b.frozen and b.missing_count() == 0
+
+    # Reads don't leave a copy of the column on the view
+    assert not b.missing.any() and (b == 0).to_numpy().tolist() == [1, 0, 1, 1]
+    assert b._container is None
+
+    # Writes thaw the view into its own container
+    b[0] = 1
+    assert not b.frozen and b._container is not None
+    assert list(b.todense()) == [1, 2, 0, 0] and b[0] == 1
+    assert mat.chromatids(1)[1][0] == 0
+
+    c = pickle.loads(pickle.dumps(a))
+    assert type(c) is SparseAlleles
+    assert list(c.todense()) == [0, -1, 0, 0]
+
+
+def test_hybridalleles():
+    from pydigree.genotypes import HybridAlleles
+    from pydigree.ibs import chromwide_ibs
+    from pydigree.recombination import recombine
+
+    data = np.zeros(40, dtype=np.int8)
+    data[10] = 1
+    data[20:30] = np.arange(10) % 3
+    data[35] = -1
+    a = HybridAlleles(data, block_size=10)
+    a.sparse_threshold = 0.15
+    a.compact()
+
+    assert a.nmark() == len(a) == 40
+    assert a.block_kinds() == ['constant', 'sparse', 'dense', 'sparse']
+    assert (np.asarray(a) == data).all()
+    assert a[10] == 1 and a[-5] == -1 and a[0] == 0
+    assert a[18:23].tolist() == data[18:23].tolist()
+    assert a.missing.nonzero()[0].tolist() == [35]
+    assert_raises(IndexError, a.__getitem__, 40)
+
+    # Span writes re-encode blocks
+    a[20:30] = 2
+    assert a.block_kinds()[2] == 'constant'
+    a[5] = 3
+    assert a.block_kinds()[0] == 'sparse'
+    data[20:30] = 2
+    data[5] = 3
+    assert (np.asarray(a) == data).all()
+    assert (a == a.todense()).all()
+
+    b = a.copy()
+    assert b.block_kinds() == a.block_kinds()
+    assert (a == b).all()
+    b[12:16] = 1
+    assert (a != b).nonzero()[0].tolist() == [12, 13, 14, 15]
+
+    c = HybridAlleles(size=40, block_size=10)
+    c.copy_span(a, 15, None)
+    assert c[:15].tolist() == [0] * 15
+    assert c[15:].tolist() == data[15:].tolist()
+
+    ibs = chromwide_ibs(a, b, a, b)
+    assert ibs[35] == 64
+    assert ibs[:35].tolist() == [2] * 35
+    assert chromwide_ibs(a, a, b, b)[12:16].tolist() == [0] * 4
+
+    gmap = np.linspace(0, 100, 40)
+    d = recombine(a, b, gmap)
+    assert isinstance(d, HybridAlleles)
+    assert d.nmark() == 40
+
+
+def test_rlealleles():
+    from pydigree.genotypes import RLEAlleles
+    from pydigree.ibs import chromwide_ibs
+    from pydigree.recombination import recombine
+
+    data = np.array([1, 1, 1, 2, 2, 0, 0, 0, 1, 1], dtype=np.uint8)
+    a = RLEAlleles(data)
+    assert a.nmark() == len(a) == 10
+    assert a.nruns == 4
+    assert a.starts.tolist() == [0, 3, 5, 8]
+    assert (np.asarray(a) == data).all()
+    assert a[4] == 2 and a[-1] == 1
+    assert a[2:6].tolist() == [1, 2, 2, 0]
+    assert a.missing.nonzero()[0].tolist() == [5, 6, 7]
+    assert a.runs(4, 9)[0].tolist() == [4, 5, 8]
+    assert_raises(IndexError, a.__getitem__, 10)
+
+    b = a.empty_like()
+    assert b.nruns == 1 and b.dtype == a.dtype
+    b.copy_span(a, 2, 7)
+    assert list(b) == [0, 0, 1, 2, 2, 0, 0, 0, 0, 0]
+    assert b.nruns == 4
+    b.copy_span(Alleles(data), 0, None)
+    assert (b == a).all()
+    assert b.nruns == 4
+
+    b[5:8] = 2
+    assert b.nruns == 3
+    b[9] = 3
+    assert list(b) == [1, 1, 1, 2, 2, 2, 2, 2, 1, 3]
+    assert (a != b).nonzero()[0].tolist() == [5, 6, 7, 9]
+    assert (a == b.todense()).tolist() == (data == np.asarray(b)).tolist()
+
+    c = RLEAlleles.from_runs([0, 4, 6], [1, 1, 2], 10)
+    assert c.nruns == 2
+    assert_raises(ValueError, RLEAlleles.from_runs, [1, 4], [1, 2], 10)
+
+    ibs = chromwide_ibs(a, b, a, a)
+    assert ibs.tolist() == [2, 2, 2, 2, 2, 64, 64, 64, 2, 1]
+
+    gmap = np.linspace(0, 100, 10)
+    d = recombine(a, b, gmap)
+    assert isinstance(d, RLEAlleles)
+    assert all(x in (y, z) for x, y, z in zip(d, a, b))
+
+
+def test_packedalleles():
+    from pydigree.genotypes import PackedAlleles
+    from pydigree.recombination import recombine
+
+    data = np.random.randint(0, 3, 100).astype(np.uint8)
+    a = PackedAlleles(data)
+    assert a.nmark() == len(a) == 100
+    assert a.nwords == 4
+    assert (np.asarray(a) == data).all()
+    assert a[37] == data[37] and a[-1] == data[-1]
+    assert a[30:70].tolist() == data[30:70].tolist()
+    assert (a.missing == (data == 0)).all()
+    assert_raises(IndexError, a.__getitem__, 100)
+    assert_raises(ValueError, PackedAlleles, [1, 3])
+
+    b = a.empty_like()
+    assert (np.asarray(b) == 0).all()
+    b.copy_span(a, 20, 70)
+    expected = np.zeros(100, dtype=np.uint8)
+    expected[20:70] = data[20:70]
+    assert (np.asarray(b) == expected).all()
+    b.copy_span(Alleles(data), 70, None)
+    expected[70:] = data[70:]
+    assert (np.asarray(b) == expected).all()
+
+    c = a.copy()
+    assert (a == c).all()
+    c[5] = 1 if data[5] != 1 else 2
+    c[40:45] = 0
+    changed = (data[40:45] != 0).nonzero()[0] + 40
+    assert (a != c).nonzero()[0].tolist() == [5] + changed.tolist()
+    assert (c.todense() == np.asarray(c)).all()
+
+    d = recombine(a, c, np.linspace(0, 100, 100))
+    assert isinstance(d, PackedAlleles)
+    assert all(x in (y, z) for x, y, z in zip(d, a, c))
+
+
+def test_mosaicalleles():
+    from pydigree.genotypes import MosaicAlleles
+    from pydigree.recombination import recombine
+
+    a = Alleles(np.array([1, 1, 1, 1, 1, 0, 1, 1], dtype=np.int8))
+    b = Alleles(np.array([2, 2, 2, 2, 2, 2, 2, 2], dtype=np.int8))
+    m = MosaicAlleles(a, b, [2, 5], first=1)
+    assert m.nmark() == len(m) == 8 and m.depth == 1
+    assert not m.materialised and m.storage_type is Alleles
+    assert np.asarray(m).tolist() == [2, 2, 1, 1, 1, 2, 2, 2]
+    assert m[0] == 2 and m[3] == 1 and m[-1] == 2
+    assert m[1:4].tolist() == [2, 1, 1]
+    assert m[3:3].tolist() == []
+    assert not m.missing.any()
+    assert_raises(IndexError, m.__getitem__, 8)
+    assert m[np.array([0, 3, 7, 2])].tolist() == [2, 1, 2, 1]
+    assert m[[-1, 5]].tolist() == [2, 2]
+    assert m[np.arange(8) > 5].tolist() == [2, 2]
+    assert_raises(IndexError, m.__getitem__, [1, 8])
+    assert m.astype(str).tolist() == list('22111222')
+
+    # Mosaics of mosaics look through to the founders
+    n = MosaicAlleles(m, a, [4])
+    assert n.depth == 2
+    assert np.asarray(n).tolist() == [2, 2, 1, 1, 1, 0, 1, 1]
+    assert n[np.array([1, 4, 5])].tolist() == [2, 1, 0]
+    assert n.missing.nonzero()[0].tolist() == [5]
+    assert (n == n.todense()).all()
+
+    # Writing copies the alleles out
+    c = n.copy()
+    c[0] = 1
+    assert c.materialised and not n.materialised
+    assert c[0] == 1 and n[0] == 2
+    assert type(c.empty_like()) is Alleles
+
+    # Missingness is looked up a segment at a time, so it doesn't have to
+    # go through every segment of every ancestor
+    import time
+    base = [Alleles(np.random.randint(0, 3, 1000).astype(np.int8))
+            for _ in range(2)]
+    for _ in range(12):
+        breaks = np.sort(np.random.choice(1000, 20, replace=False))
+        base = [MosaicAlleles(base[0], base[1], breaks, first=i)
+                for i in range(2)]
+    assert base[0].depth == 12
+    start = time.time()
+    assert (base[0].missing == (np.asarray(base[0]) == 0)).all()
+    assert time.time() - start < 1
+
+    # Deep mosaics are materialised when they're made
+    deep = m
+    for _ in range(MosaicAlleles.max_depth):
+        deep = MosaicAlleles(deep, b, [3])
+    assert deep.materialised and deep.depth == 0
+
+    gmap = np.linspace(0, 300, 8)
+    d = recombine(a, b, gmap, lazy=True)
+    assert isinstance(d, MosaicAlleles)
+    assert all(x in (y, z) for x, y, z in zip(np.asarray(d), a, b))
+    e = recombine(d, a, gmap)
+    assert type(e) is Alleles
+
+    sa = SparseAlleles(np.array([0, 1, 0, 1], dtype=np.int8))
+    sb = SparseAlleles(np.array([1, 1, 1, 0], dtype=np.int8))
+    s = MosaicAlleles(sa, sb, [2])
+    assert np.asarray(s).tolist() == [0, 1, 1, 0]
+    assert s[[3, 1, 2]].tolist() == [0, 1, 1]
+    s.materialise()
+    assert type(s._data) is SparseAlleles
+    assert s[2] == 1
+
+    la = LabelledAlleles.founder_chromosome('x', 0, 0, nmark=8)
+    lb = LabelledAlleles.founder_chromosome('x', 0, 1, nmark=8)
+    lm = MosaicAlleles(la, lb, [3])
+    assert len(lm) == 8 and lm[2].haplotype == 0 and lm[3].haplotype == 1
+    lm.materialise()
+    assert type(lm._data) is LabelledAlleles
+    # Labels are always recombined directly
+    assert type(recombine(la, lb, gmap, lazy=True)) is LabelledAlleles
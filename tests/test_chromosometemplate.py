@@ -9,4 +9,70 @@ def test_chromosometemplate():
 	assert c.closest_marker(0) == 0
 	assert c.closest_marker(5000001) == 4
 	assert c.closest_marker(5999999) == 5
-	assert c.closest_marker(1e10) == c.nmark() - 1 
\ No newline at end of file
+	assert c.closest_marker(1e10) == c.nmark() - 1 
+
+
+def test_allele_encoding():
+	import numpy as np
+	from nose.tools import assert_raises
+	c = ChromosomeTemplate()
+	c.add_genotype(0.5, 0, reference='A', alternates=['G'])
+	c.add_genotype(0.5, 1)
+	c.add_genotype(0.5, 2, reference='C', alternates=['T', 'TA'])
+
+	assert_raises(ValueError, c.decode_alleles, [1, 1, 1])
+
+	codes = c.encode_alleles(['G', 'T', 'TA'])
+	assert codes.dtype == np.int8
+	assert codes.tolist() == [2, 1, 3]
+	assert c.encode_alleles(['A', 'C', '']).tolist() == [1, 2, 0]
+	assert c.encode_alleles(['', 'T', 'CTT']).tolist() == [0, 1, 4]
+	assert c.decode_alleles([2, 2, 4]).tolist() == ['G', 'C', 'CTT']
+	assert c.decode_alleles([0, 1, 0], '0').tolist() == ['0', 'T', '0']
+	assert_raises(ValueError, c.encode_alleles, ['A'])
+
+	# Markers added later get rows in the table
+	c.add_genotype(0.5, 3, reference='G', alternates=['A', 'C', 'T'])
+	c.add_genotype(0.5, 4)
+	assert c.allele_table.shape[0] == c.nmark() == 5
+	assert c.encode_alleles(['A', 'C', '', 'T', 'GA']).tolist() == [1, 2, 0, 4, 1]
+	assert c.decode_alleles([1, 2, 0, 1, 1]).tolist() == ['A', 'C', '', 'G', 'GA']
+
+
+def test_linkageequilibrium_chromosomes():
+	import numpy as np
+	from pydigree.genotypes import Alleles, SparseAlleles
+	from pydigree.population import Population
+	np.random.seed(1)
+	c = ChromosomeTemplate()
+	for i, freq in enumerate([0.0, 0.5, 1.0, 0.01, 0.2]):
+		c.add_genotype(freq, i)
+	c.finalize()
+
+	chroms = c.linkageequilibrium_chromosomes(4000)
+	assert len(chroms) == 4000
+	assert all(type(x) is Alleles and x.template is c for x in chroms)
+	mat = np.array(chroms)
+	assert (mat[:, 0] == 1).all() and (mat[:, 2] == 2).all()
+	assert abs((mat == 2).mean(axis=0)[1] - 0.5) < 0.05
+	chroms[0][0] = 2
+	assert chroms[1][0] == 1
+
+	sparse = c.linkageequilibrium_chromosomes(4000, sparse=True)
+	assert all(type(x) is SparseAlleles and x.template is c for x in sparse)
+	mat = np.array([x.todense() for x in sparse])
+	assert (mat[:, 0] == 0).all() and (mat[:, 2] == 1).all()
+	freqs = mat.mean(axis=0)
+	assert abs(freqs[3] - 0.01) < 0.01 and abs(freqs[4] - 0.2) < 0.05
+
+	# Sparse chromosomes are writable and independent
+	sparse[0][1] = 1
+	sparse[1][1] = 0
+	assert sparse[0][1] == 1 and sparse[1][1] == 0
+
+	pop = Population()
+	pop.add_chromosome(c)
+	sets = pop.get_linkage_equilibrium_genotype_sets(3)
+	assert len(sets) == 3
+	assert all(len(x) == 1 and len(x[0]) == 2 for x in sets)
+	assert sets[0][0][0] is not sets[0][0][1]
@@ -3,10 +3,10 @@
 from itertools import chain
 
 from nose import with_setup
-from nose.tools import raises
+from nose.tools import raises, assert_raises
 
 from pydigree import Population, Individual
-from pydigree.genotypes import Alleles
+from pydigree.genotypes import Alleles, ChromosomeTemplate
 from pydigree.common import grouper
 
 def setup_80freq():
@@ -53,3 +53,179 @@ def test_freq():
     assert pop.allele_frequency(loc, 1) == ((2*600) + (1*400)) / float(2*1000)
     assert pop.allele_frequency(loc, 2) == (1*400) / float(2*1000)
 
+
+
+def test_allele_frequencies():
+    import numpy as np
+    pop = Population()
+    chrom = ChromosomeTemplate()
+    for i in range(2):
+        chrom.add_genotype(0.5, i)
+    pop.add_chromosome(chrom)
+
+    # Locus 0: 1/1 x3, 1/2 x1; locus 1: 2/2 x2, missing x2
+    genos = [([1, 2], [1, 2]), ([1, 2], [1, 2]), ([1, 0], [1, 0]),
+             ([1, 0], [2, 0])]
+    for a, b in genos:
+        ind = pop.founder_individual()
+        ind.genotypes = [[Alleles(a, dtype=np.uint8), 
+                          Alleles(b, dtype=np.uint8)]]
+    pop.founder_individual()
+
+    freqs = pop.allele_frequencies(0)
+    assert len(freqs) == 2
+    assert freqs.alleles.tolist() == [1, 2]
+    assert freqs.counts.tolist() == [[7, 1], [0, 4]]
+    assert freqs.call_rate.tolist() == [1.0, 0.5]
+    assert freqs.major_allele.tolist() == [1, 2]
+    assert freqs.minor_allele.tolist() == [2, 0]
+    assert freqs.maf.tolist() == [1 / 8., 0]
+    assert freqs.locus(0) == {1: 7 / 8., 2: 1 / 8.}
+    assert freqs.locus_counts(1) == {2: 4}
+
+    for locidx in range(2):
+        for allele, freq in freqs.locus(locidx).items():
+            assert freq == pop.allele_frequency((0, locidx), allele)
+
+    assert pop.missingness_by_locus(0).tolist() == [0, 0.5]
+    assert len(pop.allele_frequencies()) == 1
+
+    constrained = pop.allele_frequencies(0, constraint=lambda x: x.label < 2)
+    assert constrained.counts.tolist() == [[4, 0], [0, 4]]
+
+    # The same counts come out of a genotype matrix
+    pop.build_genotype_matrix()
+    assert pop.allele_frequencies(0).counts.tolist() == [[7, 1], [0, 4]]
+    assert pop.missingness_by_locus(0).tolist() == [0, 0.5]
+
+
+def test_allele_frequencies_sparse():
+    import numpy as np
+    from pydigree.genotypes import SparseAlleles
+    pop = Population()
+    chrom = ChromosomeTemplate()
+    for i in range(3):
+        chrom.add_genotype(0.5, i)
+    pop.add_chromosome(chrom)
+
+    # 0 is the reference allele here, and only -1 is missing.
+    # Locus 0: 0/0 x3, 0/1 x1; locus 1: 1/1 x2, missing x2; locus 2: 0/0
+    genos = [([0, 1, 0], [0, 1, 0]), ([0, 1, 0], [0, 1, 0]),
+             ([0, -1, 0], [0, -1, 0]), ([0, -1, 0], [1, -1, 0])]
+    for a, b in genos:
+        ind = pop.founder_individual()
+        ind.genotypes = [[SparseAlleles(np.array(a, dtype=np.int8)),
+                          SparseAlleles(np.array(b, dtype=np.int8))]]
+
+    freqs = pop.allele_frequencies(0)
+    assert freqs.alleles.tolist() == [0, 1]
+    assert freqs.counts.tolist() == [[7, 1], [0, 4], [8, 0]]
+    assert freqs.call_rate.tolist() == [1.0, 0.5, 1.0]
+    assert freqs.major_allele.tolist() == [0, 1, 0]
+    assert freqs.maf.tolist() == [1 / 8., 0, 0]
+    assert pop.missingness_by_locus(0).tolist() == [0, 0.5, 0]
+
+
+def test_dosage_matrix():
+    import numpy as np
+    from pydigree.simulation.trait import QuantitativeTrait
+    pop = Population()
+    for nmark in (3, 2):
+        chrom = ChromosomeTemplate()
+        for i in range(nmark):
+            chrom.add_genotype(0.5, i)
+        pop.add_chromosome(chrom)
+
+    genos = [[([1, 2, 1], [2, 2, 1]), ([1, 1], [1, 2])],
+             [([1, 1, 0], [1, 2, 1]), ([2, 1], [2, 1])],
+             [([1, 1, 2], [1, 1, 2]), ([1, 1], [1, 1])]]
+    inds = []
+    for g in genos:
+        ind = pop.founder_individual()
+        ind.genotypes = [[Alleles(a, dtype=np.uint8), 
+                          Alleles(b, dtype=np.uint8)] for a, b in g]
+        inds.append(ind)
+
+    loci = [(0, 0), (1, 1), (0, 2), (0, 1)]
+    d = pop.dosage_matrix(loci, allele=2, individuals=inds)
+    assert d.shape == (3, 4)
+    assert d[:, 0].tolist() == [1, 0, 0]
+    assert d[:, 1].tolist() == [1, 0, 0]
+    assert d[:, 3].tolist() == [2, 1, 0]
+    assert np.isnan(d[1, 2]) and d[0, 2] == 0 and d[2, 2] == 2
+
+    # Minor alleles: 2 at (0, 0), (1, 1) and (0, 1); 2 at (0, 2)
+    assert (pop.dosage_matrix(loci, individuals=inds)[:, [0, 1, 3]] ==
+            d[:, [0, 1, 3]]).all()
+
+    per_locus = pop.dosage_matrix(loci[:2], allele=[1, 2],
+                                  individuals=inds[:1])
+    assert per_locus.tolist() == [[1, 1]]
+    assert_raises(ValueError, pop.dosage_matrix, loci, allele=[1, 2])
+
+    for ind in inds:
+        for i, locus in enumerate(loci):
+            gt = ind.get_genotype(locus)
+            if 0 not in gt:
+                assert gt.count(2) == d[inds.index(ind), i]
+
+    trait = QuantitativeTrait('t', 'quantitative', chromosomes=pop.chromosomes)
+    trait.add_effect((0, 1), a=1, k=0.5)
+    trait.add_effect((1, 1), a=2)
+    predicted = trait.predict_phenotypes(pop, individuals=inds)
+    expected = [trait.predict_phenotype(x) for x in inds]
+    assert np.allclose(predicted, expected)
+
+    # A missing genotype at an effect locus has no prediction, rather than
+    # being called unaffected
+    for traittype in ('quantitative', 'dichotomous'):
+        trait = QuantitativeTrait('t', traittype, chromosomes=pop.chromosomes)
+        trait.add_effect((0, 2), a=1)
+        if traittype == 'dichotomous':
+            trait.set_liability_threshold(1)
+        assert_raises(ValueError, trait.predict_phenotypes, pop,
+                      individuals=inds)
+        trait.predict_phenotypes(pop, individuals=[inds[0], inds[2]])
+
+
+def test_dosage_matrix_sparse():
+    import numpy as np
+    from pydigree.genotypes import SparseAlleles
+    pop = Population()
+    chrom = ChromosomeTemplate()
+    for i in range(6):
+        chrom.add_genotype(0.5, i)
+    pop.add_chromosome(chrom)
+
+    # 0 is the reference allele, -1 is missing
+    genos = [([0, 1, 0, 0, 1, 0], [0, 1, 0, 0, 1, 2]),
+             ([1, 0, 0, -1, 0, 0], [0, 0, 0, 0, 1, 2]),
+             ([0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0])]
+    inds = []
+    for a, b in genos:
+        ind = pop.founder_individual()
+        ind.genotypes = [[SparseAlleles(np.array(a, dtype=np.int8)),
+                          SparseAlleles(np.array(b, dtype=np.int8))]]
+        inds.append(ind)
+
+    loci = [(0, i) for i in range(6)]
+    d = pop.dosage_matrix(loci, allele=1, individuals=inds)
+    assert d[0].tolist() == [0, 2, 0, 0, 2, 0]
+    assert d[2].tolist() == [0, 0, 0, 0, 0, 0]
+    assert np.isnan(d[1, 3])
+    assert d[1, [0, 1, 2, 4, 5]].tolist() == [1, 0, 0, 1, 0]
+
+    # Minor alleles are 1 at loci 0, 1 and 4, 2 at locus 5, and there's
+    # none at the monomorphic locus 2
+    minor = pop.dosage_matrix(loci, individuals=inds)
+    assert minor[:, 2].tolist() == [0, 0, 0]
+    assert minor[:, 5].tolist() == [1, 1, 0]
+    assert (minor[:, [0, 1, 4]] == d[:, [0, 1, 4]]).all()
+    assert pop.dosage_matrix([(0, 5)], allele=2).tolist() == [[1], [1], [0]]
+
+    from pydigree.simulation.trait import QuantitativeTrait
+    trait = QuantitativeTrait('t', 'quantitative', chromosomes=pop.chromosomes)
+    trait.add_effect((0, 0), a=1)
+    trait.add_effect((0, 5), a=2)
+    predicted = trait.predict_phenotypes(pop, individuals=inds)
+    assert not np.isnan(predicted).any()
@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+
+from pydigree.io import read_ped
+from pydigree.genotypes import ChromosomeTemplate
+from pydigree.simulation.genedrop import BatchGeneDrop
+
+PEDDIR = os.path.abspath(os.path.join(os.path.abspath(__file__), 
+                                      '..', '..', 'sample_pedigrees'))
+
+
+def getped(name, nmark=20):
+    ped = list(read_ped(os.path.join(PEDDIR, name + '.ped')).pedigrees)[0]
+    c = ChromosomeTemplate()
+    for i in range(nmark):
+        c.add_genotype(0.5, i * 10)
+    c.finalize()
+    ped.add_chromosome(c)
+    return ped
+
+
+def test_batch_genedrop():
+    np.random.seed(0)
+    ped = getped('first_cousins')
+    sim = BatchGeneDrop(ped)
+    assert sim.nfounders == len(ped.founders())
+    assert sorted(sim.individuals, key=id) == sorted(ped.individuals, key=id)
+
+    origins = sim.simulate(500)
+    assert len(origins) == 1
+    origins = origins[0]
+    assert origins.shape == (500, len(ped.individuals), 2, 20)
+
+    # Founders carry their own labels
+    for i, founder in enumerate(sim.founders):
+        assert (origins[:, sim.index[founder], 0] == 2 * i).all()
+        assert (origins[:, sim.index[founder], 1] == 2 * i + 1).all()
+
+    # Everyone else's chromatids come from the matching parent
+    for ind in ped.nonfounders():
+        row = sim.index[ind]
+        for hap, parent in enumerate(ind.parents()):
+            parental = origins[:, sim.index[parent]]
+            child = origins[:, row, hap]
+            assert ((child == parental[:, 0]) | 
+                    (child == parental[:, 1])).all()
+
+
+def test_batch_genedrop_ibd():
+    np.random.seed(0)
+    ped = getped('fullsib', nmark=1)
+    sim = BatchGeneDrop(ped)
+    kids = ped.nonfounders()
+    states = sim.ibd_states(sim.simulate(4000)[0], [(kids[0], kids[1]),
+                                                    (kids[0], kids[0])])
+    assert states.shape == (4000, 2, 1)
+    # Full sibs share 0, 1 and 2 alleles IBD 1/4, 1/2 and 1/4 of the time
+    freqs = np.bincount(states[:, 0, 0], minlength=3) / 4000.0
+    assert np.abs(freqs - [0.25, 0.5, 0.25]).max() < 0.03
+    assert (states[:, 1] == 2).all()
+
+
+def test_batch_genedrop_genotypes():
+    np.random.seed(0)
+    ped = getped('fullsib', nmark=5)
+    sim = BatchGeneDrop(ped)
+    origins = sim.simulate(10)[0]
+
+    founder_alleles = np.arange(sim.nfounders * 2 * 5).reshape(-1, 2, 5)
+    genotypes = sim.genotypes(origins, 0, founder_alleles)
+    assert genotypes.shape == origins.shape
+    assert (genotypes == origins * 5 + np.arange(5)).all()
+
+    per_replicate = np.broadcast_to(founder_alleles, 
+                                    (10,) + founder_alleles.shape)
+    assert (sim.genotypes(origins, 0, per_replicate) == genotypes).all()
+
+    drawn = sim.genotypes(origins, 0)
+    assert drawn.shape == origins.shape
+    assert set(np.unique(drawn).tolist()) <= {1, 2}
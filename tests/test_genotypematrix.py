@@ -0,0 +1,123 @@
+from nose.tools import assert_raises
+import numpy as np
+
+from pydigree import Population
+from pydigree.genotypes import Alleles, ChromosomeTemplate, GenotypeMatrix
+from pydigree.ibs import chromwide_ibs
+
+
+def setup_pop():
+    pop = Population()
+    for nmark in (5, 3):
+        c = ChromosomeTemplate()
+        for i in range(nmark):
+            c.add_genotype(0.5, i)
+        pop.add_chromosome(c)
+
+    np.random.seed(100)
+    for i in range(4):
+        ind = pop.founder_individual()
+        ind.genotypes = [[Alleles(np.random.randint(0, 3, c.nmark()),
+                                  dtype=np.uint8) for _ in range(2)]
+                         for c in pop.chromosomes]
+    pop.founder_individual()
+    return pop
+
+
+def test_genotype_matrix():
+    pop = setup_pop()
+    before = {ind: [[np.array(h) for h in chrom] for chrom in ind.genotypes]
+              for ind in pop.individuals if ind.has_genotypes()}
+
+    mat = pop.build_genotype_matrix()
+    assert pop.genotype_matrix is mat
+    assert mat.nind == 4
+    assert len(mat) == 2
+    assert mat[0].shape == (4, 2, 5) and mat[1].shape == (4, 2, 3)
+    assert mat.dtype == np.uint8
+
+    for ind, genos in before.items():
+        row = mat.index[ind]
+        assert mat.is_attached(ind)
+        for c, chrom in enumerate(genos):
+            for h, hap in enumerate(chrom):
+                assert isinstance(ind.genotypes[c][h], Alleles)
+                assert (ind.genotypes[c][h] == hap).all()
+                assert (mat[c][row, h] == hap).all()
+
+    # Writes through the individual show up in the matrix
+    ind = mat.individuals[2]
+    ind.genotypes[1][0][2] = 2
+    assert mat[1][2, 0, 2] == 2
+
+    stacked = np.array([np.array(h) for x in mat.individuals
+                        for h in x.genotypes[0]])
+    assert (mat.allele_counts(0, 1) == (stacked == 1).sum(axis=0)).all()
+    assert (mat.missing_counts(0) == (stacked == 0).sum(axis=0)).all()
+
+    states = mat.ibs_states(1, 0)
+    for j, other in enumerate(mat.individuals):
+        a, b = mat.individuals[1].genotypes[0]
+        c, d = other.genotypes[0]
+        assert (states[j] == chromwide_ibs(a, b, c, d)).all()
+
+
+def test_genotype_matrix_refresh():
+    pop = setup_pop()
+    mat = pop.build_genotype_matrix()
+    ind = mat.individuals[0]
+    ind.genotypes = [[Alleles(np.ones(c.nmark(), dtype=np.uint8))
+                      for _ in range(2)] for c in pop.chromosomes]
+    assert not mat.is_attached(ind)
+    assert (mat[0][0] != 1).any()
+
+    mat.refresh()
+    assert mat.is_attached(ind)
+    assert (mat[0][0] == 1).all() and (mat[1][0] == 1).all()
+
+    assert_raises(ValueError, GenotypeMatrix.from_individuals, [],
+                  pop.chromosomes)
+
+
+def test_genotype_matrix_memmap():
+    import shutil
+    import tempfile
+
+    pop = setup_pop()
+    directory = tempfile.mkdtemp()
+    try:
+        inds = [x for x in pop.individuals if x.has_genotypes()]
+        expected = [np.array(x.genotypes[1][1]) for x in inds]
+
+        mat = GenotypeMatrix([], pop.chromosomes, directory=directory)
+        for ind in inds:
+            mat.append(ind)
+        assert mat.nind == 4
+        assert isinstance(mat[1], np.memmap)
+        assert all(mat.is_attached(x) for x in inds)
+        assert all((x.genotypes[1][1] == e).all()
+                   for x, e in zip(inds, expected))
+
+        inds[0].genotypes[0][0][0] = 2
+        mat.flush()
+
+        for ind in inds:
+            ind.clear_genotypes()
+        reopened = GenotypeMatrix.open(directory, inds, pop.chromosomes)
+        assert reopened[0][0, 0, 0] == 2
+        assert all((x.genotypes[1][1] == e).all()
+                   for x, e in zip(inds, expected))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_genotype_matrix_append():
+    pop = setup_pop()
+    inds = [x for x in pop.individuals if x.has_genotypes()]
+    expected = [np.array(x.genotypes[0][0]) for x in inds]
+    mat = GenotypeMatrix([], pop.chromosomes)
+    for ind in inds:
+        mat.append(ind)
+    assert mat[0].shape == (4, 2, 5)
+    assert all(mat.is_attached(x) for x in inds)
+    assert (mat[0][:, 0] == np.array(expected)).all()
@@ -1,5 +1,6 @@
 from nose.tools import assert_raises
 from pydigree.ibs import ibs, chromwide_ibs
+from pydigree.cydigree.sparsearray import sparse_ibs, sparse_ibs_runs
 from pydigree.genotypes import Alleles, SparseAlleles
 
 import numpy as np
@@ -24,11 +25,170 @@ def test_chromwide_ibs():
     expected = np.array([2,2,1,0,64])
     assert (chromwide_ibs(a,b,c,d) == expected).all()
 
-    # spa, spb = [SparseAlleles(x) for x in zip(*g1)]
-    # spc, spd = [SparseAlleles(x) for x in zip(*g2)]
-    # assert (chromwide_ibs(spa, spb, spc, spd) == expected).all()
+    # Sparse genotypes code missing values as -1
+    sg1 = [(x-1, y-1) for x,y in g1]
+    sg2 = [(x-1, y-1) for x,y in g2]
+    spa, spb = [SparseAlleles(np.array(x), refcode=0) for x in zip(*sg1)]
+    spc, spd = [SparseAlleles(np.array(x), refcode=0) for x in zip(*sg2)]
+    assert (chromwide_ibs(spa, spb, spc, spd) == expected).all()
+
+    spa.freeze()
+    spd.freeze()
+    assert (chromwide_ibs(spa, spb, spc, spd) == expected).all()
 
     # Test assertions
     assert_raises(ValueError, chromwide_ibs, a, b, c, d, missingval=600)
     assert_raises(ValueError, chromwide_ibs, a, b, c, d, missingval=-1)
     
+
+def test_sparse_ibs_runs():
+    g1 = [(0,0), (0,0), (0,1), (0,0), (-1,0), (0,0), (0,0)]
+    g2 = [(0,0), (0,0), (1,1), (1,1), (0,0), (0,0), (0,0)]
+
+    a, b = [SparseAlleles(np.array(x), refcode=0) for x in zip(*g1)]
+    c, d = [SparseAlleles(np.array(x), refcode=0) for x in zip(*g2)]
+    
+    dense = sparse_ibs(a.container, b.container, c.container, d.container)
+    assert dense.tolist() == [2, 2, 1, 0, 64, 2, 2]
+
+    out = np.zeros(7, dtype=np.uint8)
+    sparse_ibs(a.container, b.container, c.container, d.container, out=out)
+    assert (out == dense).all()
+
+    starts, states = sparse_ibs_runs(a.container, b.container, 
+                                     c.container, d.container)
+    assert starts.tolist() == [0, 2, 3, 4, 5]
+    assert states.tolist() == [2, 1, 0, 64, 2]
+
+    short = SparseAlleles(np.zeros(3, dtype=np.int8), refcode=0)
+    assert_raises(ValueError, sparse_ibs, a.container, b.container, 
+                  c.container, short.container)
+    assert_raises(ValueError, sparse_ibs, a.container, b.container, 
+                  c.container, d.container, out=np.zeros(3, dtype=np.uint8))
+
+
+def test_packed_ibs():
+    from pydigree.genotypes import PackedAlleles
+    from pydigree.cydigree.cyfuncs import packed_ibs_counts
+
+    for nmark in (32, 70):
+        dense = [Alleles(np.random.randint(0, 3, nmark).astype(np.uint8))
+                 for _ in range(4)]
+        packed = [PackedAlleles(x) for x in dense]
+        expected = chromwide_ibs(*dense)
+        observed = chromwide_ibs(*packed)
+        assert (observed == expected).all()
+
+        words = [x.words for x in packed]
+        n0, n1, n2, nmiss = packed_ibs_counts(*(words + [nmark]))
+        assert n0 == (expected == 0).sum()
+        assert n1 == (expected == 1).sum()
+        assert n2 == (expected == 2).sum()
+        assert nmiss == (expected == 64).sum()
+
+    # Whole words of IBS2
+    a = PackedAlleles(np.ones(64, dtype=np.uint8))
+    assert (chromwide_ibs(a, a, a, a) == 2).all()
+
+
+def test_dense_ibs_kernel():
+    from pydigree.ibs import _chromwide_ibs_numpy
+    from pydigree.cydigree.cyfuncs import (dense_ibs, state_runs, 
+                                           runs_gte_uint8, runs_gte_from_runs)
+
+    for dtype in (np.uint8, np.int8, np.int32, np.int64):
+        chroms = [Alleles(np.random.randint(0, 3, 200).astype(dtype))
+                  for _ in range(4)]
+        expected = _chromwide_ibs_numpy(*(chroms + [64]))
+        assert (chromwide_ibs(*chroms) == expected).all()
+
+        out = np.zeros(200, dtype=np.uint8)
+        states, starts, values = chromwide_ibs(*chroms, out=out, runs=True)
+        assert states is out
+        assert (out == expected).all()
+        assert (np.repeat(values, np.diff(np.append(starts, 200))) == 
+                expected).all()
+
+        for minval in (1, 2):
+            for minlength in (1, 3):
+                assert (runs_gte_from_runs(starts, values, 200, minval,
+                                           minlength=minlength) ==
+                        runs_gte_uint8(expected, minval, minlength=minlength))
+
+        # Read-only genotypes (e.g. from a memory-mapped file) work too
+        for x in chroms:
+            x.flags.writeable = False
+        assert (chromwide_ibs(*chroms) == expected).all()
+
+    # String genotypes fall back to numpy, with the same output options
+    chroms = [Alleles(['A', 'C', '']), Alleles(['A', 'A', 'A']),
+              Alleles(['A', 'C', 'A']), Alleles(['A', 'A', 'A'])]
+    states, starts, values = chromwide_ibs(*chroms, runs=True)
+    assert states.tolist() == [2, 2, 64]
+    assert starts.tolist() == [0, 2] and values.tolist() == [2, 64]
+
+    assert_raises(ValueError, dense_ibs, chroms[0][:0].astype(np.uint8), 
+                  np.zeros(1, np.uint8), np.zeros(1, np.uint8), 
+                  np.zeros(1, np.uint8))
+    assert state_runs(np.zeros(0, dtype=np.uint8))[0].shape == (0,)
+
+
+def _ibs_population(chromatid):
+    from pydigree import Population
+    from pydigree.genotypes import ChromosomeTemplate
+
+    pop = Population()
+    for nmark in (30, 17):
+        c = ChromosomeTemplate()
+        for i in range(nmark):
+            c.add_genotype(0.5, i)
+        pop.add_chromosome(c)
+    for i in range(6):
+        ind = pop.founder_individual()
+        ind.genotypes = [[chromatid(c.nmark()) for _ in range(2)]
+                         for c in pop.chromosomes]
+    return pop
+
+
+def _check_pairwise_ibs(result, nchrom):
+    from pydigree.ibs import get_ibs_states
+
+    inds = result.individuals
+    for i, x in enumerate(inds):
+        for j, y in enumerate(inds):
+            states = np.concatenate([get_ibs_states(x, y, c) 
+                                     for c in range(nchrom)])
+            assert result.ibs0[i, j] == (states == 0).sum()
+            assert result.ibs1[i, j] == (states == 1).sum()
+            assert result.ibs2[i, j] == (states == 2).sum()
+            assert result.nvalid[i, j] == (states != 64).sum()
+
+
+def test_pairwise_ibs_matrix():
+    from pydigree.ibs import pairwise_ibs_matrix
+
+    pop = _ibs_population(
+        lambda n: Alleles(np.random.randint(0, 4, n), dtype=np.uint8))
+
+    result = pairwise_ibs_matrix(pop, block_size=8)
+    inds = result.individuals
+    assert len(inds) == 6
+    _check_pairwise_ibs(result, 2)
+
+    assert (result.ibs2 == result.ibs2.T).all()
+    dist = result.distance
+    assert np.allclose(np.diag(dist)[result.nvalid.diagonal() > 0], 0)
+
+    one = pairwise_ibs_matrix(pop, chromosomes=[1], block_size=100)
+    assert (one.ibs2 <= result.ibs2).all()
+
+    parallel = pairwise_ibs_matrix(pop, block_size=8, processes=2)
+    assert (parallel.ibs1 == result.ibs1).all()
+
+    # Sparse genotypes, where 0 is the reference allele and only negative
+    # alleles are missing
+    pop = _ibs_population(
+        lambda n: SparseAlleles(np.random.randint(-1, 3, n).astype(np.int8)))
+    result = pairwise_ibs_matrix(pop, block_size=8)
+    _check_pairwise_ibs(result, 2)
+    assert (result.nvalid.diagonal() > 20).all()
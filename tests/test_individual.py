@@ -32,3 +32,66 @@ def test_depth():
 	assert ped['3'].depth == 1
 	# F2
 	assert ped['7'].depth == 2
+
+def test_gametes():
+	import numpy as np
+	from pydigree.genotypes import ChromosomeTemplate
+	from pydigree.individual import Individual
+	ped = list(read_ped(os.path.join(PEDDIR, 'first_cousins.ped')).pedigrees)[0]
+	c = ChromosomeTemplate()
+	for i in range(100):
+		c.add_genotype(0.5, i * 2)
+	c.finalize()
+	ped.add_chromosome(c)
+
+	ped.get_genotypes()
+	assert all(x.has_genotypes() for x in ped.individuals)
+
+	# Every allele of a child comes from the matching parent
+	for x in ped.nonfounders():
+		for chromatid, parent in zip(x.genotypes[0], x.parents()):
+			parental = np.array(parent.genotypes[0])
+			assert (np.asarray(chromatid) == parental).any(axis=0).all()
+
+	gametes = Individual.gametes([ped['1'], ped['1'], ped['2']])
+	assert len(gametes) == 3
+	assert all(len(g) == 1 and len(g[0]) == 100 for g in gametes)
+	assert Individual.gametes([]) == []
+
+	# Lazy gametes refer to the parents' chromatids
+	from pydigree.genotypes import MosaicAlleles, Alleles
+	for x in ped.nonfounders():
+		x.clear_genotypes()
+	ped.get_genotypes(lazy=True)
+	child = ped.nonfounders()[-1]
+	assert all(type(c) is MosaicAlleles for c in child.genotypes[0])
+	chromatid, parent = child.genotypes[0][0], child.father
+	parental = np.array(parent.genotypes[0])
+	assert (np.asarray(chromatid) == parental).any(axis=0).all()
+
+	# Label dropping, then delabelling the whole pedigree at once
+	ped.clear_genotypes()
+	for x in ped.founders():
+		x.label_genotypes()
+	ped.get_genotypes()
+	for x in ped.founders():
+		x.clear_genotypes()
+		x.get_genotypes()
+	ped.delabel_genotypes()
+	for x in ped.nonfounders():
+		for chromatid, parent in zip(x.genotypes[0], x.parents()):
+			assert type(chromatid) is Alleles
+			parental = np.array(parent.genotypes[0])
+			assert (np.asarray(chromatid) == parental).any(axis=0).all()
+
+	# Labels can be dropped lazily too
+	ped.clear_genotypes()
+	for x in ped.founders():
+		x.label_genotypes()
+	ped.get_genotypes(lazy=True)
+	for x in ped.founders():
+		x.clear_genotypes()
+		x.get_genotypes()
+	ped.delabel_genotypes()
+	for x in ped.nonfounders():
+		assert all(type(c) is Alleles for c in x.genotypes[0])
@@ -94,4 +94,149 @@ def test_special():
 
     # __len__
     assert len(emtree) == 0
-    assert len(tree) == 5
\ No newline at end of file
+    assert len(tree) == 5
+
+
+def test_splice():
+    tree = IntTree.from_pairs(zip(range(0, 100, 2), range(50)))
+    source = IntTree.from_pairs([(1, 7), (3, 8)])
+
+    tree.splice(10, 20, source, 10)
+    assert tree.verify()
+    assert list(tree.keys()) == ([0, 2, 4, 6, 8, 11, 13] + 
+                                 list(range(20, 100, 2)))
+    assert tree.get(11) == 7 and tree.get(13) == 8
+
+    # Splicing in an empty tree is a delrange
+    tree.splice(0, 50, IntTree())
+    assert tree.verify()
+    assert list(tree.keys()) == list(range(50, 100, 2))
+
+    assert_raises(IndexError, tree.splice, 0, 10, 
+                  IntTree.from_keys([1, 20]), 0)
+
+
+def test_splice_balance():
+    random.seed(100)
+    keys = random.sample(range(10000), 2000)
+    tree = IntTree.from_keys(keys)
+    expected = set(keys)
+    for _ in range(200):
+        start = random.randrange(0, 9900)
+        stop = start + random.randrange(0, 100)
+        newkeys = random.sample(range(stop - start), (stop - start) // 3)
+        tree.splice(start, stop, IntTree.from_keys(newkeys), start)
+        expected = {k for k in expected if not start <= k < stop}
+        expected |= {k + start for k in newkeys}
+        assert tree.verify()
+    assert list(tree.keys()) == sorted(expected)
+
+
+def test_pickle():
+    import pickle
+    tree = IntTree.from_pairs(zip([20, 5, 15, 10], [4, 1, 3, -1]))
+    copied = pickle.loads(pickle.dumps(tree))
+    assert list(copied.keys()) == [5, 10, 15, 20]
+    assert list(copied.values()) == [1, -1, 3, 4]
+    assert copied.verify()
+
+    assert IntTree.from_arrays([], []).empty()
+    assert_raises(ValueError, IntTree.from_arrays, [2, 1], [0, 0])
+    assert_raises(ValueError, IntTree.from_arrays, [1, 2], [0])
+
+
+def test_node_reuse():
+    random.seed(200)
+    tree = IntTree()
+    expected = {}
+    for _ in range(20):
+        for k in random.sample(range(5000), 500):
+            tree.insert(k, k % 7)
+            expected[k] = k % 7
+        for k in random.sample(range(5000), 300):
+            tree.delete(k)
+            expected.pop(k, None)
+        start = random.randrange(0, 5000)
+        tree.delrange(start, start + 200)
+        expected = {k: v for k, v in expected.items() 
+                    if not start <= k < start + 200}
+        assert tree.verify()
+        assert list(tree.keys()) == sorted(expected)
+        assert list(tree.values()) == [expected[k] for k in sorted(expected)]
+
+    # Deleting the whole tree and clearing release all the nodes
+    tree.delrange(0, 5000)
+    assert tree.empty()
+    tree.insert(3, 1)
+    assert list(tree.keys()) == [3]
+    tree.clear()
+    assert tree.empty() and tree.size() == 0
+    tree.insert(4, 1)
+    assert list(tree.keys()) == [4]
+
+
+def test_bulk_builders():
+    tree = IntTree.from_keys([9, 3, 5, 3, 1])
+    assert list(tree.keys()) == [1, 3, 5, 9]
+    assert list(tree.values()) == [0, 0, 0, 0]
+    assert tree.verify()
+
+    tree = IntTree.from_pairs([(9, 1), (3, 2), (5, 3), (3, 4)])
+    assert list(tree.keys()) == [3, 5, 9]
+    assert list(tree.values()) == [4, 3, 1]
+    assert tree.verify()
+
+    assert IntTree.from_keys([]).empty()
+    assert_raises(OverflowError, IntTree.from_keys, [-1])
+
+
+def test_merge_values():
+    t1 = IntTree.from_pairs([(1, 1), (3, 1), (5, 1)])
+    t2 = IntTree.from_pairs([(3, 2), (4, 2)])
+    union = t1.union(t2)
+    assert list(union.keys()) == [1, 3, 4, 5]
+    assert list(union.values()) == [1, 1, 2, 1]
+    assert union.verify()
+
+    intersection = t1.intersection(t2)
+    assert list(intersection.keys()) == [3]
+    assert list(intersection.values()) == [1]
+    assert IntTree().union(IntTree()).empty()
+
+
+def test_split_join():
+    tree = IntTree.from_keys(range(0, 1000, 3))
+    upper = tree.split(500)
+    assert list(tree.keys()) == list(range(0, 500, 3))
+    assert list(upper.keys()) == list(range(501, 1000, 3))
+    assert tree.verify() and upper.verify()
+
+    # Joining trees that share nodes
+    tree.join(upper)
+    assert upper.empty()
+    assert list(tree.keys()) == list(range(0, 1000, 3))
+    assert tree.verify()
+
+    # Joining an independent tree
+    tree.join(IntTree.from_keys([1000, 1001]))
+    assert list(tree.keys())[-3:] == [999, 1000, 1001]
+    assert_raises(ValueError, tree.join, IntTree.from_keys([5]))
+
+    # Joining a tree whose nodes are shared with another
+    other = IntTree.from_keys([2000, 2001, 3000])
+    rest = other.split(3000)
+    tree.join(other)
+    assert list(tree.keys())[-2:] == [2000, 2001]
+    assert list(rest.keys()) == [3000]
+    del tree
+    assert list(rest.keys()) == [3000]
+
+    # Either side of a split can be changed and cleared independently
+    tree = IntTree.from_keys(range(100))
+    upper = tree.split(50)
+    upper.insert(200)
+    upper.delete(60)
+    tree.clear()
+    tree.insert(1)
+    assert len(upper) == 50
+    assert list(tree.keys()) == [1]
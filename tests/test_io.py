@@ -62,6 +62,65 @@ def test_plink():
     assert (peds['1','1'].genotypes[0][0].missing == [False, False]).all()
     assert (peds['1','1'].genotypes[1][0].missing == [False, True]).all()
 
+def test_plink_encoded():
+    import shutil
+    import tempfile
+    from pydigree.io.plink import write_plink
+    plinkped = os.path.join(TESTDATA_DIR, 'plink', 'plink_test.ped')
+    plinkmap = os.path.join(TESTDATA_DIR, 'plink', 'plink_test.map')
+
+    peds = read_plink(pedfile=plinkped, mapfile=plinkmap, 
+                      encode_alleles=True)
+    a, b = peds['1', '1'].genotypes[0]
+    assert a.dtype == np.int8
+    # Alleles are coded in the order they're seen
+    assert a.tolist() == [1, 1] and b.tolist() == [2, 1]
+    assert peds['1', '2'].genotypes[0][0].tolist() == [2, 2]
+    assert (peds['1', '1'].genotypes[1][0].missing == [False, True]).all()
+    assert peds.chromosomes[0].decode_alleles([2, 1]).tolist() == ['2', '1']
+
+    directory = tempfile.mkdtemp()
+    try:
+        prefix = os.path.join(directory, 'out')
+        write_plink(peds, prefix, mapfile=True)
+        with open(prefix + '.ped') as f:
+            assert f.readline().split()[6:] == '1 2 1 1 2 2 0 0'.split()
+        reread = read_plink(prefix=prefix)
+        assert (reread['1', '2'].genotypes[1][1] == ['2', '']).all()
+
+        # Text genotypes are written as they are, even with an allele table
+        text = read_plink(pedfile=plinkped, mapfile=plinkmap)
+        for chrom in text.chromosomes:
+            chrom.init_allele_table()
+        write_plink(text, prefix)
+        with open(prefix + '.ped') as f:
+            assert f.readline().split()[6:12] == '1 2 1 1 2 2'.split()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_plink_memmap():
+    import shutil
+    import tempfile
+    plinkped = os.path.join(TESTDATA_DIR, 'plink', 'plink_test.ped')
+    plinkmap = os.path.join(TESTDATA_DIR, 'plink', 'plink_test.map')
+
+    directory = tempfile.mkdtemp()
+    try:
+        peds = read_plink(pedfile=plinkped, mapfile=plinkmap,
+                          directory=directory)
+        mat = peds.genotype_matrix
+        assert isinstance(mat[0], np.memmap)
+        assert sorted(os.listdir(directory)) == ['chrom0.geno', 
+                                                 'chrom1.geno']
+        assert mat.nind == 2
+        assert (peds['1','1'].genotypes[0][1] == ['2', '1']).all()
+        assert (peds['1', '2'].genotypes[1][1] == ['2', '']).all()
+        assert (peds['1','1'].genotypes[1][0].missing == [False, True]).all()
+        assert all(mat.is_attached(x) for x in peds.individuals)
+    finally:
+        shutil.rmtree(directory)
+
 def test_smartopen():
     from pydigree.io.smartopen import smartopen 
     datadir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data', 'compression')
@@ -95,3 +154,37 @@ def test_smartopen():
         d = f.readlines()
         assert all(type(x) is str for x in d)
         assert [x.strip() for x in d] == ['genetics', 'pydigree', 'dna']
+
+
+def test_plink_lazy():
+    import shutil
+    import tempfile
+    from pydigree.io import read_ped
+    from pydigree.io.plink import write_plink
+    from pydigree.genotypes import MosaicAlleles
+    pedfile = os.path.join(TESTDATA_DIR, '..', '..', 'sample_pedigrees',
+                           'first_cousins.ped')
+    peds = read_ped(pedfile)
+    c = ChromosomeTemplate()
+    for i in range(20):
+        c.add_genotype(0.5, i * 5)
+    c.finalize()
+    peds.add_chromosome(c)
+    for ped in peds.pedigrees:
+        ped.get_genotypes(lazy=True)
+    child = next(iter(peds.pedigrees)).nonfounders()[-1]
+    assert type(child.genotypes[0][0]) is MosaicAlleles
+
+    directory = tempfile.mkdtemp()
+    try:
+        prefix = os.path.join(directory, 'out')
+        write_plink(peds, prefix, mapfile=True)
+        reread = read_plink(prefix=prefix)
+        assert len(reread.individuals) == len(peds.individuals)
+        for ind in peds.individuals:
+            copy = reread[ind.pedigree.label, ind.label]
+            for chromatid, written in zip(ind.genotypes[0],
+                                          copy.genotypes[0]):
+                assert (np.asarray(chromatid).astype(str) == written).all()
+    finally:
+        shutil.rmtree(directory)
@@ -14,3 +14,89 @@ def test_recombine():
     assert len(n) == len(m)
     assert type(n) == type(a) == type(b)
     assert_raises(ValueError, recombine, None, None, None)
+
+
+def test_crossover_indices():
+    from pydigree.recombination import crossover_indices
+    np.random.seed(0)
+    m = np.linspace(0, 300, 1000)
+    breaks, offsets, first = crossover_indices(m, 2000)
+    assert offsets.shape[0] == 2001 and offsets[0] == 0
+    assert offsets[-1] == breaks.shape[0]
+    assert first.shape[0] == 2000 and set(first.tolist()) <= {0, 1}
+    assert ((breaks >= 0) & (breaks < 1000)).all()
+    for lo, hi in zip(offsets[:-1], offsets[1:]):
+        assert (np.diff(breaks[lo:hi]) >= 0).all()
+    # 3 Morgans gives 3 crossovers on average
+    assert abs(breaks.shape[0] / 2000.0 - 3) < 0.2
+
+
+def test_recombine_many():
+    from pydigree.recombination import recombine_many
+    from pydigree.genotypes import SparseAlleles
+    np.random.seed(0)
+    m = np.linspace(0, 200, 500)
+    a = [Alleles(np.ones(500, dtype=np.int8)) for _ in range(100)]
+    b = [Alleles(2 * np.ones(500, dtype=np.int8)) for _ in range(100)]
+
+    gametes = recombine_many(a, b, m)
+    assert len(gametes) == 100
+    assert all(type(g) is Alleles and g.shape == (500,) for g in gametes)
+    mat = np.array(gametes)
+    assert set(np.unique(mat).tolist()) == {1, 2}
+    # Both parental chromatids are passed on about equally often
+    assert abs((mat == 2).mean() - 0.5) < 0.1
+
+    sa = [SparseAlleles(np.zeros(500, dtype=np.int8)) for _ in range(10)]
+    sb = [SparseAlleles(np.ones(500, dtype=np.int8)) for _ in range(10)]
+    sparse = recombine_many(sa, sb, m)
+    assert all(type(g) is SparseAlleles for g in sparse)
+    assert all(set(np.unique(g.todense()).tolist()) <= {0, 1} 
+               for g in sparse)
+
+    assert recombine_many([], [], m) == []
+
+    # Text alleles of different widths aren't truncated
+    gm = np.linspace(0, 300, 4)
+    a1, a2 = Alleles(['A', 'C', 'G', 'T']), Alleles(['A', 'C', 'G', 'T'])
+    b1, b2 = Alleles(['AT', 'C', 'G', 'T']), Alleles(['AT', 'C', 'G', 'T'])
+    for _ in range(20):
+        text = recombine_many([a1, b1], [a2, b2], gm)
+        assert text[1].tolist() == ['AT', 'C', 'G', 'T']
+        assert text[0].tolist() == ['A', 'C', 'G', 'T']
+
+    # Chromatids of different integer types are recombined one at a time
+    c = Alleles(np.zeros(500, dtype=np.uint8))
+    mixed = recombine_many([a[0], c], [b[0], c], m)
+    assert [x.dtype for x in mixed] == [np.int8, np.uint8]
+    assert set(np.unique(mixed[0]).tolist()) <= {1, 2}
+    assert_raises(ValueError, recombine_many, a[:2], sb[:2], m)
+    assert_raises(ValueError, recombine_many, a[:2], b[:1], m)
+
+
+def test_crossover_mask():
+    from pydigree.recombination import crossover_mask
+    np.random.seed(0)
+    mask = crossover_mask(np.linspace(0, 100, 50), 1000)
+    assert mask.shape == (1000, 50) and mask.dtype == np.bool_
+    assert abs(mask.mean() - 0.5) < 0.05
+    # Neighbouring markers are 2cM apart, so they rarely switch
+    assert (mask[:, 1:] != mask[:, :-1]).mean() < 0.05
+    assert crossover_mask([0], 10).shape == (10, 1)
+
+
+def test_recombine_labelled():
+    from pydigree.recombination import recombine_many
+    from pydigree.genotypes import LabelledAlleles
+    np.random.seed(0)
+    m = np.linspace(0, 300, 50)
+    a = LabelledAlleles.founder_chromosome('x', 0, 0, nmark=50)
+    b = LabelledAlleles.founder_chromosome('x', 0, 1, nmark=50)
+
+    gametes = [recombine(a, b, m)] + recombine_many([a] * 20, [b] * 20, m)
+    assert all(type(g) is LabelledAlleles and g.nmark == 50
+               for g in gametes)
+    haps = np.array([[g[i].haplotype for i in range(50)] for g in gametes])
+    assert set(np.unique(haps).tolist()) == {0, 1}
+    # 3 Morgans makes crossovers likely
+    assert (haps[:, 1:] != haps[:, :-1]).any()
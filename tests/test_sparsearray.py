@@ -1,6 +1,6 @@
 import numpy as np
-from nose.tools import assert_almost_equal
-from pydigree.cydigree.sparsearray import SparseArray
+from nose.tools import assert_almost_equal, assert_raises
+from pydigree.cydigree.sparsearray import SparseArray, FrozenSparseArray
 
 
 def test_setitem():
@@ -212,3 +212,167 @@ def test_copy():
     assert a.tolist() == b.tolist()
     a[1] = 1
     assert a.tolist() != b.tolist()
+
+def test_frozen():
+    a = SparseArray.from_items([(1,2), (5,3), (7,1)], 10, 0)
+    f = a.freeze()
+    assert type(f) is FrozenSparseArray
+    assert f.tolist() == a.tolist()
+    assert f.keys() == [1, 5, 7]
+    assert f.values() == [2, 3, 1]
+    assert f.ndense() == 3
+    assert f[5] == 3 and f[6] == 0 and f[0] == 0 and f[9] == 0
+
+    # Slices and fancy indexing stay frozen
+    assert type(f[4:8]) is FrozenSparseArray
+    assert f[4:8].tolist() == [0, 3, 0, 1]
+    assert f[(7, 1)].tolist() == [1, 2]
+
+    assert_raises(TypeError, f.__setitem__, 0, 1)
+
+    # Round trip
+    t = f.thaw()
+    assert type(t) is SparseArray
+    assert t.items() == a.items()
+    t[0] = 1
+    assert f[0] == 0
+
+def test_frozen_cmp():
+    a = FrozenSparseArray.from_dense([0, 1, 0, 2, 0], 0)
+    b = FrozenSparseArray.from_dense([0, 1, 1, 0, 0], 0)
+    assert (a == b).tolist() == [True, True, False, False, True]
+    assert (a != b).tolist() == [False, False, True, True, False]
+    assert (a == b.thaw()).tolist() == [True, True, False, False, True]
+    assert (a.thaw() == b).tolist() == [True, True, False, False, True]
+    assert (a == 0).tolist() == [True, False, True, False, True]
+    assert (a > 0).tolist() == [False, True, False, True, False]
+    assert (a == [0, 1, 0, 0, 0]).tolist() == [True, True, True, False, True]
+    assert (a == 0).logical_not().tolist() == [False, True, False, True, False]
+
+    # Copying slices from a frozen array into a mutable one
+    s = SparseArray(5, 0)
+    s[1:4] = a[1:4]
+    assert s.tolist() == [0, 1, 0, 2, 0]
+
+def test_setslice_bounds():
+    # Slice assignment shouldn't touch the site at the end of the slice
+    s = SparseArray.from_dense([1, 1, 1, 1, 1], 0)
+    s[1:3] = SparseArray(5, 0)[1:3]
+    assert s.tolist() == [1, 0, 0, 1, 1]
+
+    s = SparseArray.from_dense([0, 0, 0, 0, 0], 0)
+    s[1:3] = SparseArray.from_dense([2, 2, 3, 2, 2], 2)[1:3]
+    assert s.tolist() == [0, 2, 3, 0, 0]
+
+    f = FrozenSparseArray.from_dense([2, 2, 3, 2, 2], 2)
+    s[2:5] = f[2:5]
+    assert s.tolist() == [0, 2, 3, 2, 2]
+
+def test_inttree_sparsearray_setslice():
+    from pydigree.cydigree.datastructures import SparseArray as TreeSparseArray
+    s = TreeSparseArray.from_dense([1, 1, 1, 1, 1, 1], 0)
+    t = TreeSparseArray.from_dense([0, 2, 0, 2, 0, 2], 0)
+    s[1:4] = t[1:4]
+    assert s.tolist() == [1, 2, 0, 2, 1, 1]
+
+    t = TreeSparseArray.from_dense([3, 3, 3, 3, 3, 3], 3)
+    s[0:2] = t[0:2]
+    assert s.tolist() == [3, 3, 0, 2, 1, 1]
+
+def test_missing_index():
+    s = SparseArray.from_dense([0, -1, 1, -1, 0, 0, -1], 0)
+    assert s.missing_indices().tolist() == [1, 3, 6]
+    assert s.missing_count(0, 7) == 3
+    assert s.missing_count(2, 6) == 1
+
+    s[1] = 2
+    s[4] = -1
+    s[3] = 0
+    assert s.missing_indices().tolist() == [4, 6]
+
+    s[5:7] = SparseArray.from_dense([-1, 1], 0)
+    assert s.missing_indices().tolist() == [4, 5]
+    assert s.copy().missing_indices().tolist() == [4, 5]
+    assert s[3:6].missing_indices().tolist() == [1, 2]
+
+    f = s.freeze()
+    assert f.missing_indices().tolist() == [4, 5]
+    assert f.missing_count(5, 7) == 1
+    assert f.thaw().missing_indices().tolist() == [4, 5]
+
+    f = FrozenSparseArray.from_dense([0, -1, 2, -1], 0)
+    assert f.missing_indices().tolist() == [1, 3]
+    assert f.missing_count(0, 2) == 1
+
+    # All the sparse sites are missing 
+    s = SparseArray.from_dense([-1, -1, 1, -1], -1)
+    assert s.missing_indices().tolist() == [0, 1, 3]
+    assert s.missing_count(1, 4) == 2
+    assert s.freeze().missing_count(1, 4) == 2
+
+def test_pickle():
+    import pickle
+    from pydigree.cydigree.datastructures import SparseArray as TreeSparseArray
+
+    s = SparseArray.from_dense([0, 1, -1, 0, 2], 0)
+    copied = pickle.loads(pickle.dumps(s))
+    assert copied.tolist() == [0, 1, -1, 0, 2]
+    assert copied.missing_indices().tolist() == [2]
+
+    f = pickle.loads(pickle.dumps(s.freeze()))
+    assert type(f) is FrozenSparseArray
+    assert f.tolist() == [0, 1, -1, 0, 2]
+
+    t = TreeSparseArray.from_dense([0, 1, -1, 0, 2], 0)
+    assert pickle.loads(pickle.dumps(t)).tolist() == [0, 1, -1, 0, 2]
+
+def test_frozen_views():
+    f = FrozenSparseArray.from_dense([0, 1, -1, 0, 2], 0)
+    keys = f.keys_view()
+    values = f.values_view()
+    assert keys.dtype == np.uint32 and values.dtype == np.int8
+    assert keys.tolist() == [1, 2, 4]
+    assert values.tolist() == [1, -1, 2]
+    assert not keys.flags.writeable
+
+    # The view keeps the array alive
+    del f
+    assert keys.tolist() == [1, 2, 4]
+
+def test_inttree_sparsearray_large_logic():
+    from pydigree.cydigree.datastructures import SparseArray as TreeSparseArray
+    np.random.seed(10)
+    a = np.random.randint(0, 2, 2000)
+    sa = TreeSparseArray.from_dense(list(a), 0)
+    assert sa.logical_not().tolist() == list(a == 0)
+
+    b = np.random.randint(0, 3, 2000)
+    sb = TreeSparseArray.from_dense(list(b), 0)
+    assert (sa == sb).tolist() == list(a == b)
+    assert (sa != sb).tolist() == list(a != b)
+    assert sa[100:600].tolist() == list(a[100:600])
+
+def test_numpy_export():
+    from pydigree.cydigree.datastructures import SparseArray as TreeSparseArray
+    dense = [0, 1, -1, 0, 2, 0]
+    arrays = [SparseArray.from_dense(dense, 0), 
+              FrozenSparseArray.from_dense(dense, 0),
+              TreeSparseArray.from_dense(dense, 0)]
+
+    for s in arrays:
+        assert s.keys_array().dtype == np.uint32
+        assert s.keys_array().tolist() == [1, 2, 4]
+        assert s.values_array().dtype == np.int8
+        assert s.values_array().tolist() == [1, -1, 2]
+
+        assert s.to_numpy().dtype == np.int8
+        assert s.to_numpy().tolist() == dense
+        assert s.to_numpy(start=2, stop=5).tolist() == [-1, 0, 2]
+
+        mat = np.full((2, 6), 9, dtype=np.int8)
+        s.to_numpy(out=mat[1])
+        assert mat[1].tolist() == dense
+        assert mat[0].tolist() == [9] * 6
+
+        assert_raises(ValueError, s.to_numpy, np.zeros(3, dtype=np.int8))
+        assert_raises(IndexError, s.to_numpy, None, 4, 7)
@@ -40,3 +40,35 @@ def test_vcf_allele_parser():
     observed = vcf_allele_parser(a, format)
     assert observed.tolist() == expected
 
+def test_vcf_freeze():
+    testvcf = os.path.join(TESTDATA_DIR, 'test.vcf')
+    pop = read_vcf(testvcf, freeze=True)
+    chromatid = pop['NA00001'].genotypes[1][1]
+    assert chromatid.frozen
+    assert (chromatid.todense() == np.array([0, 0, 2, 0, 1, 1, 1])).all()
+
+def test_vcf_matrix():
+    testvcf = os.path.join(TESTDATA_DIR, 'test.vcf')
+    pop = read_vcf(testvcf, matrix=True)
+    expected = read_vcf(testvcf)
+
+    assert len(pop.haplotype_matrices) == 2
+    for ind in expected.individuals:
+        for chromidx in range(2):
+            for hap in range(2):
+                a = pop[ind.label].genotypes[chromidx][hap]
+                b = ind.genotypes[chromidx][hap]
+                assert a.frozen
+                assert (a.todense() == b.todense()).all()
+
+    mat = pop.haplotype_matrices[1]
+    assert mat.nhaplotypes == 6
+    assert mat.todense()[:, 0].tolist() == [0, 0, 1, 0, 0, 0, 1]
+    assert mat.allele_counts(2).tolist()[2] == 4
+    assert mat.carriers(1).tolist() == [3]
+
+    # Writing to a chromatid leaves the matrix alone
+    chromatid = pop['NA00001'].genotypes[1][0]
+    chromatid[0] = 3
+    assert chromatid[0] == 3 and not chromatid.frozen
+    assert mat.todense()[0, 0] == 0